@@ -0,0 +1,319 @@
+"""Times each stage of the feature pipeline on a synthetic topic.
+
+Generates a topic with make_synthetic, loads it into an in-memory storage,
+or into a scratch MongoDB database with --mongo, and runs the stages of
+make_features one after the other: user attributes, event table, follow
+graph, per-user features and edge features. Each stage reports its
+throughput, the database calls it made per item and its peak RSS.
+
+Database calls are collection method calls for the in-memory storage and
+commands sent to the server, including cursor getMores, for MongoDB. Peak RSS
+is per stage on Linux and since the process started elsewhere.
+
+Reports can be saved and compared with a baseline to catch regressions
+before a long production run:
+
+    python -m indiff.benchmarks.pipeline --n-users 2000 --output base.json
+    python -m indiff.benchmarks.pipeline --n-users 2000 --baseline base.json
+"""
+
+import json
+import resource
+import sys
+import time
+
+import click
+import pymongo
+from pymongo import monitoring
+
+from indiff import utils
+from indiff.cache import UserAttribsCache, configure_text_cache
+from indiff.data import make_features
+from indiff.data.make_synthetic import KEYWORDS, generate_topic, load_topic
+from indiff.features import build_features
+from indiff.features.follow_graph import FollowGraph
+from indiff.features.user_features import (compute_user_feature_matrix,
+                                           user_feature_rows)
+from indiff.storage import MemoryStorage, MongoStorage
+
+TOPIC = 'synthetic'
+
+# scratch database the --mongo benchmark loads the topic into
+BENCHMARK_DB_NAME = 'indiff_benchmark'
+
+
+def reset_peak_rss():
+    """ Resets the process's peak RSS, which Linux allows through
+    /proc/self/clear_refs. Returns False where the peak cannot be reset. """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss():
+    """ Peak resident set size of the process in bytes, since the last
+    reset_peak_rss where supported """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class CommandCounter(monitoring.CommandListener):
+    """ Counts the commands a MongoClient sends """
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def started(self, event):
+        self.n_calls += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# the indexes indiff.data.create_indices builds on the real database
+INDEXES = {'': ('id', 'author_id'), '-users': ('id', 'username'),
+           '-retweets': ('id_str', 'user.id_str'),
+           '-replies': ('author_id', 'user.id_str'),
+           '-event_tweets': ('id', 'author_id')}
+
+
+def create_indexes(storage, topic):
+    for suffix, fields in INDEXES.items():
+        for field in fields:
+            storage[topic + suffix].create_index(field)
+
+
+def measure(name, run, n_items, unit, db_calls):
+    """Runs a stage and measures it.
+
+    Arguments:
+        name {str} -- stage name
+        run {callable} -- runs the stage, returning its result
+        n_items {int} -- items the stage processes
+        unit {str} -- what an item is
+        db_calls {callable} -- returns the number of database calls so far
+
+    Returns:
+        dict, object -- stage report and the stage's result
+    """
+    reset_peak_rss()
+    calls = db_calls()
+    start = time.perf_counter()
+    result = run()
+    seconds = time.perf_counter() - start
+    calls = db_calls() - calls
+
+    report = {'stage': name, 'unit': unit, 'items': n_items,
+              'seconds': seconds,
+              'rate': n_items / seconds if seconds else float('inf'),
+              'db_calls': calls,
+              'calls_per_item': calls / n_items if n_items else 0.0,
+              'peak_rss': peak_rss()}
+    print(f'{name:>14}: {report["rate"]:12.1f} {unit}/sec '
+          f'{report["calls_per_item"]:8.2f} calls/{unit} '
+          f'peak RSS {report["peak_rss"] / 2 ** 20:8.1f} MB '
+          f'({seconds:.2f}s for {n_items} {unit})')
+    return report, result
+
+
+def run_pipeline(storage, topic, network, keywords, db_calls, n_edges=0):
+    """Runs the stages of make_features on a loaded topic.
+
+    Arguments:
+        storage {object} -- MemoryStorage or MongoStorage holding the topic
+        topic {str} -- topic name
+        network {DiGraph} -- the topic's network
+        keywords {set} -- topic keywords
+        db_calls {callable} -- returns the number of database calls so far
+
+    Keyword Arguments:
+        n_edges {int} -- edges whose features are computed, 0 for all
+        (default: {0})
+
+    Returns:
+        list -- report of each stage
+    """
+    collection = lambda suffix: storage[topic + suffix]
+    user_ids = list(network.nodes)
+    edges = list(network.edges)
+    if n_edges:
+        edges = edges[:n_edges]
+
+    reports = []
+
+    def user_attribs():
+        make_features.process_user_attribs(
+            users=user_ids, tweet_collection=collection(''),
+            event_collection=collection('-event_tweets'),
+            tweet_mentions_collection=collection('-mentions'),
+            users_collection=collection('-users'),
+            retweet_collection=collection('-retweets'),
+            replies_collection=collection('-replies'),
+            user_attribs_collection=collection('-user-attribs'),
+            responses_collection=collection('-responses'))
+
+    report, _ = measure('user_attribs', user_attribs, len(user_ids),
+                        'users', db_calls)
+    reports.append(report)
+
+    def event_table():
+        make_features.process_event_table(collection('-event_tweets'),
+                                          collection('-event-table'))
+        return build_features.load_event_table(collection('-event-table'))
+
+    report, event_table = measure('event_table', event_table, len(user_ids),
+                                  'users', db_calls)
+    reports.append(report)
+
+    report, follow_graph = measure(
+        'follow_graph',
+        lambda: FollowGraph.from_users(collection('-users')),
+        len(user_ids), 'users', db_calls)
+    reports.append(report)
+
+    report, user_features = measure(
+        'user_features',
+        lambda: user_feature_rows(compute_user_feature_matrix(
+            collection('-user-attribs'), keywords, user_ids=user_ids)),
+        len(user_ids), 'users', db_calls)
+    reports.append(report)
+
+    def edge_features():
+        collections = make_features.edge_collections(
+            storage, storage, topic,
+            node_collection=UserAttribsCache(collection('-user-attribs')))
+        rows = make_features.edge_chunk_rows(
+            edges, keywords, collections, user_features,
+            event_table=event_table, follow_graph=follow_graph)
+        return sum(1 for _ in rows)
+
+    report, _ = measure('edges', edge_features, len(edges), 'edges',
+                        db_calls)
+    reports.append(report)
+
+    return reports
+
+
+def regressions(reports, baseline, tolerance):
+    """ Describes every stage slower, or making more database calls per
+    item, than in the baseline by more than tolerance """
+    found = []
+    baseline = {report['stage']: report for report in baseline}
+    for report in reports:
+        base = baseline.get(report['stage'])
+        if base is None:
+            continue
+        if report['rate'] < base['rate'] * (1 - tolerance):
+            found.append(f'{report["stage"]}: {report["rate"]:.1f} '
+                         f'{report["unit"]}/sec, baseline '
+                         f'{base["rate"]:.1f}')
+        if report['calls_per_item'] > \
+                base['calls_per_item'] * (1 + tolerance):
+            found.append(f'{report["stage"]}: '
+                         f'{report["calls_per_item"]:.2f} calls/'
+                         f'{report["unit"]}, baseline '
+                         f'{base["calls_per_item"]:.2f}')
+    return found
+
+
+@click.command()
+@click.option('--n-users', default=1000, show_default=True,
+              help='Users of the synthetic topic.')
+@click.option('--tweets-per-user', default=20, show_default=True,
+              help='Mean number of tweets per user.')
+@click.option('--avg-following', default=20, show_default=True,
+              help='Mean number of accounts a user follows.')
+@click.option('--n-edges', default=0, show_default=True,
+              help='Edges whose features are computed, 0 for all.')
+@click.option('--seed', default=0, show_default=True, help='Random seed.')
+@click.option('--sentiment-engine', type=click.Choice(utils.SENTIMENT_ENGINES),
+              default='textblob', show_default=True,
+              help='Sentiment engine used for tweets.')
+@click.option('--mongo', is_flag=True,
+              help=f'Run on MongoDB, in the {BENCHMARK_DB_NAME} database, '
+                   'instead of in memory.')
+@click.option('--output', default=None, type=click.Path(dir_okay=False),
+              help='JSON file the stage reports are written to.')
+@click.option('--baseline', default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Reports of an earlier run; exits with an error if a '
+                   'stage regressed.')
+@click.option('--tolerance', default=0.2, show_default=True,
+              help='Slowdown, or increase in calls per item, allowed '
+                   'against the baseline.')
+def main(n_users, tweets_per_user, avg_following, n_edges, seed,
+         sentiment_engine, mongo, output, baseline, tolerance):
+    """ Benchmarks the feature pipeline on a synthetic topic
+    """
+    utils.set_sentiment_engine(sentiment_engine)
+    text_cache = configure_text_cache()
+
+    start = time.perf_counter()
+    collections, network = generate_topic(
+        n_users=n_users, tweets_per_user=tweets_per_user,
+        avg_following=avg_following, seed=seed)
+    print(f'generated {n_users} users, '
+          f'{len(collections[""])} tweets and '
+          f'{network.number_of_edges()} edges '
+          f'in {time.perf_counter() - start:.2f}s')
+
+    if mongo:
+        counter = CommandCounter()
+        client = pymongo.MongoClient(host='localhost', port=27017,
+                                     appname=__file__,
+                                     event_listeners=[counter])
+        storage = MongoStorage(client[BENCHMARK_DB_NAME], client=client)
+        for name in storage.list_collection_names():
+            if name == TOPIC or name.startswith(TOPIC + '-'):
+                storage[name].drop()
+        db_calls = lambda: counter.n_calls
+    else:
+        storage = MemoryStorage()
+        db_calls = lambda: storage.n_calls
+
+    keywords = utils.keyword_extractor().extract_many(KEYWORDS)
+    keywords = set(keyword for line in keywords for keyword in line)
+
+    try:
+        load_topic(storage, TOPIC, collections)
+        create_indexes(storage, TOPIC)
+        reports = run_pipeline(storage, TOPIC, network, keywords, db_calls,
+                               n_edges=n_edges)
+    finally:
+        text_cache.close()
+        storage.close()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'n_users': n_users, 'tweets_per_user': tweets_per_user,
+                       'avg_following': avg_following, 'n_edges': n_edges,
+                       'seed': seed, 'mongo': mongo, 'stages': reports},
+                      f, indent=2)
+
+    if baseline:
+        with open(baseline) as f:
+            found = regressions(reports, json.load(f)['stages'], tolerance)
+        for regression in found:
+            print('regression:', regression)
+        if found:
+            sys.exit(1)
+        print('no regressions')
+
+
+if __name__ == '__main__':
+    main()
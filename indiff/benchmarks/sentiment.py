@@ -0,0 +1,101 @@
+"""Compares the TextBlob and batch lexicon sentiment engines.
+
+Reports tweets/sec for each engine and how many labels agree, either on the
+texts of a file (one tweet per line) or on generated tweets.
+
+    python -m indiff.benchmarks.sentiment --n-tweets 20000
+"""
+
+import random
+import time
+
+import click
+
+from indiff import utils
+from indiff.lexicon import NEGATIONS, default_lexicon_path, load_lexicon
+
+FILLER_WORDS = ['the', 'a', 'is', 'it', 'this', 'day', 'event', 'today',
+                'rt', '@someone', 'http://t.co/abc', '#anniversary', '!']
+
+
+def generate_tweets(n_tweets, seed=0):
+    """Generates tweet-like texts mixing lexicon words, negations, modifiers
+    and filler words
+
+    Arguments:
+        n_tweets {int} -- number of texts
+
+    Keyword Arguments:
+        seed {int} -- random seed (default: {0})
+
+    Returns:
+        list -- generated texts
+    """
+    rng = random.Random(seed)
+    lexicon_words = list(load_lexicon(default_lexicon_path()))
+    other_words = FILLER_WORDS + sorted(NEGATIONS)
+
+    tweets = []
+    for _ in range(n_tweets):
+        n_words = rng.randint(3, 25)
+        words = [rng.choice(lexicon_words) if rng.random() < 0.3
+                 else rng.choice(other_words) for _ in range(n_words)]
+        tweets.append(' '.join(words))
+
+    return tweets
+
+
+def time_engine(engine, tweets, batch_size):
+    """Scores tweets with an engine in batches
+
+    Returns:
+        float, ndarray -- elapsed seconds and labels
+    """
+    utils.set_sentiment_engine(engine)
+    if engine == 'lexicon':
+        # exclude the one-off lexicon load from the timing
+        utils.lexicon_sentiment()
+
+    labels = []
+    start = time.perf_counter()
+    for i in range(0, len(tweets), batch_size):
+        polarities = utils.sentiment_polarities(tweets[i:i + batch_size])
+        labels.extend(utils.sentiment_labels(polarities))
+    elapsed = time.perf_counter() - start
+
+    return elapsed, labels
+
+
+@click.command()
+@click.option('--texts-file', type=click.Path(exists=True), default=None,
+              help='File with one tweet text per line.')
+@click.option('--n-tweets', default=10000, show_default=True,
+              help='Number of tweets to generate without --texts-file.')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Tweets scored per call.')
+def main(texts_file, n_tweets, batch_size):
+    """ Benchmarks the sentiment engines
+    """
+    if texts_file:
+        with open(texts_file, 'r') as f:
+            tweets = [line.rstrip('\n') for line in f]
+    else:
+        tweets = generate_tweets(n_tweets)
+
+    results = {}
+    for engine in utils.SENTIMENT_ENGINES:
+        results[engine] = time_engine(engine, tweets, batch_size)
+
+    for engine, (elapsed, _) in results.items():
+        print(f'{engine:>10}: {len(tweets) / elapsed:12.1f} tweets/sec '
+              f'({elapsed:.2f}s for {len(tweets)} tweets)')
+
+    baseline = results['textblob'][1]
+    lexicon = results['lexicon'][1]
+    agree = sum(1 for a, b in zip(baseline, lexicon) if a == b)
+    print(f'label agreement: {agree}/{len(tweets)}')
+    print(f'speedup: {results["textblob"][0] / results["lexicon"][0]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""Module contains in-memory caches shared across a feature run.
+"""
+
+import hashlib
+import logging
+import os
+import sys
+from collections import OrderedDict
+
+from sqlitedict import SqliteDict
+
+from indiff import utils
+
+
+def sizeof(obj):
+    """Approximates the memory used by a document in bytes.
+
+    Follows dicts, lists, tuples and sets; everything else is measured with
+    sys.getsizeof.
+
+    Arguments:
+        obj {object} -- document or value to measure
+
+    Returns:
+        int -- approximate size in bytes
+    """
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        size += sum(sizeof(key) + sizeof(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item) for item in obj)
+
+    return size
+
+
+class LRUCache(object):
+    """Least recently used cache bounded by entry count and memory.
+
+    Keyword Arguments:
+        maxsize {int} -- maximum number of entries (default: {10000})
+        max_bytes {int} -- approximate memory cap in bytes, None for no cap
+        (default: {None})
+    """
+
+    def __init__(self, maxsize=10000, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Returns the cached value for key and marks it as recently used"""
+        try:
+            value, _ = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores value under key, evicting the least recently used entries
+        until both the entry and memory caps are satisfied"""
+        if key in self._entries:
+            _, old_size = self._entries.pop(key)
+            self.nbytes -= old_size
+
+        size = sizeof(value) if self.max_bytes is not None else 0
+        self._entries[key] = (value, size)
+        self.nbytes += size
+
+        while self._entries and (
+                len(self._entries) > self.maxsize or
+                (self.max_bytes is not None and
+                 self.nbytes > self.max_bytes and len(self._entries) > 1)):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0
+        return self.hits / lookups
+
+    def stats(self):
+        """Returns counters describing how the cache has been used"""
+        return {'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'nbytes': self.nbytes,
+                'hit_rate': self.hit_rate}
+
+
+class UserAttribsCache(object):
+    """Read-through cache over the user attributes collection.
+
+    Lookups of the form find_one({'_id': user_id}) are served from an LRU
+    cache so that each user document is fetched once per run. Any other
+    query, and every other collection method, is passed through to the
+    wrapped collection.
+
+    Cached documents are shared between callers and must not be modified.
+
+    Arguments:
+        collection {collection} -- user attributes collection
+
+    Keyword Arguments:
+        maxsize {int} -- maximum number of cached users (default: {50000})
+        max_bytes {int} -- approximate memory cap in bytes
+        (default: {1024 ** 3})
+    """
+
+    def __init__(self, collection, maxsize=50000, max_bytes=1024 ** 3):
+        self.collection = collection
+        self.cache = LRUCache(maxsize=maxsize, max_bytes=max_bytes)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        if args or kwargs or not isinstance(filter, dict) or \
+                list(filter) != ['_id']:
+            return self.collection.find_one(filter, *args, **kwargs)
+
+        user_id = filter['_id']
+        attr = self.cache.get(user_id)
+        if attr is None:
+            attr = self.collection.find_one(filter)
+            if attr is not None:
+                self.cache.put(user_id, attr)
+
+        return attr
+
+    def log_stats(self, logger=None):
+        logger = logger or logging.getLogger(__name__)
+        stats = self.cache.stats()
+        logger.info('user attribute cache: {entries} users, {hits} hits, '
+                    '{misses} misses, {evictions} evictions, '
+                    '{nbytes} bytes'.format(**stats))
+
+
+class TextCache(object):
+    """Content-addressed cache of per-text results.
+
+    Tweets with identical text, such as retweets, share one cache entry
+    keyed by a hash of the whitespace-normalised text, so their sentiment
+    label and keywords are computed once. Entries live in an in-memory LRU
+    and, when a path is given, in an SQLite file that persists across runs.
+
+    The SQLite connection is served by a thread of the process that opened
+    it, so a forked process cannot use it and must configure its own cache.
+
+    Keyword Arguments:
+        maxsize {int} -- maximum number of in-memory entries
+        (default: {200000})
+        path {str} -- SQLite file for the on-disk tier, None to keep entries
+        in memory only (default: {None})
+        commit_every {int} -- on-disk writes between commits
+        (default: {1000})
+        read_only {bool} -- only read the on-disk tier, keeping new entries
+        in memory (default: {False})
+    """
+
+    def __init__(self, maxsize=200000, path=None, commit_every=1000,
+                 read_only=False):
+        self.memory = LRUCache(maxsize=maxsize)
+        self.path = path
+        self.read_only = read_only
+        self.disk = None
+        if path is not None:
+            self.disk = SqliteDict(path, tablename='text-cache',
+                                   flag='r' if read_only else 'c')
+        self._pid = os.getpid()
+        self.commit_every = commit_every
+        self._pending = 0
+
+    @staticmethod
+    def key(namespace, text):
+        normalised = ' '.join(text.split())
+        digest = hashlib.sha1(normalised.encode('utf-8')).hexdigest()
+        return f'{namespace}:{digest}'
+
+    def get_or_compute(self, namespace, text, compute):
+        """Returns the cached result for text, computing and storing it on a
+        miss
+
+        Arguments:
+            namespace {str} -- kind of result, part of the key
+            text {str} -- text the result is derived from
+            compute {callable} -- computes the result from the text
+        """
+        key = self.key(namespace, text)
+
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+
+        if value is None:
+            value = compute(text)
+            if self.disk is not None and not self.read_only:
+                self.disk[key] = value
+                self._pending += 1
+                if self._pending >= self.commit_every:
+                    self.commit()
+
+        self.memory.put(key, value)
+        return value
+
+    def sentiment(self, text):
+        """Sentiment label of text with the current sentiment engine"""
+        namespace = 'sentiment-' + utils.get_sentiment_engine()
+        return self.get_or_compute(namespace, text, utils.sentiment)
+
+    def keywords(self, text):
+        """Keywords of text, as utils.split_text"""
+        namespace = 'keywords-' + utils.keyword_extractor().version
+        return list(self.get_or_compute(namespace, text, utils.split_text))
+
+    def commit(self):
+        if self.disk is not None and self._pending:
+            self.disk.commit()
+        self._pending = 0
+
+    def close(self):
+        # a forked copy drops the parent's connection without using it
+        if self.disk is not None and os.getpid() == self._pid:
+            self.commit()
+            self.disk.close()
+        self.disk = None
+
+    def log_stats(self, logger=None):
+        logger = logger or logging.getLogger(__name__)
+        stats = self.memory.stats()
+        logger.info('text cache: {entries} texts, {hits} hits, '
+                    '{misses} misses'.format(**stats))
+
+
+_text_cache = TextCache()
+
+
+def get_text_cache():
+    """Returns the text cache shared by every Tweet"""
+    return _text_cache
+
+
+def configure_text_cache(maxsize=200000, path=None, read_only=False):
+    """Replaces the shared text cache, e.g. to add an on-disk tier
+
+    Keyword Arguments:
+        maxsize {int} -- maximum number of in-memory entries
+        (default: {200000})
+        path {str} -- SQLite file for the on-disk tier (default: {None})
+        read_only {bool} -- only read the on-disk tier (default: {False})
+
+    Returns:
+        TextCache -- the new shared cache
+    """
+    global _text_cache
+
+    _text_cache.close()
+    _text_cache = TextCache(maxsize=maxsize, path=path, read_only=read_only)
+    return _text_cache
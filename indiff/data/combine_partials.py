@@ -1,24 +1,247 @@
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+
 import click
+import numpy as np
 import pandas as pd
-import os
+import pyarrow.parquet as pq
+
+from indiff.data.feature_sink import ID_COLUMNS, ParquetFeatureSink
+
+PARTIAL_PATTERNS = ('*.h5', '*.parquet')
+
+# HDF tables store strings in fixed-width columns sized on the first append
+HDF_MIN_ITEMSIZE = {'src_id': 32, 'dest_id': 32}
+HDF_STRING_ITEMSIZE = 1024
+
+
+def partial_files(folder):
+    """ Dataset files in folder, in chunk number order """
+    def number(path):
+        found = re.search(r'\d+', path.stem)
+        return (int(found.group()) if found else -1, path.name)
+
+    paths = set()
+    for pattern in PARTIAL_PATTERNS:
+        paths.update(Path(folder).glob(pattern))
+    return sorted(paths, key=number)
+
+
+def read_partial(path, columns=None):
+    """ Reads a dataset file written by make_features
+
+    Arguments:
+        path {Path} -- HDF or Parquet dataset file
+
+    Keyword Arguments:
+        columns {list} -- columns to read, None for all (default: {None})
+
+    Returns:
+        DataFrame -- the file's rows
+    """
+    if Path(path).suffix == '.parquet':
+        return pq.read_table(path, columns=columns).to_pandas()
+
+    df = pd.read_hdf(path)
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+def read_partials(paths, columns=None, workers=4):
+    """Reads dataset files on worker threads, yielding them in order.
+
+    At most workers files are read ahead of the one being consumed, so
+    memory stays flat however many partials there are.
+
+    Arguments:
+        paths {list} -- dataset files
+
+    Keyword Arguments:
+        columns {list} -- columns to read, None for all (default: {None})
+        workers {int} -- files read at once (default: {4})
+
+    Yields:
+        tuple -- path and DataFrame of each file
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append((path, executor.submit(read_partial, path,
+                                                  columns)))
+            if len(pending) > workers:
+                path, future = pending.popleft()
+                yield path, future.result()
+
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+
+class HDFTableWriter(object):
+    """Appends DataFrames to one table of an HDF file.
+
+    Like ParquetFeatureSink, the file is written under a temporary name and
+    only renamed to path once closed.
+
+    Arguments:
+        path {str} -- HDF file written
+
+    Keyword Arguments:
+        key {str} -- table key (default: {'dataset'})
+    """
+
+    def __init__(self, path, key='dataset'):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.key = key
+        self.store = pd.HDFStore(self.tmp_path, mode='w')
+        self.dtypes = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_frame(self, df):
+        # categorical ids from Parquet partials are stored as plain strings
+        df = df.copy()
+        min_itemsize = {}
+        for name in df.columns:
+            if isinstance(df[name].dtype, pd.CategoricalDtype):
+                df[name] = df[name].astype(str)
+            if df[name].dtype == object:
+                min_itemsize[name] = HDF_MIN_ITEMSIZE.get(
+                    name, HDF_STRING_ITEMSIZE)
+
+        # the table's column types are fixed by the first frame, while HDF
+        # and Parquet partials store numbers with different widths
+        if self.dtypes is None:
+            self.dtypes = df.dtypes
+        else:
+            df = df.astype(self.dtypes)
+        self.store.append(self.key, df, format='table', index=False,
+                          min_itemsize=min_itemsize or None)
+
+    def close(self):
+        self.store.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """ Discards the partly written file """
+        self.store.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def edge_hashes(df):
+    """ 64-bit hash of the (src_id, dest_id) edge of each row. Two of 100
+    million distinct edges collide with a probability under 1/3000. """
+    ids = df[list(ID_COLUMNS)].astype(str)
+    return pd.util.hash_pandas_object(ids, index=False).to_numpy()
+
+
+def combine(partials, writer, query=None, columns=None, dedupe=True):
+    """Appends partials to a writer one at a time.
+
+    Arguments:
+        partials {iterable} -- (path, DataFrame) pairs, see read_partials
+        writer {object} -- HDFTableWriter or ParquetFeatureSink
+
+    Keyword Arguments:
+        query {str} -- DataFrame.query expression rows must match
+        (default: {None})
+        columns {list} -- columns written, None for all (default: {None})
+        dedupe {bool} -- only write the first row of each (src_id, dest_id)
+        edge (default: {True})
+
+    Returns:
+        int -- number of rows written
+    """
+    # hashes of the edges written, far smaller than the id strings
+    seen = set()
+    n_rows = 0
+    for path, df in partials:
+        if query:
+            df = df.query(query)
+
+        if dedupe:
+            hashes = edge_hashes(df).tolist()
+            keep = ~pd.Series(hashes).duplicated().to_numpy()
+            keep &= np.fromiter((edge not in seen for edge in hashes),
+                                dtype=bool, count=len(hashes))
+            seen.update(hashes)
+            df = df[keep]
+
+        if columns is not None:
+            df = df[columns]
+
+        print('Appending', len(df), 'rows from', path)
+        if len(df):
+            writer.write_frame(df)
+        n_rows += len(df)
+
+    return n_rows
+
+
+def columns_to_read(columns, query, dedupe):
+    """ Columns the partials are read with, None when every column is
+    needed """
+    if columns is None or query:
+        # the columns a query refers to are only known to pandas
+        return None
+
+    needed = list(columns)
+    if dedupe:
+        needed += [name for name in ID_COLUMNS if name not in needed]
+    return needed
 
 
 @click.command()
-def main():
-    partial_folder = Path('data/raw')
-    dataset_files = partial_folder.glob('*.h5')
+@click.option('--input-dir', default='data/raw', show_default=True,
+              type=click.Path(exists=True, file_okay=False),
+              help='Folder of the dataset files to combine.')
+@click.option('--output', default='data/combined.h5', show_default=True,
+              type=click.Path(dir_okay=False),
+              help='Combined file, an HDF table or, for a .parquet '
+                   'extension, a Parquet file.')
+@click.option('--column', 'columns', multiple=True,
+              help='Column to keep; repeat for several. All by default.')
+@click.option('--query', default=None,
+              help='Only keep rows matching this DataFrame.query '
+                   'expression, e.g. "src_num_followers > 10".')
+@click.option('--keep-duplicates', is_flag=True,
+              help='Keep every row of edges found in several partials.')
+@click.option('--workers', default=4, show_default=True,
+              help='Dataset files read in parallel.')
+def main(input_dir, output, columns, query, keep_duplicates, workers):
+    """ Streams the dataset files of make_features into one file """
+    columns = list(columns) or None
+    dedupe = not keep_duplicates
 
-    partials = []
+    paths = partial_files(input_dir)
+    print('Combining', len(paths), 'files from', input_dir)
 
-    for file in dataset_files:
-        print('Reading file', file)
-        partials.append(pd.read_hdf(file))
+    if Path(output).suffix == '.parquet':
+        writer = ParquetFeatureSink(output)
+    else:
+        writer = HDFTableWriter(output)
 
-    print('Combining...')
-    combined = pd.concat(partials)
+    partials = read_partials(
+        paths, columns=columns_to_read(columns, query, dedupe),
+        workers=workers)
+    with writer:
+        n_rows = combine(partials, writer, query=query, columns=columns,
+                         dedupe=dedupe)
 
-    combined.to_hdf('data/combined.h5', 'dataset')
+    print('Wrote', n_rows, 'rows to', output)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+from pathlib import Path
+
+import click
+from dotenv import find_dotenv, load_dotenv
+
+from indiff.storage import MongoStorage, dump_collections
+
+
+def topic_collection_names(collection_names, topic):
+    """ The topic's collections among collection_names: the tweets and every
+    collection named after the topic """
+    return sorted(name for name in collection_names
+                  if name == topic or name.startswith(topic + '-'))
+
+
+@click.command()
+@click.argument('topic')
+@click.option('--output-dir', default=None,
+              type=click.Path(file_okay=False),
+              help='Dump folder. data/interim/<topic>/dump by default.')
+def main(topic, output_dir):
+    """ Dumps the collections of a topic to JSON lines files, which
+    make_features --dump-dir runs on in memory
+    """
+    logger = logging.getLogger(__name__)
+
+    db_name = "RPE_twitteranniv"
+    event_db_name = "RPE_twitteranniv"
+    storage = None
+
+    if output_dir is None:
+        root_dir = Path(__file__).resolve().parents[2]
+        output_dir = os.path.join(root_dir, 'data', 'interim', topic, 'dump')
+
+    try:
+        storage = MongoStorage.connect(db_name, appname=__file__)
+        event_storage = storage.database_storage(event_db_name)
+
+        if topic not in storage.list_collection_names():
+            raise ValueError(f"Collection does not exist: {topic}.")
+    except ValueError as error:
+        logger.error(error)
+    else:
+        names = topic_collection_names(storage.list_collection_names(), topic)
+        dump_collections(storage.database, names, output_dir)
+
+        event_name = topic + "-event_tweets"
+        if event_db_name != db_name and \
+                event_name in event_storage.list_collection_names():
+            dump_collections(event_storage.database, [event_name], output_dir)
+
+        logger.info(f'dumped {topic} to "{output_dir}"')
+    finally:
+        if storage is not None:
+            logger.info('ending all server sessions')
+            storage.close()
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,167 @@
+"""Module contains a streaming Parquet writer for edge feature rows.
+
+Rows are collected into Arrow record batches of batch_size rows, each written
+as one compressed Parquet row group, so only one batch is held in memory.
+Columns have fixed types chosen from their names: ids are dictionary
+encoded, 0/1 flags are uint8, counts int32, ratios and averages float32 and
+everything else float64, with descriptions as strings.
+
+    with ParquetFeatureSink('dataset1.parquet') as sink:
+        sink.write_rows(rows)
+"""
+
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ID_COLUMNS = ('src_id', 'dest_id')
+
+# features that are only ever 0 or 1
+FLAG_COLUMNS = ('dest_follows_src', 'event_is_positive', 'event_is_negative',
+                'event_is_directed', 'event_has_hashtags', 'event_has_media',
+                'event_has_url')
+
+
+def column_type(name):
+    """ Arrow type of a feature column
+
+    Arguments:
+        name {str} -- column name, as in Features.to_dict
+
+    Returns:
+        DataType -- the column's type
+    """
+    if name in ID_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    if name in FLAG_COLUMNS:
+        return pa.uint8()
+    if name.endswith('_description'):
+        return pa.string()
+    if 'ratio' in name or 'avg' in name:
+        return pa.float32()
+    if '_num_' in name or name.startswith('num_') or \
+            name.endswith('total_tweets'):
+        return pa.int32()
+
+    # response times are in seconds, which float32 cannot hold exactly
+    return pa.float64()
+
+
+def feature_schema(columns):
+    """ Schema of feature rows with the given columns, in order """
+    return pa.schema([(name, column_type(name)) for name in columns])
+
+
+def _array(values, type_):
+    if pa.types.is_integer(type_):
+        values = [int(value) if isinstance(value, bool) else value
+                  for value in values]
+    return pa.array(values, type=type_)
+
+
+class ParquetFeatureSink(object):
+    """Writes feature rows to a Parquet file as they are produced.
+
+    The schema is fixed by the columns of the first row. Rows missing a
+    column store a null, and a column the schema does not have raises a
+    ValueError. The file is written under a temporary name and only renamed
+    to path once closed, so an interrupted chunk leaves no dataset file.
+
+    Arguments:
+        path {str} -- Parquet file written
+
+    Keyword Arguments:
+        batch_size {int} -- rows per record batch and row group
+        (default: {1000})
+        compression {str} -- Parquet compression codec (default: {'zstd'})
+    """
+
+    def __init__(self, path, batch_size=1000, compression='zstd'):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.batch_size = batch_size
+        self.compression = compression
+        self.schema = None
+        self.writer = None
+        self.rows = []
+        self.n_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, row):
+        """ Buffers one feature row, writing a full batch """
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def write_frame(self, df):
+        """ Writes the rows of a DataFrame, batch_size rows at a time """
+        self.flush()
+        for i in range(0, len(df), self.batch_size):
+            part = df.iloc[i:i + self.batch_size]
+            self._write_columns({name: part[name].tolist()
+                                 for name in part.columns}, len(part))
+
+    def flush(self):
+        """ Writes the buffered rows as one row group """
+        if not self.rows:
+            return
+
+        rows, self.rows = self.rows, []
+        if self.schema is None:
+            self._open(list(rows[0]))
+
+        names = dict.fromkeys(name for row in rows for name in row)
+        self._write_columns({name: [row.get(name) for row in rows]
+                             for name in names}, len(rows))
+
+    def _open(self, columns):
+        self.schema = feature_schema(columns)
+        self.writer = pq.ParquetWriter(self.tmp_path, self.schema,
+                                       compression=self.compression)
+
+    def _write_columns(self, columns, n_rows):
+        if self.schema is None:
+            self._open(list(columns))
+
+        unknown = set(columns).difference(self.schema.names)
+        if unknown:
+            raise ValueError(f'columns not in the schema of {self.path}: '
+                             f'{sorted(unknown)}')
+
+        arrays = [_array(columns.get(field.name, [None] * n_rows), field.type)
+                  for field in self.schema]
+        self.writer.write_batch(
+            pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.n_rows += n_rows
+
+    def close(self):
+        """ Writes the remaining rows and moves the file to path """
+        self.flush()
+        if self.writer is None:
+            # no rows; still leave a file so the chunk counts as done
+            self._open([])
+        self.writer.close()
+        self.writer = None
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """ Discards the partly written file """
+        self.rows = []
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
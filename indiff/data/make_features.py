@@ -1,28 +1,49 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import logging
 import os
+import pickle
+import time
 from datetime import datetime
+from collections import defaultdict
+from functools import partial
 from itertools import count
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
 from pathlib import Path
 
 import click
 import networkx as nx
 import pandas as pd
 import progressbar
-import pymongo
 import json
 import statistics
 from dotenv import find_dotenv, load_dotenv
 
 from indiff import utils
-from indiff.features import build_features
-from indiff.twitter import Tweet
-
-
-def compute_user_attribs(user_attribs, user_tweets, users_collection, tweet_collection, event_collection,
-                         retweet_collection, replies_collection, tweet_mentions_collection):
+from indiff.cache import UserAttribsCache, configure_text_cache
+from indiff.data.feature_sink import ParquetFeatureSink
+from indiff.data.run_manifest import RunManifest
+from indiff.features import async_features, build_features
+from indiff.features.follow_graph import FollowGraph
+from indiff.features.user_features import (compute_user_feature_matrix,
+                                           user_feature_rows)
+from indiff.storage import MemoryStorage, MongoStorage
+from indiff.twitter import OwnerResolver, Tweet
+from indiff.write_buffer import WriteBuffer
+
+
+def compute_user_attribs(user_attribs, user_tweets, users_collection,
+                         tweet_collection, event_collection,
+                         retweet_collection, replies_collection,
+                         tweet_mentions_collection, mentions_buffer=None,
+                         owner_resolver=None, known_entries=None):
     """ Computes a user's attributes
 
+    The tweets are folded into the counters, lists and dates already in
+    user_attribs, so an existing document can be updated with new tweets
+    only.
+
     Arguments:
         user_attribs {dict} -- user attributes
         user_tweets {collection} -- all tweets by user
@@ -30,9 +51,33 @@ def compute_user_attribs(user_attribs, user_tweets, users_collection, tweet_coll
         retweet_collection {collection} -- collection with all retweets
         replies_collection {collection} -- collection with all replies
         tweet_mentions_collection {collection} -- tweets with user mentions
+
+    Keyword Arguments:
+        mentions_buffer {WriteBuffer} -- buffer for tweet_mentions_collection
+        writes, flushed by the caller. A buffer flushed on return is used if
+        None (default: {None})
+        owner_resolver {OwnerResolver} -- original owner lookups shared
+        across users. One over tweet_collection is used if None
+        (default: {None})
+        known_entries {dict} -- response id -> responses index entry of an
+        earlier run, reused instead of rebuilt (default: {None})
+
+    Returns:
+        list -- the user's responses index entries
     """
     user_id = user_attribs['_id']
 
+    own_mentions_buffer = mentions_buffer is None
+    if own_mentions_buffer:
+        mentions_buffer = WriteBuffer(tweet_mentions_collection)
+
+    if owner_resolver is None:
+        owner_resolver = OwnerResolver(tweet_collection)
+
+    # resolve the owners of every tweet this user retweeted or quoted at once
+    user_tweets = [Tweet(user_tweet) for user_tweet in user_tweets]
+    owner_resolver.prefetch(user_tweets)
+
     user = users_collection.find_one({'id': user_id})
 
     user_attribs['username'] = user['username']
@@ -62,55 +107,63 @@ def compute_user_attribs(user_attribs, user_tweets, users_collection, tweet_coll
 
     bar = progressbar.ProgressBar(prefix=f"Computing {user_id}'s "
                                   "Attributes: ")
-    for user_tweet in bar(user_tweets):
-        tweet = Tweet(user_tweet)
-
-        orig_owner_id = tweet.original_owner_id(tweet_collection)
+    for tweet in bar(user_tweets):
+
+        # every field below is read from the tweet's parsed fields, so the
+        # raw document is only parsed once
+        kind = tweet.parsed.kind
+        created_at = tweet.created_at
+        has_hashtags = bool(tweet.hashtags)
+        has_urls = bool(tweet.urls)
+        has_media = bool(tweet.media)
+        users_mentioned_in_tweet = tweet.users_mentioned
+
+        orig_owner_id = tweet.original_owner_id(
+            tweet_collection, owner_resolver=owner_resolver)
         if orig_owner_id != user_id:
             user_attribs['all_possible_original_tweet_owners'].append(
                 orig_owner_id)
 
-        if tweet.is_retweeted_tweet:
+        if kind == 'retweet':
             user_attribs['retweeted_tweets'].append(tweet.id)
 
-            if tweet.hashtags:
+            if has_hashtags:
                 user_attribs['n_retweeted_tweets_with_hashtags'] += 1
-            if tweet.urls:
+            if has_urls:
                 user_attribs['n_retweeted_tweets_with_urls'] += 1
-            if tweet.media:
+            if has_media:
                 user_attribs['n_retweeted_tweets_with_media'] += 1
 
-            if tweet.is_others_mentioned:
+            if users_mentioned_in_tweet:
                 user_attribs['retweets_with_others_mentioned_count'] += 1
 
             # fetch tweet dates
-            user_attribs['retweeted_tweets_dates'].append(tweet.created_at)
-        elif tweet.is_quoted_tweet:
+            user_attribs['retweeted_tweets_dates'].append(created_at)
+        elif kind == 'quote':
             user_attribs['quoted_tweets'].append(tweet.id)
 
-            if tweet.hashtags:
+            if has_hashtags:
                 user_attribs['n_quoted_tweets_with_hashtags'] += 1
-            if tweet.urls:
+            if has_urls:
                 user_attribs['n_quoted_tweets_with_urls'] += 1
-            if tweet.media:
+            if has_media:
                 user_attribs['n_quoted_tweets_with_media'] += 1
 
-            if tweet.is_others_mentioned:
+            if users_mentioned_in_tweet:
                 user_attribs['quoted_tweets_with_others_mentioned_count'] += 1
 
             # fetch tweet dates
-            user_attribs['quoted_tweets_dates'].append(tweet.created_at)
+            user_attribs['quoted_tweets_dates'].append(created_at)
         else:
             user_attribs['tweets'].append(tweet.id)
 
-            if tweet.hashtags:
+            if has_hashtags:
                 user_attribs['n_tweets_with_hashtags'] += 1
-            if tweet.urls:
+            if has_urls:
                 user_attribs['n_tweets_with_urls'] += 1
-            if tweet.media:
+            if has_media:
                 user_attribs['n_tweets_with_media'] += 1
 
-            users_mentioned_in_tweet = tweet.users_mentioned
             if users_mentioned_in_tweet:
                 user_attribs['users_mentioned_in_all_my_tweets'].extend(
                     users_mentioned_in_tweet)
@@ -121,14 +174,12 @@ def compute_user_attribs(user_attribs, user_tweets, users_collection, tweet_coll
                     "users": users_mentioned_in_tweet
                 }
 
-                tweet_mentions_collection.insert_one(
-                    tweet_users_doc)
+                mentions_buffer.replace({'_id': tweet.id}, tweet_users_doc)
 
-            if tweet.is_others_mentioned:
                 user_attribs['tweets_with_others_mentioned_count'] += 1
 
             # fetch tweet dates
-            user_attribs['tweets_dates'].append(tweet.created_at)
+            user_attribs['tweets_dates'].append(created_at)
 
         if tweet.is_response_tweet:
             user_attribs['responses'].append(tweet.id)
@@ -136,24 +187,25 @@ def compute_user_attribs(user_attribs, user_tweets, users_collection, tweet_coll
         if tweet.is_favourited:
             user_attribs['favorite_tweets_count'] += 1
 
-        user_attribs['retweet_count'] += tweet.retweet_count
+        retweet_count = tweet.retweet_count
+        user_attribs['retweet_count'] += retweet_count
 
-        if tweet.is_retweeted:
+        if retweet_count:
             user_attribs['retweeted_count'] += 1
 
         user_attribs['keywords_in_all_my_tweets'].extend(tweet.keywords)
 
         if user_attribs['tweet_min_date'] == 0:
-            user_attribs['tweet_min_date'] = tweet.created_at
+            user_attribs['tweet_min_date'] = created_at
 
         if user_attribs['tweet_max_date'] == 0:
-            user_attribs['tweet_max_date'] = tweet.created_at
+            user_attribs['tweet_max_date'] = created_at
 
-        if user_attribs['tweet_min_date'] > tweet.created_at:
-            user_attribs['tweet_min_date'] = tweet.created_at
+        if user_attribs['tweet_min_date'] > created_at:
+            user_attribs['tweet_min_date'] = created_at
 
-        if user_attribs['tweet_max_date'] < tweet.created_at:
-            user_attribs['tweet_max_date'] = tweet.created_at
+        if user_attribs['tweet_max_date'] < created_at:
+            user_attribs['tweet_max_date'] = created_at
 
         # external_owner_id = tweet.original_owner_id
         # if external_owner_id:
@@ -167,19 +219,21 @@ def compute_user_attribs(user_attribs, user_tweets, users_collection, tweet_coll
             user_attribs['negative_sentiment_count'] += 1
 
         # calculate n_tweets_with_user_mentions
-        if tweet.users_mentioned:
+        if users_mentioned_in_tweet:
             user_attribs['n_tweets_with_user_mentions'] += 1
 
+    if own_mentions_buffer:
+        mentions_buffer.flush()
+
+    # Expand this user's responses into responses index entries
+    entries = list(build_features.response_entries(
+        user_id, user_tweets, tweet_collection, retweet_collection,
+        replies_collection, event_collection, current_attr=user_attribs,
+        owner_resolver=owner_resolver, known_entries=known_entries))
+
     # Gather all response times from this user
-    responses = []
-    for tweet in build_features.get_responses(user_id, user_tweets, tweet_collection,
-                                              retweet_collection, replies_collection,
-                                              current_attr=user_attribs):
-        original = tweet.get_original_tweet(tweet_collection, event_collection)
-        # If we have a copy of the original tweet
-        if original:
-            delay = (tweet.created_at.replace(tzinfo=None) - original.created_at.replace(tzinfo=None)).total_seconds()
-            responses.append(delay)
+    responses = [entry['response_time'] for entry in entries
+                 if entry['response_time'] is not None]
 
     # If the user has any responses
     if len(responses) > 0:
@@ -187,11 +241,91 @@ def compute_user_attribs(user_attribs, user_tweets, users_collection, tweet_coll
         user_attribs['median_response_time'] = statistics.median(responses)
         user_attribs['max_response_time'] = max(responses)
 
-
-def process_user_attribs(users, tweet_collection, event_collection, tweet_mentions_collection,
-                         users_collection, retweet_collection, replies_collection, user_attribs_collection):
+    return entries
+
+
+# user attributes fields holding the _id of the newest tweet folded in, and
+# of the newest tweet whose mentions were added to mentioned_in
+TWEETS_MARK = 'tweets_mark'
+MENTIONS_MARK = 'mentions_mark'
+
+
+def new_user_attribs(user_id):
+    """ Returns the attributes of a user before any tweet is folded in """
+    return {'_id': user_id,
+            'username': '',
+            'tweets': [],
+            'n_tweets_with_hashtags': 0,
+            'n_tweets_with_urls': 0,
+            'n_tweets_with_media': 0,
+            'tweets_with_others_mentioned_count': 0,
+            'mentioned_in': [],
+            'users_mentioned_in_all_my_tweets': [],
+            'keywords_in_all_my_tweets': [],
+            'all_possible_original_tweet_owners': [],
+            'retweeted_tweets': [],
+            'n_retweeted_tweets_with_hashtags': 0,
+            'n_retweeted_tweets_with_urls': 0,
+            'n_retweeted_tweets_with_media': 0,
+            'retweets_with_others_mentioned_count': 0,
+            'retweet_count': 0,
+            'retweeted_count': 0,
+            'quoted_tweets': [],
+            'n_quoted_tweets_with_hashtags': 0,
+            'n_quoted_tweets_with_urls': 0,
+            'n_quoted_tweets_with_media': 0,
+            'quoted_tweets_with_others_mentioned_count': 0,
+            'description': None,
+            'favorite_tweets_count': 0,
+            'positive_sentiment_count': 0,
+            'negative_sentiment_count': 0,
+            'followers_count': 0,
+            'friends_count': 0,
+            'followers_ids': [],
+            'friends_ids': [],
+            'tweet_min_date': 0,
+            'tweet_max_date': 0,
+            'n_tweets_with_user_mentions': 0,
+            'tweets_dates': [],
+            'retweeted_tweets_dates': [],
+            'quoted_tweets_dates': [],
+            'responses': [],
+            'mean_response_time': 0.0,
+            'median_response_time': 0.0,
+            'max_response_time': 0.0,
+            # high-water marks, see process_user_attribs
+            TWEETS_MARK: None,
+            MENTIONS_MARK: None,
+            }
+
+
+def process_user_attribs(users, tweet_collection, event_collection,
+                         tweet_mentions_collection, users_collection,
+                         retweet_collection, replies_collection,
+                         user_attribs_collection, responses_collection=None,
+                         batch_size=1000, incremental=False):
     """ Computes user attributes for multiple users
 
+    Every user attributes document records two high-water marks over the
+    _ids of the tweet collection: the newest tweet folded into it and the
+    newest tweet whose mentions were added to mentioned_in. The second
+    catches up with the first only once mentioned_in is written, so the
+    mentions of tweets folded in by an interrupted run are added by the
+    next one. Marks assume that tweets inserted later get greater _ids, as
+    the ObjectIds the collectors' inserts generate do.
+
+    In incremental mode, a user with no tweet past their mentions mark is
+    skipped before any other read. Otherwise only the tweets past their
+    tweets mark are folded in and the derived fields recomputed, reusing
+    the responses already in the responses index. Users without a
+    document, or with one from before marks were recorded, are computed in
+    full, as is every user outside incremental mode.
+
+    The followers_count, friends_count and description of an existing
+    document are kept, so incremental runs never refresh them from the
+    users collection. Neither are the responses of a user without new
+    tweets refreshed from the retweets and replies collections.
+
     Arguments:
         users {list} -- user ids
         tweet_collection {collection} -- tweets
@@ -200,6 +334,11 @@ def process_user_attribs(users, tweet_collection, event_collection, tweet_mentio
         retweet_collection {collection} -- collection with all retweets
         replies_collection {collection} -- collection with all replies
         user_attribs_collection {collection} -- user attributes
+        responses_collection {collection} -- responses index, keyed by
+        responder (default: {None})
+        batch_size {int} -- writes per bulk write (default: {1000})
+        incremental {bool} -- only fold in tweets past existing documents'
+        marks (default: {False})
     """
     n_user_ids = len(users)
 
@@ -207,57 +346,77 @@ def process_user_attribs(users, tweet_collection, event_collection, tweet_mentio
     # Create an index so that user mentions will be efficent
     user_attribs_collection.create_index('username')
 
+    # Create an index so that a user's responses are one indexed query
+    if responses_collection is not None:
+        responses_collection.create_index([('responder_id', 1),
+                                           ('rank', 1)])
+
+    # Writes are buffered and sent as unordered bulk writes. Every write of
+    # a user touches different documents, so their order does not matter,
+    # except that a user's mentions and responses are written before the
+    # attributes that advance their mark.
+    mentions_buffer = WriteBuffer(tweet_mentions_collection,
+                                  batch_size=batch_size)
+    buffers = [mentions_buffer]
+
+    # referenced tweet id -> author, shared by every user of the run
+    owner_resolver = OwnerResolver(tweet_collection, chunk_size=batch_size)
+    if responses_collection is not None:
+        responses_buffer = WriteBuffer(responses_collection,
+                                       batch_size=batch_size)
+        buffers.append(responses_buffer)
+    user_attribs_buffer = WriteBuffer(user_attribs_collection,
+                                      batch_size=batch_size,
+                                      flush_first=tuple(buffers))
+    buffers.append(user_attribs_buffer)
+
+    # user id -> tweets mark of every user written by this run, tweets
+    # whose mentions they add and users computed in full, who get the
+    # mentions of every tweet
+    written_marks = {}
+    mention_tweet_ids = set()
+    new_usernames = set()
+
     for i, user_id in zip(count(start=1), users):
         logging.info(f"PROCESSING NODE ATTR FOR {user_id}: "
                      f"{i} OF {n_user_ids} USERS")
-        user_attribs = {'_id': user_id,
-                        'username': '',
-                        'tweets': [],
-                        'n_tweets_with_hashtags': 0,
-                        'n_tweets_with_urls': 0,
-                        'n_tweets_with_media': 0,
-                        'tweets_with_others_mentioned_count': 0,
-                        'mentioned_in': [],
-                        'users_mentioned_in_all_my_tweets': [],
-                        'keywords_in_all_my_tweets': [],
-                        'all_possible_original_tweet_owners': [],
-                        'retweeted_tweets': [],
-                        'n_retweeted_tweets_with_hashtags': 0,
-                        'n_retweeted_tweets_with_urls': 0,
-                        'n_retweeted_tweets_with_media': 0,
-                        'retweets_with_others_mentioned_count': 0,
-                        'retweet_count': 0,
-                        'retweeted_count': 0,
-                        'quoted_tweets': [],
-                        'n_quoted_tweets_with_hashtags': 0,
-                        'n_quoted_tweets_with_urls': 0,
-                        'n_quoted_tweets_with_media': 0,
-                        'quoted_tweets_with_others_mentioned_count': 0,
-                        'description': None,
-                        'favorite_tweets_count': 0,
-                        'positive_sentiment_count': 0,
-                        'negative_sentiment_count': 0,
-                        'followers_count': 0,
-                        'friends_count': 0,
-                        'followers_ids': [],
-                        'friends_ids': [],
-                        'tweet_min_date': 0,
-                        'tweet_max_date': 0,
-                        'n_tweets_with_user_mentions': 0,
-                        'tweets_dates': [],
-                        'retweeted_tweets_dates': [],
-                        'quoted_tweets_dates': [],
-                        'responses': [],
-                        'mean_response_time': 0.0,
-                        'median_response_time': 0.0,
-                        'max_response_time': 0.0,
-                        }
+        user_attribs = None
+        known_entries = None
+        if incremental:
+            user_attribs = user_attribs_collection.find_one({'_id': user_id})
+
+        is_new = user_attribs is None or TWEETS_MARK not in user_attribs
+        if is_new:
+            user_attribs = new_user_attribs(user_id)
 
         query = {"author_id": user_id}
-        user_tweets = tweet_collection.find(query)
+        if user_attribs[MENTIONS_MARK] is not None:
+            query['_id'] = {'$gt': user_attribs[MENTIONS_MARK]}
+        pending_tweets = list(tweet_collection.find(query))
+        if not is_new and not pending_tweets:
+            continue
+
+        # tweets past the mentions mark but not the tweets mark were folded
+        # in by an interrupted run, which did not add their mentions
+        tweets_mark = user_attribs[TWEETS_MARK]
+        user_tweets = [tweet for tweet in pending_tweets
+                       if tweets_mark is None or tweet['_id'] > tweets_mark]
+        marks = [tweet['_id'] for tweet in pending_tweets]
+        if tweets_mark is not None:
+            marks.append(tweets_mark)
+        user_attribs[TWEETS_MARK] = max(marks, default=None)
+        mention_tweet_ids.update(tweet['id'] for tweet in pending_tweets
+                                 if 'id' in tweet)
+
+        if not is_new and responses_collection is not None:
+            known_entries = {
+                entry['id']: entry for entry in
+                build_features.get_indexed_responses(
+                    user_id, responses_collection)
+                if build_features.is_complete_entry(entry)}
 
         # compute user atribs
-        compute_user_attribs(
+        entries = compute_user_attribs(
             user_attribs=user_attribs,
             user_tweets=user_tweets,
             users_collection=users_collection,
@@ -265,21 +424,50 @@ def process_user_attribs(users, tweet_collection, event_collection, tweet_mentio
             event_collection=event_collection,
             retweet_collection=retweet_collection,
             replies_collection=replies_collection,
-            tweet_mentions_collection=tweet_mentions_collection
+            tweet_mentions_collection=tweet_mentions_collection,
+            mentions_buffer=mentions_buffer,
+            owner_resolver=owner_resolver,
+            known_entries=known_entries
             )
+        if is_new:
+            new_usernames.add(user_attribs['username'])
+
+        # write the user's responses to the responses index, replacing the
+        # entries of an earlier run
+        if responses_collection is not None:
+            entry_ids = []
+            for entry in entries:
+                entry['_id'] = f"{user_id}:{entry['rank']}"
+                entry_ids.append(entry['_id'])
+                responses_buffer.replace({'_id': entry['_id']}, entry)
+            responses_buffer.delete({'responder_id': user_id,
+                                     '_id': {'$nin': entry_ids}})
 
         update_user_attribs(user_attribs=user_attribs)
         # write user attributes as document to database
-        try:
-            user_attribs_collection.insert_one(user_attribs)
-        except pymongo.errors.DuplicateKeyError:
-            logging.info(f'updating node attribute for {user_id}')
-            user_attribs_collection.replace_one({'_id': user_id}, user_attribs)
-        except pymongo.errors.InvalidDocument as err:
-            logging.error('found an invalid document')
-            logging.error(err)
+        user_attribs_buffer.replace({'_id': user_id}, user_attribs)
+        written_marks[user_id] = user_attribs[TWEETS_MARK]
+
+    for buffer in buffers:
+        buffer.flush()
+        buffer.log_stats()
+    logging.info(f'resolved {len(owner_resolver.owners)} original tweet '
+                 f'owners in {owner_resolver.n_queries} queries')
+
+    if incremental:
+        compute_mentioned_in(tweet_mentions_collection,
+                             user_attribs_collection, batch_size=batch_size,
+                             tweet_ids=mention_tweet_ids,
+                             usernames=new_usernames)
+    else:
+        compute_mentioned_in(tweet_mentions_collection,
+                             user_attribs_collection, batch_size=batch_size)
 
-    compute_mentioned_in(tweet_mentions_collection, user_attribs_collection)
+    # the mentions of every tweet folded in are written
+    with WriteBuffer(user_attribs_collection, batch_size=batch_size) as buffer:
+        for user_id, mark in written_marks.items():
+            buffer.update({'_id': user_id}, {'$set': {MENTIONS_MARK: mark}})
+    buffer.log_stats()
 
 
 def update_user_attribs(user_attribs):
@@ -303,59 +491,426 @@ def update_user_attribs(user_attribs):
     build_features.compute_A(user_attribs)
 
 
-def compute_mentioned_in(tweet_mentions_collection, user_attribs_collection):
+def compute_mentioned_in(tweet_mentions_collection, user_attribs_collection,
+                         batch_size=1000, tweet_ids=None, usernames=None):
     """ Computes tweets a user is mentioned in
 
+    Groups the mentioned tweet ids by username in one streaming pass over the
+    mentions and appends them to the users' mentioned_in with unordered bulk
+    $set updates. Tweets already in a user's mentioned_in, added by an
+    interrupted run, are not appended again. Usernames without user
+    attributes match no document and are skipped.
+
     Arguments:
         tweet_mentions_collection {collection} -- a collection of tweet and
         user mentions
         user_attribs_collection {collection} -- a collection of user attributes
+
+    Keyword Arguments:
+        batch_size {int} -- updates per bulk write (default: {1000})
+        tweet_ids {set} -- only append these tweets, None for every tweet
+        (default: {None})
+        usernames {set} -- users every tweet is appended for regardless of
+        tweet_ids (default: {None})
     """
-    # calculate extra attributes
-    # TODO: look for a way to make this computationally effecient since
-    # we can now query a database and just change a particular part of the
-    # database.
-    # get all tweets in database
+    usernames = usernames or set()
     n_tweets = tweet_mentions_collection.count_documents({})
-    if n_tweets:
-        logging.info('update user attribs with tweets mentioned in')
+    if not n_tweets:
+        return
+
+    logging.info('update user attribs with tweets mentioned in')
 
-        tweets = tweet_mentions_collection.find({}, no_cursor_timeout=True)
+    # username -> ids of the tweets mentioning them, in collection order
+    mentioned_in = defaultdict(list)
+    tweets = tweet_mentions_collection.find({}, {'users': 1},
+                                            no_cursor_timeout=True)
+    try:
         bar = progressbar.ProgressBar(maxlen=n_tweets)
         for tweet_document in bar(tweets):
-            tweet_id = tweet_document['_id']
-            users_mentioned = tweet_document['users']
-
-            for user in users_mentioned:
-                # check if user exists in user_attribs_collection
-                query_user_attr = {'username': user}
-                document_count = user_attribs_collection.count_documents(
-                    query_user_attr)
-                if document_count:
-                    user_attr_document = user_attribs_collection.find_one(
-                        query_user_attr)
-
-                    # update the document
-                    mentioned_in = user_attr_document['mentioned_in']
-                    mentioned_in.append(tweet_id)
-                    new_values = {"$set": {
-                        "mentioned_in": mentioned_in
-                        }}
-
-                    user_attribs_collection.update_one(
-                        query_user_attr, new_values)
-
+            for user in tweet_document['users']:
+                if tweet_ids is None or user in usernames or \
+                        tweet_document['_id'] in tweet_ids:
+                    mentioned_in[user].append(tweet_document['_id'])
+    finally:
         # Close the database cursor
         tweets.close()
 
+    # the new ids are appended to each user's current list and the whole
+    # list is set, so a batch sent again after a failure is applied once
+    usernames = list(mentioned_in)
+    with WriteBuffer(user_attribs_collection, batch_size=batch_size) as buffer:
+        for i in range(0, len(usernames), batch_size):
+            found = set()
+            cursor = user_attribs_collection.find(
+                {'username': {'$in': usernames[i:i + batch_size]}},
+                {'username': 1, 'mentioned_in': 1})
+            try:
+                for user_attribs in cursor:
+                    user = user_attribs['username']
+                    # only the first document of a username, as update_one
+                    if user in found:
+                        continue
+                    found.add(user)
+                    current = user_attribs.get('mentioned_in', [])
+                    added = set(current)
+                    new_ids = [id_ for id_ in mentioned_in[user]
+                               if id_ not in added]
+                    if new_ids:
+                        buffer.update({'_id': user_attribs['_id']}, {'$set': {
+                            'mentioned_in': current + new_ids}})
+            finally:
+                cursor.close()
+    buffer.log_stats()
+
+
+def follow_graph_cache_path(users_collection, cache_dir):
+    """ Directory of the follow graph of a users collection, keyed by a
+    fingerprint of the users' ids and following lists """
+    key = collection_fingerprint(users_collection,
+                                 ('id', 'following_ids', 'following'))
+    return os.path.join(cache_dir, f'follow-graph-{key}')
+
+
+def load_follow_graph(users_collection, path):
+    """ Loads the follow graph saved at path, building and saving it from
+    the users collection first if needed
+
+    Arguments:
+        users_collection {collection} -- user data objects
+        path {str} -- directory of the graph's arrays
+
+    Returns:
+        FollowGraph -- memory-mapped follow graph
+    """
+    if not FollowGraph.exists(path):
+        logging.info(f'building follow graph in "{path}"')
+        FollowGraph.from_users(users_collection).save(path)
+
+    return FollowGraph.load(path)
+
+
+def process_event_table(event_collection, event_table_collection,
+                        batch_size=1000):
+    """ Builds the event table: one row per user summarising their earliest
+    event tweet, which the event features read instead of scanning the
+    user's event tweets for every edge
+
+    Arguments:
+        event_collection {collection} -- event tweets
+        event_table_collection {collection} -- event table, keyed by user
+
+    Keyword Arguments:
+        batch_size {int} -- writes per bulk write (default: {1000})
+    """
+    logging.info('building event table')
+
+    # sorting by author needs an index on large collections
+    event_collection.create_index('author_id')
+
+    event_table_collection.drop()
+    with WriteBuffer(event_table_collection,
+                     batch_size=batch_size) as buffer:
+        for row in build_features.event_table_rows(event_collection):
+            buffer.replace({'_id': row['_id']}, row)
+    buffer.log_stats()
+
+
+def known_user_ids(users_collection):
+    """ Reads the ids of every user in the database with one projected
+    cursor """
+    cursor = users_collection.find({}, {'id': 1, '_id': 0})
+    try:
+        return {user['id'] for user in cursor if 'id' in user}
+    finally:
+        cursor.close()
+
+
+def filter_graph(social_network, users_collection):
+    """ Removes all nodes without users in the database, in place
+
+    Arguments:
+        social_network {DiGraph} -- graph of user ids
+        users_collection {collection} -- user data objects
+
+    Returns:
+        DiGraph -- the filtered graph
+    """
+    known = known_user_ids(users_collection)
+    missing = [user for user in social_network.nodes if user not in known]
+    logging.info(f'removing {len(missing)} of '
+                 f'{social_network.number_of_nodes()} users not in database')
+    social_network.remove_nodes_from(missing)
+
+    return social_network
+
+
+def file_fingerprint(filepath, block_size=1 << 20):
+    """ SHA-1 of a file's contents """
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def collection_fingerprint(collection, fields):
+    """ SHA-1 of some fields of every document in a collection
+
+    Documents are read with one projected cursor, in natural order.
+    Documents added, removed or updated in those fields since change it.
+
+    Arguments:
+        collection {collection} -- collection to fingerprint
+        fields {iterable} -- fields a cache derived from the collection reads
+
+    Returns:
+        str -- hex digest
+    """
+    digest = hashlib.sha1()
+    cursor = collection.find({}, dict.fromkeys(fields, 1))
+    try:
+        for document in cursor:
+            digest.update(repr(sorted(document.items())).encode('utf-8'))
+    finally:
+        cursor.close()
+    return digest.hexdigest()
+
+
+def load_filtered_graph(social_network_filepath, users_collection, cache_dir):
+    """ Reads the social network and removes users missing from the database
+
+    The filtered graph is pickled to cache_dir, keyed by fingerprints of the
+    adjacency list and of the user ids in the database, so that reruns on
+    unchanged data skip reading and filtering the graph. The pickle keeps
+    node and edge order, and so the edge chunks, identical to a fresh
+    filter.
+
+    Arguments:
+        social_network_filepath {str} -- adjacency list of the network
+        users_collection {collection} -- user data objects
+        cache_dir {str} -- directory of the filtered graph cache
+
+    Returns:
+        DiGraph -- the filtered graph
+    """
+    key = hashlib.sha1('{}:{}'.format(
+        file_fingerprint(social_network_filepath),
+        collection_fingerprint(users_collection, ('id',))).encode(
+            'utf-8')).hexdigest()
+    cache_path = os.path.join(cache_dir, f'filtered-graph-{key}.pickle')
+
+    if os.path.exists(cache_path):
+        logging.info(f'loading filtered graph from "{cache_path}"')
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+
+    # build initial graph from file
+    social_network = nx.read_adjlist(social_network_filepath, delimiter=',',
+                                     create_using=nx.DiGraph)
+    filter_graph(social_network, users_collection)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    logging.info(f'saving filtered graph to "{cache_path}"')
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(social_network, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+    return social_network
+
+
+# edges per dataset file
+CHUNK_SIZE = 5000
+
+# dataset file extension of each output format
+OUTPUT_FORMATS = {'hdf': '.h5', 'parquet': '.parquet'}
+
+DB_NAME = "RPE_twitteranniv"
+EVENT_DB_NAME = "RPE_twitteranniv"
+
+# Per-process state of the edge feature workers, see init_edge_worker
+_edge_worker = {}
+
+
+def edge_collections(db, event_db, topic, node_collection=None):
+    """ Collections calculate_network_diffusion reads, as keyword arguments
+
+    Arguments:
+        db {database} -- topic database
+        event_db {database} -- event tweets database
+        topic {str} -- topic name
+
+    Keyword Arguments:
+        node_collection {collection} -- user attributes, wrapped in a new
+        UserAttribsCache if None (default: {None})
+    """
+    if node_collection is None:
+        node_collection = UserAttribsCache(db[topic + "-user-attribs"])
+
+    return {'node_collection': node_collection,
+            'tweet_collection': db[topic],
+            'retweets_collection': db[topic + "-retweets"],
+            'replies_collection': db[topic + "-replies"],
+            'event_tweets_collection': event_db[topic + "-event_tweets"],
+            'users_collection': db[topic + "-users"],
+            'responses_collection': db[topic + "-responses"]}
+
+
+def edge_chunk_rows(edges, keywords, collections, user_features,
+                    event_table=None, follow_graph=None, response_maps=None):
+    """ Computes the features of a chunk of edges as they are needed
+
+    Arguments:
+        edges {list} -- (source, destination) user id pairs
+        keywords {set} -- topic keywords
+        collections {dict} -- see edge_collections
+        user_features {dict} -- precomputed per-user feature rows
+
+    Keyword Arguments:
+        event_table {dict} -- user id -> event table row (default: {None})
+        follow_graph {FollowGraph} -- follow graph (default: {None})
+        response_maps {LRUCache} -- response maps shared with other chunks,
+        see build_features.response_maps_cache. A new one is used if None
+        (default: {None})
+
+    Yields:
+        dict -- features of each edge, in edge order
+    """
+    return build_features.calculate_network_diffusion(
+        edges, keywords,
+        **collections,
+        additional_attr=True,
+        do_not_add_sentiment=False,
+        user_features=user_features,
+        event_table=event_table,
+        follow_graph=follow_graph,
+        response_maps=response_maps
+        )
+
+
+def edge_chunk_features(edges, keywords, collections, user_features,
+                        event_table=None, follow_graph=None,
+                        response_maps=None):
+    """ Computes the features of a chunk of edges
+
+    Arguments:
+        edges {list} -- (source, destination) user id pairs
+        keywords {set} -- topic keywords
+        collections {dict} -- see edge_collections
+        user_features {dict} -- precomputed per-user feature rows
+
+    Keyword Arguments:
+        event_table {dict} -- user id -> event table row (default: {None})
+        follow_graph {FollowGraph} -- follow graph (default: {None})
+        response_maps {LRUCache} -- see edge_chunk_rows (default: {None})
+
+    Returns:
+        DataFrame -- one row per edge, in edge order
+    """
+    results = edge_chunk_rows(edges, keywords, collections, user_features,
+                              event_table=event_table,
+                              follow_graph=follow_graph,
+                              response_maps=response_maps)
+
+    return pd.DataFrame(results)
+
+
+def init_edge_worker(topic, keywords, user_features, event_table,
+                     follow_graph_path, sentiment_engine, storage=None,
+                     text_cache_path=None):
+    """ Pool initializer: each worker process opens its own MongoClient,
+    since clients must not be shared across a fork, and memory-maps the
+    follow graph, which the workers share through the page cache. An
+    in-memory storage is used as is; forked workers read the parent's copy.
+
+    The parent's text cache connection does not survive the fork either, so
+    each worker opens the text cache file read-only and keeps the texts it
+    computes in memory, leaving the file to the parent. """
+    utils.set_sentiment_engine(sentiment_engine)
+    text_cache = configure_text_cache(path=text_cache_path, read_only=True)
+    Finalize(text_cache, text_cache.close, exitpriority=10)
+
+    if storage is None:
+        storage = MongoStorage.connect(DB_NAME, appname=__file__)
+        event_storage = storage.database_storage(EVENT_DB_NAME)
+        # ends the worker's server sessions when the worker exits
+        Finalize(storage, storage.close, exitpriority=10)
+    else:
+        event_storage = storage
+
+    _edge_worker.update(
+        storage=storage,
+        keywords=keywords,
+        user_features=user_features,
+        event_table=event_table,
+        follow_graph=FollowGraph.load(follow_graph_path),
+        collections=edge_collections(storage, event_storage, topic),
+        # kept across the worker's chunks, as a serial run does
+        response_maps=build_features.response_maps_cache())
+
+
+def compute_edge_chunk(task):
+    """ Worker task: computes the features of one identified slice of edges
+
+    Arguments:
+        task {tuple} -- slice key and edges
+
+    Returns:
+        tuple -- slice key and the slice's DataFrame
+    """
+    key, edges = task
+    df = edge_chunk_features(edges, _edge_worker['keywords'],
+                             _edge_worker['collections'],
+                             _edge_worker['user_features'],
+                             event_table=_edge_worker['event_table'],
+                             follow_graph=_edge_worker['follow_graph'],
+                             response_maps=_edge_worker['response_maps'])
+    return key, df
+
 
 @click.command()
 @click.argument('topic')
 @click.argument('keywords_filepath', type=click.Path(exists=True))
-def main(topic, keywords_filepath):
+@click.option('--sentiment-engine', type=click.Choice(utils.SENTIMENT_ENGINES),
+              default='textblob', show_default=True,
+              help='Sentiment engine used for tweets without a stored label.')
+@click.option('--text-cache', 'text_cache_path', default=None,
+              type=click.Path(dir_okay=False),
+              help='SQLite file caching sentiment and keywords of tweet '
+                   'texts across runs.')
+@click.option('--workers', default=1, show_default=True,
+              help='Processes computing chunks of edges in parallel.')
+@click.option('--async-concurrency', default=0, show_default=True,
+              help='Compute features with the asyncio engine, prefetching '
+                   'this many edges at once. 0 keeps the synchronous engine. '
+                   'Cannot be combined with --workers.')
+@click.option('--output-format', type=click.Choice(list(OUTPUT_FORMATS)),
+              default='hdf', show_default=True,
+              help='Format of the dataset files. parquet streams rows into '
+                   'typed, compressed row groups.')
+@click.option('--checkpoint-size', default=500, show_default=True,
+              help='Edges written and recorded at a time, and so the most '
+                   'work an interrupted run loses.')
+@click.option('--incremental', is_flag=True,
+              help='Only fold tweets added since the last run into existing '
+                   'user attributes.')
+@click.option('--dump-dir', default=None,
+              type=click.Path(exists=True, file_okay=False),
+              help='Run in memory on a dump of the topic written by '
+                   'indiff.data.dump_topic instead of MongoDB.')
+def main(topic, keywords_filepath, sentiment_engine, text_cache_path,
+         workers, async_concurrency, output_format, checkpoint_size,
+         incremental, dump_dir):
     """ Runs feature extraction scripts to generate raw data.
     """
+    if workers > 1 and async_concurrency > 0:
+        raise click.UsageError('--workers and --async-concurrency cannot be '
+                               'combined: the asyncio engine runs in a '
+                               'single process.')
+
     logger = logging.getLogger(__name__)
+    utils.set_sentiment_engine(sentiment_engine)
+    text_cache = configure_text_cache(path=text_cache_path)
     current_date_and_time = datetime.now()
 
     # root directories
@@ -364,29 +919,35 @@ def main(topic, keywords_filepath):
     raw_data_root_dir = os.path.join(data_root_dir, 'raw')
     topic_raw_data_dir = os.path.join(raw_data_root_dir, topic)
 
-    db_name = "RPE_twitteranniv"
-    event_db_name = "RPE_twitteranniv"
-    client = None
+    db_name = DB_NAME
+    event_db_name = EVENT_DB_NAME
+    storage = None
+    pool = None
+    manifest = None
 
     try:
         if not os.path.exists(topic_raw_data_dir):
             raise FileExistsError(f'Dataset for {topic} does not exists.')
 
-        client = pymongo.MongoClient(host='localhost', port=27017,
-                                     appname=__file__)
-        db = client[db_name]
-        event_db = client[event_db_name]
+        if dump_dir is not None:
+            # every collection, including the ones built below, in memory
+            storage = MemoryStorage.from_dump(dump_dir, name=db_name)
+            event_storage = storage
+        else:
+            storage = MongoStorage.connect(db_name, appname=__file__)
+            event_storage = storage.database_storage(event_db_name)
+        db = storage
+        event_db = event_storage
         tweet_collection = db[topic]
         user_attribs_collection = db[topic + "-user-attribs"]
         users_collection = db[topic + "-users"]
         retweets_collection = db[topic + "-retweets"]
         replies_collection = db[topic + "-replies"]
         tweet_mentions_collection = db[topic + "-mentions"]
+        responses_collection = db[topic + "-responses"]
+        event_table_collection = db[topic + "-event-table"]
         event_tweets_collection = event_db[topic + "-event_tweets"]
 
-        if db_name not in client.list_database_names():
-            raise ValueError(f"Database does not exist: {db_name}.")
-
         if topic not in db.list_collection_names():
             raise ValueError(f"Collection does not exist: {topic}.")
 
@@ -394,22 +955,14 @@ def main(topic, keywords_filepath):
 
         social_network_filepath = list(topic_raw_data_dir.glob('*.adjlist'))[0]
 
-        # build initial graph from file
-        social_network = nx.read_adjlist(social_network_filepath,
-                                         delimiter=',',
-                                         create_using=nx.DiGraph)
+        # build the graph of users in the database, or load it from a
+        # previous run
+        topic_interim_data_dir = os.path.join(data_root_dir, 'interim', topic)
+        social_network = load_filtered_graph(
+            social_network_filepath, users_collection, topic_interim_data_dir)
     except (ValueError, FileNotFoundError, FileExistsError, KeyError) as error:
         logger.error(error)
     else:
-        # Remove all nodes without users in the database
-        widgets = ['Filtering users not in database, ',
-                   progressbar.Counter('Processed %(value)02d'),
-                   ' users (', progressbar.Timer(), ')']
-        bar = progressbar.ProgressBar(widgets=widgets)
-        for user in bar(list(social_network.nodes)):
-            if not users_collection.find_one({'id': user}):
-                social_network.remove_node(user)
-
         #print('Saving filtered adjacency list')
         #nx.write_adjlist(social_network, social_network_filepath, delimiter=',')
 
@@ -423,74 +976,363 @@ def main(topic, keywords_filepath):
         parts[-2] = 'reports'
         topic_reports_dir = Path(*parts)
 
-        # initialise node attributes to have desired info from dataset
-        user_ids = nx.nodes(social_network)
-        process_user_attribs(
-             users=user_ids, tweet_collection=tweet_collection,
-             event_collection=event_tweets_collection,
-             tweet_mentions_collection=tweet_mentions_collection,
-             users_collection=users_collection,
-             retweet_collection=retweets_collection,
-             replies_collection=replies_collection,
-             user_attribs_collection=user_attribs_collection
-             )
         keywords = utils.get_keywords_from_file(keywords_filepath)
 
         # Split the edges into sections to allow partial processing
-        edge_chunks = list(chunks(nx.edges(social_network), 5000))
+        edge_chunks = list(chunks(nx.edges(social_network), CHUNK_SIZE))
         print('Split edges into ', len(edge_chunks), ' sections')
 
-        # For each chunk of edges
-        for num, edges in enumerate(edge_chunks, start=1):
-            # create indexed name for dataset file
-            dataset_file = 'dataset' + str(num) + '.h5'
-            raw_dataset_dir = topic_raw_data_dir.parent
+        # the manifest records every stage, checkpoint and chunk completed,
+        # so a restarted run only computes what is missing. The run's key
+        # covers its inputs, so new data starts a new run
+        raw_dataset_dir = topic_raw_data_dir.parent
+        extension = OUTPUT_FORMATS[output_format]
+        checkpoint_dir = os.path.join(topic_interim_data_dir, 'checkpoints')
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        manifest = RunManifest(os.path.join(topic_interim_data_dir,
+                                            'manifest.sqlite'))
+        is_new_manifest = manifest.is_empty()
+        run = manifest.begin_run(
+            [edge for edges in edge_chunks for edge in edges], CHUNK_SIZE,
+            output_format, settings=(
+                sentiment_engine, file_fingerprint(keywords_filepath),
+                collections_version([
+                    tweet_collection, retweets_collection,
+                    replies_collection, users_collection,
+                    event_tweets_collection])))
+        if is_new_manifest:
+            import_dataset_files(manifest, run, len(edge_chunks),
+                                 raw_dataset_dir, extension)
+
+        # collections in memory do not outlive the process, so a run on a
+        # dump computes every stage again
+        record_stages = dump_dir is None
+
+        # initialise node attributes to have desired info from dataset
+        user_ids = nx.nodes(social_network)
+        run_stage(manifest, run, 'user_attribs', partial(
+            process_user_attribs,
+            users=user_ids, tweet_collection=tweet_collection,
+            event_collection=event_tweets_collection,
+            tweet_mentions_collection=tweet_mentions_collection,
+            users_collection=users_collection,
+            retweet_collection=retweets_collection,
+            replies_collection=replies_collection,
+            user_attribs_collection=user_attribs_collection,
+            responses_collection=responses_collection,
+            incremental=incremental), record=record_stages)
+
+        # each user's earliest event tweet is summarised once for all edges
+        run_stage(manifest, run, 'event_table', partial(
+            process_event_table, event_tweets_collection,
+            event_table_collection), record=record_stages)
+        event_table = build_features.load_event_table(event_table_collection)
+
+        # who follows whom, built once per users collection
+        follow_graph_path = follow_graph_cache_path(users_collection,
+                                                    topic_interim_data_dir)
+        follow_graph = load_follow_graph(users_collection, follow_graph_path)
+
+        # user attribute documents are read-only from here on, so a single
+        # cache can be shared by every chunk of edges
+        user_attribs_cache = UserAttribsCache(user_attribs_collection)
+
+        # per-user features are computed once for all users and joined to
+        # each edge
+        user_features_path = os.path.join(topic_interim_data_dir,
+                                          f'user-features-{run[:12]}.pickle')
+        run_stage(manifest, run, 'user_features', partial(
+            save_user_features, user_attribs_collection, keywords, user_ids,
+            user_features_path), path=user_features_path,
+            record=record_stages)
+        user_features = user_feature_rows(pd.read_pickle(user_features_path))
+
+        tasks, pending = checkpoint_tasks(manifest, run, edge_chunks,
+                                          checkpoint_size)
+        logger.info(f'run {run}: {len(tasks)} checkpoints to compute in '
+                    f'{len(pending)} chunks')
+
+        key_saveas = os.path.join(topic_reports_dir.parent, 'dataset.keys')
+
+        def finish_chunk(num):
+            """ Assembles a chunk whose checkpoints are all written """
+            dataset_file = 'dataset' + str(num) + extension
             processed_saveas = os.path.join(raw_dataset_dir, dataset_file)
 
-            # if that file does not exist
-            if not os.path.exists(processed_saveas):
-                # prepare table for dataframe
-                results = build_features.calculate_network_diffusion(
-                    edges, keywords,
-                    node_collection=user_attribs_collection,
-                    tweet_collection=tweet_collection,
-                    retweets_collection=retweets_collection,
-                    replies_collection=replies_collection,
-                    event_tweets_collection=event_tweets_collection,
-                    users_collection=users_collection,
-                    additional_attr=True,
-                    do_not_add_sentiment=False
-                    )
-
-                df = pd.DataFrame(results)
-
-                # save processed dataset to hdf file
-                key = utils.generate_random_id(15)
-
-                # save features to a centralised raw directory
-                logger.info(f'saving computed features to "{processed_saveas}"')
-                df.to_hdf(processed_saveas, key=key)
+            # save processed dataset to hdf file
+            key = utils.generate_random_id(15)
 
+            # save features to a centralised raw directory
+            logger.info(f'saving computed features to "{processed_saveas}"')
+            assemble_chunk(manifest, run, num, processed_saveas,
+                           output_format, key=key)
+            if output_format == 'hdf':
                 # save key to reports directory
                 if not os.path.exists(topic_reports_dir):
                     os.makedirs(topic_reports_dir)
-                key_saveas = os.path.join(topic_reports_dir.parent, 'dataset.keys')
                 logger.info(f'saving dataset key to "{key_saveas}"')
+                append_dataset_key(key_saveas, key, current_date_and_time,
+                                   topic_raw_data_dir, topic)
+
+        # chunks interrupted between their last checkpoint and assembly
+        for num in [num for num, n_left in pending.items() if n_left == 0]:
+            finish_chunk(num)
+
+        if workers > 1:
+            # workers read the text cache file as it is when they start
+            text_cache.commit()
+            # imap hands checkpoints back in order, so files are written
+            # exactly as in a serial run
+            pool = Pool(processes=workers, initializer=init_edge_worker,
+                        initargs=(topic, keywords, user_features,
+                                  event_table, follow_graph_path,
+                                  sentiment_engine,
+                                  storage if dump_dir is not None else None,
+                                  text_cache_path))
+            computed = pool.imap(compute_edge_chunk, tasks)
+        elif async_concurrency > 0:
+            chunk_rows = async_features.network_diffusion_chunks(
+                (edges for _, edges in tasks), keywords, db_name,
+                event_db_name, topic, user_features=user_features,
+                event_table=event_table, follow_graph=follow_graph,
+                concurrency=async_concurrency,
+                storage=storage if dump_dir is not None else None)
+            computed = zip((key for key, _ in tasks), chunk_rows)
+        else:
+            collections = edge_collections(
+                db, event_db, topic, node_collection=user_attribs_cache)
+            # like the user attributes, response maps serve every chunk
+            response_maps = build_features.response_maps_cache()
+            computed = ((key, edge_chunk_rows(edges, keywords, collections,
+                                              user_features,
+                                              event_table=event_table,
+                                              follow_graph=follow_graph,
+                                              response_maps=response_maps))
+                        for key, edges in tasks)
+
+        # For each checkpoint of edges
+        started = time.perf_counter()
+        for (num, start, stop), rows in computed:
+            checkpoint_path = os.path.join(
+                checkpoint_dir, f'{run[:12]}-{num}-{start}{extension}')
+            n_rows = write_dataset(rows, checkpoint_path, output_format,
+                                   key='checkpoint')
+            finished = time.perf_counter()
+            manifest.record_checkpoint(run, num, start, stop, n_rows,
+                                       checkpoint_path, finished - started)
+            started = finished
+
+            pending[num] -= 1
+            if pending[num] == 0:
+                finish_chunk(num)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+            pool = None
+    finally:
+        if pool is not None:
+            # a failed run does not wait for the workers' queued chunks
+            pool.terminate()
+            pool.join()
 
-                mode = 'a'
-                if not os.path.exists(key_saveas):
-                    mode = 'w'
+        if manifest is not None:
+            manifest.close()
 
-                with open(key_saveas, mode) as f:
-                    f.write('\n***\n\nmake_dataset.py '
-                            f'started at {current_date_and_time}')
-                    f.write(f'\nNetwork path: {topic_raw_data_dir}')
-                    f.write(f'\nTopic: {topic}')
-                    f.write(f'\nKey: {key}\n\n')
-    finally:
-        if client is not None:
+        text_cache.log_stats(logger)
+        text_cache.close()
+
+        if storage is not None:
             logger.info('ending all server sessions')
-            client.close()
+            storage.close()
+
+
+def collections_version(collections):
+    """ Cheap marker of the documents in collections: their counts and
+    largest _ids. Documents added or removed since change it. """
+    parts = []
+    for collection in collections:
+        last = collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+        parts.append('{}:{}:{}'.format(
+            collection.name, collection.estimated_document_count(),
+            last['_id'] if last is not None else None))
+    return ','.join(parts)
+
+
+def import_dataset_files(manifest, run, n_chunks, dataset_dir, extension):
+    """ Records the dataset files written before the manifest existed as
+    completed chunks of run, since they were never computed again either
+
+    Arguments:
+        manifest {RunManifest} -- journal of the run
+        run {str} -- run key
+        n_chunks {int} -- number of chunks of the run
+        dataset_dir {str} -- directory of the dataset files
+        extension {str} -- dataset file extension
+    """
+    for num in range(1, n_chunks + 1):
+        path = os.path.join(dataset_dir, f'dataset{num}{extension}')
+        if os.path.exists(path):
+            logging.info(f'importing "{path}" into the manifest')
+            manifest.record_chunk(run, num, None, path, None)
+
+
+def run_stage(manifest, run, stage, compute, path=None, record=True):
+    """ Runs a preprocessing stage unless the manifest records it as
+    completed by an earlier attempt of the run
+
+    Arguments:
+        manifest {RunManifest} -- journal of the run
+        run {str} -- run key
+        stage {str} -- stage name
+        compute {callable} -- runs the stage
+
+    Keyword Arguments:
+        path {str} -- file the stage writes, which must still exist for
+        the stage to count as completed (default: {None})
+        record {bool} -- look up and record the stage, False when its
+        results do not outlive the process (default: {True})
+
+    Returns:
+        bool -- whether the stage ran
+    """
+    if record and manifest.stage_completed(run, stage):
+        logging.info(f'skipping {stage}, completed by an earlier attempt')
+        return False
+
+    started = time.perf_counter()
+    compute()
+    if record:
+        manifest.record_stage(run, stage, path,
+                              time.perf_counter() - started)
+    return True
+
+
+def save_user_features(user_attribs_collection, keywords, user_ids, path):
+    """ Computes the user feature matrix and pickles it under a temporary
+    name, renamed to path once complete """
+    tmp_path = path + '.tmp'
+    compute_user_feature_matrix(user_attribs_collection, keywords,
+                                user_ids=user_ids).to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def checkpoint_tasks(manifest, run, edge_chunks, checkpoint_size):
+    """ Splits the edges of incomplete chunks that no recorded checkpoint
+    covers into checkpoints of at most checkpoint_size edges
+
+    Arguments:
+        manifest {RunManifest} -- journal of the run
+        run {str} -- run key
+        edge_chunks {list} -- lists of edges, chunk 1 first
+        checkpoint_size {int} -- edges per checkpoint
+
+    Returns:
+        tuple -- ((chunk number, start, stop), edges) tasks in edge order,
+        and the number of tasks left in each incomplete chunk
+    """
+    completed = manifest.completed_chunks(run)
+
+    tasks = []
+    pending = {}
+    for num, edges in enumerate(edge_chunks, start=1):
+        if num in completed:
+            continue
+
+        pending[num] = 0
+        checkpoints = manifest.completed_checkpoints(run, num)
+        position = 0
+        for start, stop, _ in checkpoints + [(len(edges), len(edges), None)]:
+            for i in range(position, start, checkpoint_size):
+                j = min(i + checkpoint_size, start)
+                tasks.append(((num, i, j), edges[i:j]))
+                pending[num] += 1
+            position = max(position, stop)
+
+    return tasks, pending
+
+
+def write_dataset(rows, path, output_format, key='dataset'):
+    """ Writes feature rows to a dataset file under a temporary name, and
+    renames it to path once complete
+
+    Arguments:
+        rows {iterable} -- feature rows, or a DataFrame of them
+        path {str} -- dataset file
+        output_format {str} -- one of OUTPUT_FORMATS
+
+    Keyword Arguments:
+        key {str} -- HDF key (default: {'dataset'})
+
+    Returns:
+        int -- rows written
+    """
+    if output_format == 'parquet':
+        with ParquetFeatureSink(path) as sink:
+            if isinstance(rows, pd.DataFrame):
+                sink.write_frame(rows)
+            else:
+                sink.write_rows(rows)
+        return sink.n_rows
+
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+    tmp_path = path + '.tmp'
+    df.to_hdf(tmp_path, key=key, mode='w')
+    os.replace(tmp_path, path)
+    return len(df)
+
+
+def read_dataset(path, output_format):
+    if output_format == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_hdf(path)
+
+
+def assemble_chunk(manifest, run, num, path, output_format, key='dataset'):
+    """ Joins the checkpoints of a chunk, in edge order, into its dataset
+    file, records the chunk and removes the checkpoint files
+
+    Arguments:
+        manifest {RunManifest} -- journal of the run
+        run {str} -- run key
+        num {int} -- chunk number
+        path {str} -- dataset file
+        output_format {str} -- one of OUTPUT_FORMATS
+
+    Keyword Arguments:
+        key {str} -- HDF key (default: {'dataset'})
+    """
+    checkpoint_paths = [checkpoint_path for _, _, checkpoint_path
+                        in manifest.completed_checkpoints(run, num)]
+
+    if output_format == 'parquet':
+        with ParquetFeatureSink(path) as sink:
+            for checkpoint_path in checkpoint_paths:
+                sink.write_frame(read_dataset(checkpoint_path, output_format))
+    else:
+        df = pd.concat([read_dataset(checkpoint_path, output_format)
+                        for checkpoint_path in checkpoint_paths],
+                       ignore_index=True)
+        write_dataset(df, path, output_format, key=key)
+
+    n_rows, seconds = manifest.checkpoint_stats(run, num)
+    manifest.record_chunk(run, num, n_rows, path, seconds)
+    for checkpoint_path in checkpoint_paths:
+        os.remove(checkpoint_path)
+
+
+def append_dataset_key(key_saveas, key, started_at, network_path, topic):
+    """ Appends the HDF key of a dataset file to the keys report """
+    mode = 'a'
+    if not os.path.exists(key_saveas):
+        mode = 'w'
+
+    with open(key_saveas, mode) as f:
+        f.write('\n***\n\nmake_dataset.py '
+                f'started at {started_at}')
+        f.write(f'\nNetwork path: {network_path}')
+        f.write(f'\nTopic: {topic}')
+        f.write(f'\nKey: {key}\n\n')
 
 
 # Split a list into chunks of size n
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""Generates a synthetic topic shaped like the Twitter data make_features
+reads, at any scale, so the pipeline can be run and timed without the real
+database.
+
+Users follow each other in a power-law graph: a few accounts are followed by
+many users and most by few, and how many accounts users follow is heavy
+tailed too. Users are stored in the old (followers_count, following) and new
+(public_metrics, following_ids) formats.
+
+Every tweet is a v2 document (author_id, referenced_tweets) in the topic
+collection. Retweets are also stored in the v1 format (user,
+retweeted_status) in the retweets collection, and replies in the replies
+collection. Event tweets store their entities and metrics as strings, as in
+the event database. Responses and mentions mostly go to accounts the user
+follows, so follow edges carry diffusion, and some responses are to event
+tweets.
+
+    python -m indiff.data.make_synthetic synthetic --n-users 10000
+"""
+
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
+from pathlib import Path
+
+import click
+import networkx as nx
+from dotenv import find_dotenv, load_dotenv
+
+from indiff.storage import MemoryStorage, MongoStorage, dump_collections
+
+KEYWORDS = ['anniversary', 'celebrate', 'birthday', 'party']
+
+WORDS = KEYWORDS + ['good', 'bad', 'happy', 'sad', 'great', 'terrible',
+                    'love', 'hate', 'awesome', 'awful', 'nice', 'day', 'the',
+                    'a', 'is', 'this', 'today', 'fun', 'boring', 'year',
+                    'friends', 'not', 'very', 'again', 'time']
+
+# first tweet date and length of the period tweets are spread over
+START_DATE = datetime(2020, 3, 1)
+PERIOD = timedelta(days=60)
+
+# delay of a response after the tweet it responds to, in seconds
+MEAN_RESPONSE_DELAY = 6 * 3600
+
+V1_DATE_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+EVENT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+RESPONSE_KINDS = ('retweeted', 'quoted', 'replied_to')
+
+
+def power_law_following(n_users, avg_following, exponent, rng):
+    """Draws who follows whom.
+
+    Each user is followed with a probability proportional to
+    popularity rank ** -exponent, ranks shuffled over the users. The number
+    of accounts a user follows is Pareto distributed with mean
+    avg_following.
+
+    Arguments:
+        n_users {int} -- number of users
+        avg_following {float} -- mean number of accounts followed
+        exponent {float} -- popularity power-law exponent
+        rng {Random} -- random generator
+
+    Returns:
+        list -- indices of the users each user follows
+    """
+    ranks = list(range(n_users))
+    rng.shuffle(ranks)
+    cum_weights = list(accumulate((rank + 1) ** -exponent for rank in ranks))
+
+    alpha = 2.0
+    following = []
+    for user in range(n_users):
+        n_following = int(avg_following * (alpha - 1) / alpha *
+                          rng.paretovariate(alpha))
+        n_following = min(n_following, n_users - 1)
+
+        followed = set()
+        # popular accounts are drawn again and again, so give up on
+        # reaching n_following after a while
+        for _ in range(10):
+            if len(followed) >= n_following:
+                break
+            for other in rng.choices(range(n_users), cum_weights=cum_weights,
+                                     k=n_following - len(followed)):
+                if other != user:
+                    followed.add(other)
+        following.append(sorted(followed))
+
+    return following
+
+
+def _random_date(rng):
+    return START_DATE + timedelta(seconds=rng.randrange(
+        int(PERIOD.total_seconds())))
+
+
+def _text(rng, mentions=()):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(4, 18))]
+    return ' '.join(['@' + username for username in mentions] + words)
+
+
+def _entities(rng, mentions):
+    entities = {'mentions': [{'username': username} for username in mentions],
+                'hashtags': [], 'urls': []}
+    if rng.random() < 0.25:
+        entities['hashtags'].append({'tag': rng.choice(KEYWORDS)})
+    if rng.random() < 0.2:
+        entities['urls'].append({'url': 'https://t.co/' + str(
+            rng.randrange(10 ** 8))})
+    return entities
+
+
+def _public_metrics(rng):
+    return {'retweet_count': int(rng.paretovariate(1.5)) - 1,
+            'reply_count': rng.randint(0, 2),
+            'like_count': int(rng.paretovariate(1.2)) - 1,
+            'quote_count': rng.randint(0, 1)}
+
+
+def user_document(rng, user_id, username, following, n_followers,
+                  new_format):
+    """ User document in the new (v2) or old format """
+    description = rng.choice(['', 'Tweets about ' + rng.choice(WORDS),
+                              'I love ' + rng.choice(KEYWORDS)])
+    if new_format:
+        metrics = {'followers_count': n_followers,
+                   'following_count': len(following),
+                   'tweet_count': rng.randint(0, 5000)}
+        return {'id': user_id, 'username': username,
+                'description': description,
+                # some imports stored metrics as a JSON string
+                'public_metrics': str(metrics) if rng.random() < 0.1
+                else metrics,
+                'following_ids': following}
+
+    return {'id': user_id, 'username': username, 'description': description,
+            'followers_count': n_followers, 'following_count': len(following),
+            'following': following}
+
+
+def v1_retweet(retweet, original, user):
+    """ v1 format document of a retweet, as in the retweets collection """
+    return {'id': int(retweet['id']), 'id_str': retweet['id'],
+            'full_text': retweet['text'],
+            'created_at': retweet['created_at'].strftime(V1_DATE_FORMAT),
+            'user': {'id_str': user['id'], 'screen_name': user['username'],
+                     'description': user['description']},
+            'retweeted_status': {
+                'id_str': original['id'],
+                'full_text': original['text'],
+                'created_at': original['created_at'].strftime(
+                    V1_DATE_FORMAT),
+                'user': {'id_str': original['author_id']}},
+            'entities': {'hashtags': [{'text': hashtag['tag']} for hashtag
+                                      in original['entities']['hashtags']],
+                         'urls': original['entities']['urls'],
+                         'user_mentions': []},
+            'public_metrics': retweet['public_metrics']}
+
+
+def original_tweet(rng, author_id, mentions, hashtag=None):
+    """ v2 format document of a tweet that responds to no other """
+    entities = _entities(rng, mentions)
+    text = _text(rng, mentions)
+    if hashtag is not None:
+        entities['hashtags'] = [{'tag': hashtag}]
+        text += ' #' + hashtag
+    tweet = {'author_id': author_id, 'text': text,
+             'created_at': _random_date(rng), 'entities': entities,
+             'public_metrics': _public_metrics(rng)}
+    if rng.random() < 0.2:
+        tweet['attachments'] = {'media_keys': [
+            '3_' + str(rng.randrange(10 ** 12))]}
+    return tweet
+
+
+def event_document(event):
+    """ Event tweet as stored in the event database, with its date in the
+    event format and its entities and metrics as strings """
+    return dict(event, created_at=event['created_at'].strftime(
+        EVENT_DATE_FORMAT), entities=str(event['entities']),
+        public_metrics=str(event['public_metrics']))
+
+
+def generate_topic(n_users=1000, tweets_per_user=20, avg_following=20,
+                   exponent=1.2, response_ratio=0.4, mention_ratio=0.3,
+                   event_ratio=0.2, new_format_ratio=0.5, seed=0):
+    """Generates the collections and follow network of a synthetic topic.
+
+    Keyword Arguments:
+        n_users {int} -- number of users (default: {1000})
+        tweets_per_user {int} -- mean tweets per user (default: {20})
+        avg_following {float} -- mean accounts followed (default: {20})
+        exponent {float} -- popularity power-law exponent (default: {1.2})
+        response_ratio {float} -- share of tweets responding to another
+        tweet (default: {0.4})
+        mention_ratio {float} -- share of tweets mentioning users
+        (default: {0.3})
+        event_ratio {float} -- event tweets per tweet (default: {0.2})
+        new_format_ratio {float} -- share of users in the new format
+        (default: {0.5})
+        seed {int} -- random seed (default: {0})
+
+    Returns:
+        dict, DiGraph -- documents of each collection, by collection suffix
+        ('' for the tweets), and the network, with an edge from each user to
+        each of their followers
+    """
+    rng = random.Random(seed)
+
+    user_ids = [str(10 ** 9 + 7919 * i) for i in range(n_users)]
+    usernames = ['user_' + user_id for user_id in user_ids]
+    usernames_by_id = dict(zip(user_ids, usernames))
+    following = power_law_following(n_users, avg_following, exponent, rng)
+    followers = [[] for _ in range(n_users)]
+    for user, followed in enumerate(following):
+        for other in followed:
+            followers[other].append(user)
+
+    users = [user_document(rng, user_ids[i], usernames[i],
+                           [user_ids[other] for other in following[i]],
+                           len(followers[i]),
+                           rng.random() < new_format_ratio)
+             for i in range(n_users)]
+
+    def mentions_of(user):
+        if rng.random() >= mention_ratio:
+            return []
+        candidates = following[user] or range(n_users)
+        return [usernames[other] for other in
+                rng.sample(candidates, min(len(candidates),
+                                           rng.randint(1, 2)))]
+
+    # original and event tweets first, then responses to earlier tweets of
+    # followed accounts
+    tweets = []
+    originals = [[] for _ in range(n_users)]
+    events = [[] for _ in range(n_users)]
+    n_responses = []
+    for user in range(n_users):
+        n_tweets = rng.randint(1, 2 * tweets_per_user - 1)
+        n_responses.append(sum(rng.random() < response_ratio
+                               for _ in range(n_tweets)))
+        for _ in range(n_tweets - n_responses[user]):
+            tweet = original_tweet(rng, user_ids[user], mentions_of(user))
+            originals[user].append(tweet)
+            tweets.append(tweet)
+        for _ in range(sum(rng.random() < event_ratio
+                           for _ in range(n_tweets))):
+            events[user].append(original_tweet(
+                rng, user_ids[user], mentions_of(user),
+                hashtag=rng.choice(KEYWORDS)))
+
+    responses = []
+    for user in range(n_users):
+        for _ in range(n_responses[user]):
+            sources = [other for other in following[user] if originals[other]]
+            if not sources or rng.random() < 0.1:
+                # now and then a user responds to someone they do not follow
+                sources = [other for other in (rng.randrange(n_users)
+                                               for _ in range(10))
+                           if originals[other] and other != user][:1]
+            if not sources:
+                continue
+            source = rng.choice(sources)
+            if events[source] and rng.random() < 0.2:
+                original = rng.choice(events[source])
+            else:
+                original = rng.choice(originals[source])
+
+            kind = rng.choice(RESPONSE_KINDS)
+            mentions = mentions_of(user)
+            if kind == 'retweeted':
+                text = 'RT @{}: {}'.format(
+                    usernames_by_id[original['author_id']], original['text'])
+            else:
+                text = _text(rng, mentions)
+            response = {
+                'author_id': user_ids[user], 'text': text,
+                'created_at': original['created_at'] + timedelta(
+                    seconds=int(rng.expovariate(1 / MEAN_RESPONSE_DELAY))),
+                'entities': _entities(rng, mentions),
+                'public_metrics': _public_metrics(rng),
+                'referenced_tweets': [{'type': kind, 'original': original}]}
+            if kind != 'retweeted' and rng.random() < 0.1:
+                response['attachments'] = {'media_keys': [
+                    '3_' + str(rng.randrange(10 ** 12))]}
+            if kind == 'replied_to':
+                response['in_reply_to_user_id'] = original['author_id']
+            responses.append(response)
+            tweets.append(response)
+
+    # ids are handed out in date order, as tweet ids increase with time
+    event_tweets = [event for user_events in events for event in user_events]
+    tweet_ids = iter(range(10 ** 17, 10 ** 18, 7177))
+    for tweet in sorted(tweets + event_tweets,
+                        key=lambda tweet: tweet['created_at']):
+        tweet['id'] = str(next(tweet_ids))
+    tweets.sort(key=lambda tweet: tweet['created_at'])
+
+    users_by_id = {user['id']: user for user in users}
+    retweets = []
+    replies = []
+    for response in responses:
+        (referenced,) = response['referenced_tweets']
+        original = referenced.pop('original')
+        referenced['id'] = original['id']
+        if referenced['type'] == 'retweeted':
+            retweets.append(v1_retweet(response, original,
+                                       users_by_id[response['author_id']]))
+        elif referenced['type'] == 'replied_to':
+            replies.append(dict(response))
+
+    network = nx.DiGraph()
+    network.add_nodes_from(user_ids)
+    network.add_edges_from((user_ids[other], user_ids[user])
+                           for user, followed in enumerate(following)
+                           for other in followed)
+
+    collections = {'': tweets, '-users': users, '-retweets': retweets,
+                   '-replies': replies,
+                   '-event_tweets': [event_document(event)
+                                     for event in event_tweets]}
+    return collections, network
+
+
+def load_topic(storage, topic, collections, batch_size=1000):
+    """ Inserts generated collections into a storage's topic collections """
+    for suffix, documents in collections.items():
+        collection = storage[topic + suffix]
+        for i in range(0, len(documents), batch_size):
+            collection.insert_many(documents[i:i + batch_size])
+
+
+def write_topic(topic, collections, network, raw_dir, dump_dir):
+    """Writes a generated topic where make_features reads it.
+
+    Arguments:
+        topic {str} -- topic name
+        collections {dict} -- see generate_topic
+        network {DiGraph} -- see generate_topic
+        raw_dir {str} -- raw data directory, which gets the network's
+        <topic>.adjlist and keywords.txt in a <topic> folder
+        dump_dir {str} -- folder the collections are dumped to, which
+        make_features --dump-dir reads
+    """
+    topic_raw_dir = os.path.join(raw_dir, topic)
+    os.makedirs(topic_raw_dir, exist_ok=True)
+    nx.write_adjlist(network, os.path.join(topic_raw_dir, f'{topic}.adjlist'),
+                     delimiter=',')
+    with open(os.path.join(topic_raw_dir, 'keywords.txt'), 'w') as f:
+        f.write('\n'.join(KEYWORDS) + '\n')
+
+    storage = MemoryStorage(copy_documents=False, indexes=())
+    load_topic(storage, topic, collections)
+    dump_collections(storage, storage.list_collection_names(), dump_dir)
+
+
+@click.command()
+@click.argument('topic')
+@click.option('--n-users', default=1000, show_default=True,
+              help='Number of users.')
+@click.option('--tweets-per-user', default=20, show_default=True,
+              help='Mean number of tweets per user.')
+@click.option('--avg-following', default=20, show_default=True,
+              help='Mean number of accounts a user follows.')
+@click.option('--exponent', default=1.2, show_default=True,
+              help='Power-law exponent of account popularity.')
+@click.option('--seed', default=0, show_default=True, help='Random seed.')
+@click.option('--mongo', is_flag=True,
+              help='Also insert the collections into MongoDB.')
+def main(topic, n_users, tweets_per_user, avg_following, exponent, seed,
+         mongo):
+    """ Generates a synthetic topic: its network and keywords in
+    data/raw/<topic> and a dump of its collections in
+    data/interim/<topic>/dump
+    """
+    logger = logging.getLogger(__name__)
+
+    root_dir = Path(__file__).resolve().parents[2]
+    data_root_dir = os.path.join(root_dir, 'data')
+    raw_dir = os.path.join(data_root_dir, 'raw')
+    dump_dir = os.path.join(data_root_dir, 'interim', topic, 'dump')
+
+    db_name = "RPE_twitteranniv"
+    storage = None
+
+    try:
+        if mongo:
+            storage = MongoStorage.connect(db_name, appname=__file__)
+            if topic in storage.list_collection_names():
+                raise ValueError(f"Collection already exists: {topic}.")
+    except ValueError as error:
+        logger.error(error)
+    else:
+        logger.info(f'generating {n_users} users')
+        collections, network = generate_topic(
+            n_users=n_users, tweets_per_user=tweets_per_user,
+            avg_following=avg_following, exponent=exponent, seed=seed)
+        for suffix, documents in collections.items():
+            logger.info(f'{topic + suffix}: {len(documents)} documents')
+        logger.info(f'{network.number_of_edges()} follow edges')
+
+        write_topic(topic, collections, network, raw_dir, dump_dir)
+        logger.info(f'wrote "{os.path.join(raw_dir, topic)}" and '
+                    f'"{dump_dir}"')
+
+        if storage is not None:
+            load_topic(storage, topic, collections)
+            logger.info(f'inserted {topic} into {db_name}')
+    finally:
+        if storage is not None:
+            logger.info('ending all server sessions')
+            storage.close()
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,200 @@
+"""Module contains the journal that lets feature runs resume after a crash.
+
+A run is identified by a hash of its ordered edges, its chunk size, its
+output format and any other settings its results depend on. The
+preprocessing stages that run before the edge features are recorded as
+they complete, and skipped when the run is restarted. Every checkpoint, a
+slice of a chunk's edges whose features were written to their own file, is
+recorded with its edge range, row count, file and timing as soon as the
+file has been renamed into place. When every checkpoint of a chunk is done
+they are assembled into the chunk's dataset file, which is recorded in
+turn. A restarted run only computes the ranges that were not recorded.
+
+    manifest = RunManifest('manifest.sqlite')
+    run = manifest.begin_run(edges, chunk_size, 'hdf')
+    manifest.record_stage(run, 'user_attribs', None, seconds)
+    manifest.record_checkpoint(run, num, start, stop, rows, path, seconds)
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run TEXT PRIMARY KEY,
+    n_edges INTEGER,
+    chunk_size INTEGER,
+    output_format TEXT,
+    started_at REAL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    run TEXT,
+    stage TEXT,
+    path TEXT,
+    seconds REAL,
+    finished_at REAL,
+    PRIMARY KEY (run, stage)
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run TEXT,
+    chunk INTEGER,
+    start INTEGER,
+    stop INTEGER,
+    rows INTEGER,
+    path TEXT,
+    seconds REAL,
+    finished_at REAL,
+    PRIMARY KEY (run, chunk, start)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    run TEXT,
+    chunk INTEGER,
+    rows INTEGER,
+    path TEXT,
+    seconds REAL,
+    finished_at REAL,
+    PRIMARY KEY (run, chunk)
+);
+'''
+
+
+def edge_set_hash(edges, *parts):
+    """ SHA-1 of an ordered sequence of edges and any other run settings """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(f'{part}\n'.encode('utf-8'))
+    for src, dest in edges:
+        digest.update(f'{src},{dest}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class RunManifest(object):
+    """SQLite journal of completed stages, checkpoints and chunks.
+
+    Every record is committed before the call returns, so it survives the
+    process being killed. Files are only recorded once complete, and a
+    recorded file that has since disappeared does not count as done.
+
+    Arguments:
+        path {str} -- SQLite file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def begin_run(self, edges, chunk_size, output_format, settings=()):
+        """Registers a run, or finds the one a previous process started.
+
+        Arguments:
+            edges {list} -- (source, destination) pairs, in chunk order
+            chunk_size {int} -- edges per chunk
+            output_format {str} -- dataset file format
+
+        Keyword Arguments:
+            settings {tuple} -- anything else the run's results depend on,
+            such as versions of its inputs (default: {()})
+
+        Returns:
+            str -- the run's key
+        """
+        run = edge_set_hash(edges, chunk_size, output_format, *settings)
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?)',
+                (run, len(edges), chunk_size, output_format, time.time()))
+        return run
+
+    def is_empty(self):
+        """ Whether no run was ever registered """
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM runs').fetchone()[0] == 0
+
+    def stage_completed(self, run, stage):
+        """ Whether a stage of a run is recorded, and its file, if it wrote
+        one, still exists """
+        row = self.connection.execute(
+            'SELECT path FROM stages WHERE run = ? AND stage = ?',
+            (run, stage)).fetchone()
+        return row is not None and (row[0] is None or os.path.exists(row[0]))
+
+    def record_stage(self, run, stage, path, seconds):
+        """Records a completed preprocessing stage.
+
+        Arguments:
+            run {str} -- run key
+            stage {str} -- stage name
+            path {str} -- file the stage wrote, None if it only wrote to the
+            database
+            seconds {float} -- time taken by the stage
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?)',
+                (run, stage, path, seconds, time.time()))
+
+    def completed_chunks(self, run):
+        """ Returns the dataset file of every completed chunk, by number """
+        cursor = self.connection.execute(
+            'SELECT chunk, path FROM chunks WHERE run = ?', (run,))
+        return {chunk: path for chunk, path in cursor
+                if os.path.exists(path)}
+
+    def completed_checkpoints(self, run, chunk):
+        """ Returns the (start, stop, path) of every completed checkpoint of
+        a chunk, in edge order """
+        cursor = self.connection.execute(
+            'SELECT start, stop, path FROM checkpoints '
+            'WHERE run = ? AND chunk = ? ORDER BY start', (run, chunk))
+        return [(start, stop, path) for start, stop, path in cursor
+                if os.path.exists(path)]
+
+    def record_checkpoint(self, run, chunk, start, stop, rows, path,
+                          seconds):
+        """Records a checkpoint whose file has been written.
+
+        Arguments:
+            run {str} -- run key
+            chunk {int} -- chunk number
+            start {int} -- index of the first edge in the chunk
+            stop {int} -- index after the last edge in the chunk
+            rows {int} -- rows written
+            path {str} -- checkpoint file
+            seconds {float} -- time taken to compute the rows
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO checkpoints '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (run, chunk, start, stop, rows, path, seconds, time.time()))
+
+    def record_chunk(self, run, chunk, rows, path, seconds):
+        """ Records a chunk whose dataset file has been assembled, and
+        forgets its checkpoints """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?)',
+                (run, chunk, rows, path, seconds, time.time()))
+            self.connection.execute(
+                'DELETE FROM checkpoints WHERE run = ? AND chunk = ?',
+                (run, chunk))
+
+    def checkpoint_stats(self, run, chunk):
+        """ Returns the rows and seconds of a chunk's checkpoints """
+        rows, seconds = self.connection.execute(
+            'SELECT COALESCE(SUM(rows), 0), COALESCE(SUM(seconds), 0) '
+            'FROM checkpoints WHERE run = ? AND chunk = ?',
+            (run, chunk)).fetchone()
+        return rows, seconds
+
+    def close(self):
+        self.connection.close()
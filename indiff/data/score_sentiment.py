@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+from collections import deque
+from multiprocessing import Pool
+
+import click
+import progressbar
+import pymongo
+from dotenv import find_dotenv, load_dotenv
+from pymongo import UpdateOne
+
+from indiff.cache import TextCache
+from indiff.utils import (SENTIMENT_ENGINES, sentiment_labels,
+                          sentiment_polarities, set_sentiment_engine)
+
+
+def tweet_text(document):
+    """ Returns the text of a raw tweet document, as Tweet.text does """
+    if 'full_text' in document:
+        return document['full_text']
+
+    return document.get('text', '')
+
+
+def score_batch(batch):
+    """ Scores a batch of (document id, text) pairs
+
+    Arguments:
+        batch {list} -- (document id, text) pairs
+
+    Returns:
+        list -- (document id, polarity, label) triples
+    """
+    # retweets repeat the same text, so each distinct text is scored once
+    texts = {TextCache.key('text', text): text for _, text in batch}
+    polarities = sentiment_polarities(list(texts.values()))
+    labels = sentiment_labels(polarities)
+    scores = {key: (float(polarity), str(label))
+              for key, polarity, label in zip(texts, polarities, labels)}
+
+    return [(document_id, *scores[TextCache.key('text', text)])
+            for document_id, text in batch]
+
+
+def unscored_batches(collection, batch_size, rescore=False):
+    """ Yields batches of (document id, text) pairs still to be scored """
+    query = {}
+    if not rescore:
+        query = {'sentiment_label': {'$exists': False}}
+    projection = {'_id': 1, 'text': 1, 'full_text': 1}
+
+    batch = []
+    cursor = collection.find(query, projection, no_cursor_timeout=True)
+    try:
+        for document in cursor:
+            batch.append((document['_id'], tweet_text(document)))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    finally:
+        cursor.close()
+
+    if batch:
+        yield batch
+
+
+def scored_batches(pool, batches, max_pending):
+    """ Scores batches on a pool, yielding the results in batch order
+
+    At most max_pending batches are read ahead of the one being consumed,
+    so the collection's text is never all queued in memory at once.
+    """
+    pending = deque()
+    for batch in batches:
+        pending.append(pool.apply_async(score_batch, (batch,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+def score_collection(collection, pool, batch_size=1000, rescore=False,
+                     max_pending=None):
+    """ Scores every tweet in a collection and stores the polarity and label
+    on the document
+
+    Arguments:
+        collection {collection} -- tweets to score
+        pool {Pool} -- worker processes used for scoring
+
+    Keyword Arguments:
+        batch_size {int} -- tweets per worker task (default: {1000})
+        rescore {bool} -- also rescore tweets that already have a label
+        (default: {False})
+        max_pending {int} -- batches submitted to the pool at once, twice
+        the number of CPUs if None (default: {None})
+
+    Returns:
+        int -- number of tweets scored
+    """
+    if max_pending is None:
+        max_pending = 2 * os.cpu_count()
+
+    n_scored = 0
+    batches = unscored_batches(collection, batch_size, rescore=rescore)
+
+    widgets = [f'Scoring {collection.name}, ',
+               progressbar.Counter('Processed %(value)02d'),
+               ' batches (', progressbar.Timer(), ')']
+    bar = progressbar.ProgressBar(widgets=widgets)
+    for scored in bar(scored_batches(pool, batches, max_pending)):
+        requests = [UpdateOne({'_id': document_id},
+                              {'$set': {'sentiment_polarity': polarity,
+                                        'sentiment_label': label}})
+                    for document_id, polarity, label in scored]
+        if requests:
+            collection.bulk_write(requests, ordered=False)
+        n_scored += len(requests)
+
+    return n_scored
+
+
+@click.command()
+@click.argument('topic')
+@click.option('--workers', default=os.cpu_count(), show_default=True,
+              help='Number of scoring processes.')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Tweets per worker task.')
+@click.option('--rescore', is_flag=True,
+              help='Rescore tweets that already have a sentiment label.')
+@click.option('--engine', type=click.Choice(SENTIMENT_ENGINES),
+              default='textblob', show_default=True,
+              help='Sentiment engine used to score tweets.')
+def main(topic, workers, batch_size, rescore, engine):
+    """ Scores the sentiment of every tweet of a topic once, so that feature
+    runs read the stored label instead of rescoring the text
+    """
+    logger = logging.getLogger(__name__)
+
+    db_name = "RPE_twitteranniv"
+    event_db_name = "RPE_twitteranniv"
+    client = None
+
+    try:
+        client = pymongo.MongoClient(host='localhost', port=27017,
+                                     appname=__file__)
+        db = client[db_name]
+        event_db = client[event_db_name]
+
+        if topic not in db.list_collection_names():
+            raise ValueError(f"Collection does not exist: {topic}.")
+
+        collections = [db[topic],
+                       db[topic + "-retweets"],
+                       db[topic + "-replies"],
+                       event_db[topic + "-event_tweets"]]
+    except (ValueError, KeyError) as error:
+        logger.error(error)
+    else:
+        with Pool(processes=workers, initializer=set_sentiment_engine,
+                  initargs=(engine,)) as pool:
+            for collection in collections:
+                n_scored = score_collection(collection, pool,
+                                            batch_size=batch_size,
+                                            rescore=rescore,
+                                            max_pending=2 * workers)
+                logger.info(f'scored {n_scored} tweets in {collection.name}')
+    finally:
+        if client is not None:
+            logger.info('ending all server sessions')
+            client.close()
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,402 @@
+"""Asyncio feature engine.
+
+Edge features are almost entirely waiting on MongoDB round trips. This
+engine fetches every document an edge reads with an async driver (motor),
+keeping many edges' queries in flight at once under a concurrency limit,
+into in-memory stand-ins of the collections. Features then runs unchanged on
+those stand-ins without touching the database, so the rows are the same as
+build_features.calculate_network_diffusion yields.
+
+Documents are read-only while features are computed, so the user attributes,
+responses, event tweets and following lists are cached across edges.
+
+    engine = AsyncFeatureEngine(keywords, **motor_collections(db, event_db,
+                                                              topic))
+    rows = [row async for row in engine.calculate_network_diffusion(edges)]
+
+The engine also runs on a MemoryStorage, through AsyncCollection, which
+gives its collections the part of the motor API the engine uses.
+"""
+
+import asyncio
+from collections import deque
+
+import pandas as pd
+
+from indiff.cache import LRUCache
+from indiff.features.build_features import Features, response_maps_cache
+from indiff.features.user_features import user_feature_rows
+from indiff.twitter import TWEET_PROJECTION
+
+
+class _Cursor(object):
+    """ Cursor over prefetched documents, supporting sort """
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def sort(self, key, direction=1):
+        self.documents.sort(key=lambda document: document[key],
+                            reverse=direction < 0)
+        return self
+
+
+class PrefetchedCollection(object):
+    """In-memory stand-in for a collection, answering the single field
+    equality and $in queries Features makes from prefetched documents.
+
+    A query that was not prefetched raises a KeyError rather than silently
+    returning nothing.
+
+    Arguments:
+        name {str} -- collection name, used in error messages
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._results = {}
+
+    @staticmethod
+    def _key(filter):
+        if len(filter) != 1:
+            raise KeyError(f'unsupported query: {filter}')
+        (field, value), = filter.items()
+        return field, value
+
+    def add(self, field, value, documents):
+        """ Stores the documents matching {field: value} """
+        self._results[(field, value)] = list(documents)
+
+    def _documents(self, filter):
+        field, value = self._key(filter)
+        if isinstance(value, dict) and list(value) == ['$in']:
+            values = dict.fromkeys(value['$in'])
+        else:
+            values = [value]
+
+        documents = []
+        for value in values:
+            if (field, value) not in self._results:
+                raise KeyError(f'{self.name}: query {filter} was not '
+                               'prefetched')
+            documents.extend(self._results[(field, value)])
+        return documents
+
+    def find(self, filter, *args, **kwargs):
+        return _Cursor(self._documents(filter))
+
+    def find_one(self, filter, *args, **kwargs):
+        documents = self._documents(filter)
+        return documents[0] if documents else None
+
+
+class _AsyncCursor(object):
+    """ Motor style cursor over a synchronous cursor """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, key_or_list, direction=1):
+        self.cursor = self.cursor.sort(key_or_list, direction)
+        return self
+
+    async def to_list(self, length=None):
+        documents = list(self.cursor)
+        return documents if length is None else documents[:length]
+
+
+class AsyncCollection(object):
+    """Awaitable find and find_one over a synchronous collection, such as a
+    MemoryCollection, so AsyncFeatureEngine runs on it as on motor.
+
+    Arguments:
+        collection {collection} -- synchronous collection
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, filter=None, projection=None, *args, **kwargs):
+        return _AsyncCursor(self.collection.find(filter, projection,
+                                                 *args, **kwargs))
+
+    async def find_one(self, filter=None, projection=None, *args, **kwargs):
+        return self.collection.find_one(filter, projection, *args, **kwargs)
+
+
+class AsyncFeatureEngine(object):
+    """Computes edge features with concurrent, asynchronous prefetches.
+
+    Requires the responses index built by make_features.process_user_attribs.
+
+    Arguments:
+        keywords {set} -- topic keywords
+        node_collection {collection} -- async user attributes collection
+        tweet_collection {collection} -- async tweets collection
+        event_tweets_collection {collection} -- async event tweets collection
+        users_collection {collection} -- async users collection
+        responses_collection {collection} -- async responses index
+
+    Keyword Arguments:
+        user_features {dict} -- precomputed per-user feature rows
+        (default: {None})
+        event_table {dict} -- user id -> event table row. Event tweets are
+        not fetched when given (default: {None})
+        follow_graph {FollowGraph} -- follow graph. User documents are not
+        fetched when given (default: {None})
+        concurrency {int} -- edges prefetched at once (default: {64})
+        maxsize {int} -- users cached per kind of document (default: {50000})
+        chunk_size {int} -- ids per $in query (default: {1000})
+    """
+
+    def __init__(self, keywords, node_collection, tweet_collection,
+                 event_tweets_collection, users_collection,
+                 responses_collection, *, user_features=None, event_table=None,
+                 follow_graph=None, concurrency=64, maxsize=50000,
+                 chunk_size=1000):
+        self.keywords = keywords
+        self.node_collection = node_collection
+        self.tweet_collection = tweet_collection
+        self.event_tweets_collection = event_tweets_collection
+        self.users_collection = users_collection
+        self.responses_collection = responses_collection
+        if isinstance(user_features, pd.DataFrame):
+            user_features = user_feature_rows(user_features)
+        self.user_features = user_features
+        self.event_table = event_table
+        self.follow_graph = follow_graph
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+
+        self.attribs = LRUCache(maxsize=maxsize)
+        self.responses = LRUCache(maxsize=maxsize)
+        self.event_tweets = LRUCache(maxsize=maxsize)
+        self.users = LRUCache(maxsize=maxsize)
+        self.response_maps = response_maps_cache()
+        self.n_queries = 0
+
+    async def _cached(self, cache, key, fetch):
+        value = cache.get(key)
+        if value is None:
+            self.n_queries += 1
+            value = await fetch()
+            # None results are cached as an empty tuple
+            cache.put(key, value if value is not None else ())
+        return value if value != () else None
+
+    async def _find_in(self, collection, field, values, projection=None):
+        """ Documents whose field is one of values, grouped by value in
+        collection order """
+        found = {value: [] for value in values}
+        for i in range(0, len(values), self.chunk_size):
+            self.n_queries += 1
+            query = {field: {'$in': values[i:i + self.chunk_size]}}
+            for document in await collection.find(
+                    query, projection).to_list(length=None):
+                found[document.get(field)].append(document)
+        return found
+
+    async def user_attribs(self, user_id):
+        return await self._cached(
+            self.attribs, user_id,
+            lambda: self.node_collection.find_one({'_id': user_id}))
+
+    async def user_responses(self, user_id):
+        query = {'responder_id': user_id}
+        return await self._cached(
+            self.responses, user_id,
+            lambda: self.responses_collection.find(query).sort(
+                'rank', 1).to_list(length=None))
+
+    async def user_event_tweets(self, user_id):
+        if self.event_table is not None:
+            return []
+
+        query = {'author_id': user_id}
+        return await self._cached(
+            self.event_tweets, user_id,
+            lambda: self.event_tweets_collection.find(query).to_list(
+                length=None))
+
+    async def user(self, user_id):
+        if self.follow_graph is not None:
+            return None
+
+        return await self._cached(
+            self.users, user_id,
+            lambda: self.users_collection.find_one({'id': user_id}))
+
+    async def prefetch(self, src_user, dest_user):
+        """Fetches every document the features of an edge read.
+
+        Returns:
+            dict -- in-memory stand-ins for the Features collections
+        """
+        users = (src_user, dest_user)
+        attribs, responses, event_tweets, user_docs = await asyncio.gather(
+            asyncio.gather(*(self.user_attribs(u) for u in users)),
+            asyncio.gather(*(self.user_responses(u) for u in users)),
+            asyncio.gather(*(self.user_event_tweets(u) for u in users)),
+            asyncio.gather(*(self.user(u) for u in users)))
+
+        node_collection = PrefetchedCollection('user-attribs')
+        responses_collection = PrefetchedCollection('responses')
+        event_tweets_collection = PrefetchedCollection('event_tweets')
+        users_collection = PrefetchedCollection('users')
+        tweet_collection = PrefetchedCollection('tweets')
+        for i, user_id in enumerate(users):
+            node_collection.add('_id', user_id,
+                                [attribs[i]] if attribs[i] else [])
+            responses_collection.add('responder_id', user_id,
+                                     responses[i] or [])
+            event_tweets_collection.add('author_id', user_id,
+                                        event_tweets[i] or [])
+            users_collection.add('id', user_id,
+                                 [user_docs[i]] if user_docs[i] else [])
+
+        # the tweets the target user is mentioned in
+        mentioned_in = []
+        if attribs[1]:
+            mentioned_in = list(dict.fromkeys(attribs[1]['mentioned_in']))
+        tweets = await self._find_in(self.tweet_collection, 'id',
+                                     mentioned_in, TWEET_PROJECTION)
+        for tweet_id, found in tweets.items():
+            tweet_collection.add('id', tweet_id, found[:1])
+
+        return {'node_collection': node_collection,
+                'tweet_collection': tweet_collection,
+                'event_tweets_collection': event_tweets_collection,
+                'users_collection': users_collection,
+                'responses_collection': responses_collection}
+
+    async def edge_features(self, semaphore, src_user, dest_user):
+        """ Prefetches and computes the features of one edge """
+        async with semaphore:
+            collections = await self.prefetch(src_user, dest_user)
+
+        features = Features(src_user=src_user, dest_user=dest_user,
+                            keywords=self.keywords,
+                            user_features=self.user_features,
+                            event_table=self.event_table,
+                            response_maps=self.response_maps,
+                            follow_graph=self.follow_graph,
+                            **collections)
+        return features.to_dict()
+
+    async def calculate_network_diffusion(self, edges):
+        """Yields the feature rows of edges, in edge order.
+
+        At most concurrency edges are prefetched at once, and at most twice
+        as many finished rows wait for their turn.
+
+        Arguments:
+            edges {iterable} -- (source, destination) user id pairs
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = deque()
+        for src_user, dest_user in edges:
+            pending.append(asyncio.ensure_future(
+                self.edge_features(semaphore, src_user, dest_user)))
+            if len(pending) >= 2 * self.concurrency:
+                yield await pending.popleft()
+
+        while pending:
+            yield await pending.popleft()
+
+
+def motor_collections(db, event_db, topic):
+    """ Async collections of a topic, as AsyncFeatureEngine arguments
+
+    Arguments:
+        db {AsyncIOMotorDatabase} -- topic database
+        event_db {AsyncIOMotorDatabase} -- event tweets database
+        topic {str} -- topic name
+    """
+    return {'node_collection': db[topic + "-user-attribs"],
+            'tweet_collection': db[topic],
+            'event_tweets_collection': event_db[topic + "-event_tweets"],
+            'users_collection': db[topic + "-users"],
+            'responses_collection': db[topic + "-responses"]}
+
+
+def storage_collections(storage, event_storage, topic):
+    """ Async collections of a topic held in synchronous storages, such as
+    a MemoryStorage, as AsyncFeatureEngine arguments
+
+    Arguments:
+        storage {MemoryStorage} -- topic storage
+        event_storage {MemoryStorage} -- event tweets storage
+        topic {str} -- topic name
+    """
+    return {name: AsyncCollection(collection) for name, collection in
+            motor_collections(storage, event_storage, topic).items()}
+
+
+async def _collect(rows):
+    return [row async for row in rows]
+
+
+def network_diffusion_chunks(edge_chunks, keywords, db_name, event_db_name,
+                             topic, *, user_features=None, event_table=None,
+                             follow_graph=None, concurrency=64,
+                             host='localhost', port=27017, storage=None,
+                             event_storage=None):
+    """Computes the feature rows of chunks of edges with the asyncio engine.
+
+    One client and one engine, and so one set of caches, serve every chunk.
+    Given a storage, the engine reads it instead of connecting to MongoDB.
+
+    Arguments:
+        edge_chunks {iterable} -- lists of (source, destination) user id
+        pairs
+        keywords {set} -- topic keywords
+        db_name {str} -- topic database name
+        event_db_name {str} -- event tweets database name
+        topic {str} -- topic name
+
+    Keyword Arguments:
+        user_features {dict} -- precomputed per-user feature rows
+        (default: {None})
+        event_table {dict} -- user id -> event table row (default: {None})
+        follow_graph {FollowGraph} -- follow graph (default: {None})
+        concurrency {int} -- edges prefetched at once (default: {64})
+        storage {MemoryStorage} -- storage holding the topic, read instead
+        of the db_name database (default: {None})
+        event_storage {MemoryStorage} -- storage holding the event tweets,
+        storage if None (default: {None})
+
+    Yields:
+        list -- feature rows of each chunk, in edge order
+    """
+    loop = asyncio.new_event_loop()
+    client = None
+    try:
+        if storage is not None:
+            collections = storage_collections(
+                storage, event_storage if event_storage is not None
+                else storage, topic)
+        else:
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            async def connect():
+                # motor clients attach to the loop that is running when
+                # created
+                return AsyncIOMotorClient(host=host, port=port)
+
+            client = loop.run_until_complete(connect())
+            collections = motor_collections(client[db_name],
+                                            client[event_db_name], topic)
+        engine = AsyncFeatureEngine(
+            keywords, **collections, user_features=user_features,
+            event_table=event_table, follow_graph=follow_graph,
+            concurrency=concurrency)
+        for edges in edge_chunks:
+            yield loop.run_until_complete(
+                _collect(engine.calculate_network_diffusion(edges)))
+    finally:
+        if client is not None:
+            client.close()
+        loop.close()
@@ -1,17 +1,36 @@
 from collections import ChainMap, Counter
+from collections.abc import Hashable
+from itertools import groupby
 
 import numpy as np
 import pandas as pd
 import progressbar
 import statistics
 
-from indiff.twitter import Tweet
+from indiff import utils
+from indiff.cache import LRUCache, UserAttribsCache
+from indiff.features.follow_graph import following_ids
+from indiff.features.user_features import (ADDITIONAL_USER_FEATURES,
+                                           GENERIC_USER_FEATURES,
+                                           user_feature_rows)
+from indiff.twitter import TWEET_PROJECTION, Tweet
+
+# approximate memory cap of the response maps shared across edges, in bytes
+RESPONSE_MAPS_MAX_BYTES = 512 * 1024 ** 2
+
+
+def response_maps_cache():
+    """ Returns an empty cache of responder id -> response map, see
+    Features.responses_by_original, to share across the edges of a run """
+    return LRUCache(maxsize=50000, max_bytes=RESPONSE_MAPS_MAX_BYTES)
 
 
 class Features(object):
     def __init__(self, src_user=None, dest_user=None, keywords=None,
                  node_collection=None, tweet_collection=None, retweets_collection=None, event_tweets_collection=None,
-                 users_collection=None, user=None, replies_collection=None):
+                 users_collection=None, user=None, replies_collection=None,
+                 user_features=None, responses_collection=None,
+                 event_table=None, response_maps=None, follow_graph=None):
         self.src_user = src_user
         self.dest_user = dest_user
         self.keywords = keywords
@@ -22,6 +41,43 @@ class Features(object):
         self.event_tweets_collection=event_tweets_collection
         self.users_collection=users_collection
         self.user = user
+        # user id -> precomputed per-user features, see user_features.py
+        self.user_features = user_features
+        self.responses_collection = responses_collection
+        self._responses = {}
+        # user id -> event table row, see event_table_row
+        self.event_table = event_table
+        self._events = {}
+        # responder id -> responses by original tweet id, see
+        # responses_by_original. Shared across edges when given.
+        if response_maps is None:
+            response_maps = LRUCache()
+        self.response_maps = response_maps
+        # see follow_graph.py
+        self.follow_graph = follow_graph
+
+    def precomputed_user_features(self, user_id, names, user=None):
+        """Looks up per-user features in the precomputed user feature matrix.
+
+        Arguments:
+            user_id {str} -- User ID
+            names {list} -- feature names without the user prefix
+
+        Keyword Arguments:
+            user {str} -- Name used to prefix users in the returned dictionary
+
+        Returns:
+            {dict} -- mapping of feature names to values, or None if the user
+            is not in the matrix
+        """
+        if self.user_features is None:
+            return None
+
+        row = self.user_features.get(user_id)
+        if row is None:
+            return None
+
+        return {f'{user}_{name}': row[name] for name in names}
 
     def activity_index(self, user_id, e=30.4*24):
         """Expresses user's volume of tweets.
@@ -577,199 +633,298 @@ class Features(object):
         attr = self.node_collection.find_one(query)
         return attr['max_response_time']
 
+    def responses(self, user_id):
+        """ Returns the response index entries of the given user, reading the
+        responses index when one was built and expanding the user's responses
+        otherwise. Entries are memoised for the lifetime of this object.
+
+        Arguments:
+            user_id {str} -- User ID
+
+        Returns:
+            list -- response entries, see response_entry
+        """
+        if user_id not in self._responses:
+            if self.responses_collection is not None:
+                entries = get_indexed_responses(user_id,
+                                                self.responses_collection)
+            else:
+                entries = list(response_entries(
+                    user_id, self.node_collection, self.tweet_collection,
+                    self.retweets_collection, self.replies_collection,
+                    self.event_tweets_collection))
+            self._responses[user_id] = entries
+
+        return self._responses[user_id]
+
     def dest_num_responses_to_src(self):
         """ Returns the number of responses (retweets, quotes, or replies) given from the target to the source user """
         count = 0
-        for response in get_responses(self.dest_user, self.node_collection, self.tweet_collection, self.retweets_collection, self.replies_collection):
-            if response.original_owner_id(self.tweet_collection) == self.src_user:
+        for response in self.responses(self.dest_user):
+            if response['original_owner_id'] == self.src_user:
                 count += 1
         return count
 
     def dest_num_responses_to_mentions(self):
         """ Returns the number of responses (retweets, quotes, or replies) given from the target when mentioned """
         count = 0
-        for response in get_responses(self.dest_user, self.node_collection, self.tweet_collection, self.retweets_collection, self.replies_collection):
-            if response.users_mentioned == self.dest_user:
+        for response in self.responses(self.dest_user):
+            if response['users_mentioned'] == self.dest_user:
                 count += 1
         return count
 
     def dest_avg_positive_sentiment_responses(self):
         """ Computes the avg positive sentiment of the responses sent by the target """
-        num_responses = 0
-        num_positive = 0
-
-        # For each response
-        for tweet in get_responses(self.dest_user, self.node_collection, self.tweet_collection, self.retweets_collection, self.replies_collection):
-            num_responses += 1
-            # If that tweet is positive
-            if tweet.is_positive_sentiment:
-                num_positive += 1
-
-        if num_responses == 0:
-            return 0
-        return num_positive / num_responses
+        return self.dest_response_features()[
+            'dest_avg_positive_sentiment_responses']
 
     def dest_avg_negative_sentiment_responses(self):
         """ Computes the avg negative sentiment of the responses sent by the target """
-        num_responses = 0
-        num_negative = 0
-
-        # For each response
-        for tweet in get_responses(self.dest_user, self.node_collection, self.tweet_collection, self.retweets_collection, self.replies_collection):
-            num_responses += 1
-            # If that tweet is negative
-            if tweet.is_negative_sentiment:
-                num_negative += 1
-
-        if num_responses == 0:
-            return 0
-        return num_negative / num_responses
+        return self.dest_response_features()[
+            'dest_avg_negative_sentiment_responses']
 
     def dest_num_responses_to_media(self):
         """ Returns the number of responses (retweets, quotes, or replies) given from the target to tweets containing media """
         count = 0
-        for response in get_responses(self.dest_user, self.node_collection, self.tweet_collection, self.retweets_collection, self.replies_collection):
-            if response.media:
+        for response in self.responses(self.dest_user):
+            if response['has_media']:
                 count += 1
         return count
 
     def dest_num_responses_to_hashtags(self):
         """ Returns the number of responses (retweets, quotes, or replies) given from the target to tweets containing hashtags """
         count = 0
-        for response in get_responses(self.dest_user, self.node_collection, self.tweet_collection, self.retweets_collection, self.replies_collection):
-            if response.hashtags:
+        for response in self.responses(self.dest_user):
+            if response['has_hashtags']:
                 count += 1
         return count
 
     def dest_num_responses_to_urls(self):
         """ Returns the number of responses (retweets, quotes, or replies) given from the target to tweets containing urls """
         count = 0
-        for response in get_responses(self.dest_user, self.node_collection, self.tweet_collection, self.retweets_collection, self.replies_collection):
-            if response.urls:
+        for response in self.responses(self.dest_user):
+            if response['has_urls']:
                 count += 1
         return count
 
+    def dest_response_features(self):
+        """ Computes every feature derived from the target's responses in a
+        single pass over them
+
+        Returns:
+            {dict} -- mapping of feature names to values
+        """
+        num_responses = 0
+        num_to_src = 0
+        num_to_mentions = 0
+        num_positive = 0
+        num_negative = 0
+        num_media = 0
+        num_hashtags = 0
+        num_urls = 0
+
+        for response in self.responses(self.dest_user):
+            num_responses += 1
+            if response['original_owner_id'] == self.src_user:
+                num_to_src += 1
+            if response['users_mentioned'] == self.dest_user:
+                num_to_mentions += 1
+            if response['sentiment'] == 'positive':
+                num_positive += 1
+            if response['sentiment'] == 'negative':
+                num_negative += 1
+            if response['has_media']:
+                num_media += 1
+            if response['has_hashtags']:
+                num_hashtags += 1
+            if response['has_urls']:
+                num_urls += 1
+
+        return {
+            'dest_num_responses_to_src': num_to_src,
+            'dest_num_responses_to_mentions': num_to_mentions,
+            'dest_avg_positive_sentiment_responses':
+                num_positive / num_responses if num_responses else 0,
+            'dest_avg_negative_sentiment_responses':
+                num_negative / num_responses if num_responses else 0,
+            'dest_num_responses_to_media': num_media,
+            'dest_num_responses_to_hashtags': num_hashtags,
+            'dest_num_responses_to_urls': num_urls,
+        }
+
     def dest_follows_src(self):
         """ Returns 1 if the target user follows the source, 0 otherwise """
+        if self.follow_graph is not None:
+            follows = self.follow_graph.follows(self.dest_user,
+                                                self.src_user)
+            return 1 if follows else 0
+
         for id in get_following(self.dest_user, self.users_collection):
             if id == self.src_user:
                 return 1
 
         return 0
 
+    def event(self, user_id):
+        """ Returns the event table row of the given user, reading the
+        precomputed event table when one was loaded and summarising the
+        user's event tweets otherwise. Rows are memoised for the lifetime of
+        this object.
+
+        Arguments:
+            user_id {str} -- User ID
+
+        Returns:
+            dict -- event table row, None if the user has no event tweets
+        """
+        if self.event_table is not None:
+            return self.event_table.get(user_id)
+
+        if user_id not in self._events:
+            self._events[user_id] = event_table_row(
+                user_id, get_event_tweets(user_id,
+                                          self.event_tweets_collection))
+
+        return self._events[user_id]
+
     def event_is_positive(self, user_id):
         """ Returns 1 if the event tweet for the given user is positive, 0 otherwise """
-        event = get_event_tweet(user_id, self.event_tweets_collection)
+        event = self.event(user_id)
 
         if event is None:
             return 0
 
-        if event.is_positive_sentiment:
+        if event['sentiment'] == 'positive':
             return 1
         else:
             return 0
 
     def event_is_negative(self, user_id):
         """ Returns 1 if the event tweet for the given user is negative, 0 otherwise """
-        event = get_event_tweet(user_id, self.event_tweets_collection)
+        event = self.event(user_id)
 
         if event is None:
             return 0
 
-        if event.is_negative_sentiment:
+        if event['sentiment'] == 'negative':
             return 1
         else:
             return 0
 
     def event_is_directed_to(self, src_id, target_id):
         """ Returns 1 if the event tweet for the given user is directed to the target """
-        event = get_event_tweet(src_id, self.event_tweets_collection)
+        event = self.event(src_id)
 
         if event is None:
             return 0
 
         # TODO Verify mentions are working right
-        if target_id in event.users_mentioned:
+        if target_id in event['users_mentioned']:
             return 1
         else:
             return 0
 
     def event_has_hashtags(self, user_id):
         """ Returns 1 if the event tweet for the given user has a hashtag """
-        event = get_event_tweet(user_id, self.event_tweets_collection)
+        event = self.event(user_id)
 
         if event is None:
             return 0
 
-        if event.hashtags:
+        if event['has_hashtags']:
             return 1
         else:
             return 0
 
     def event_has_media(self, user_id):
         """ Returns 1 if the event tweet for the given user has media """
-        event = get_event_tweet(user_id, self.event_tweets_collection)
+        event = self.event(user_id)
 
         if event is None:
             return 0
 
-        if event.media:
+        if event['has_media']:
             return 1
         else:
             return 0
 
     def event_has_url(self, user_id):
         """ Returns 1 if the event tweet for the given user has media """
-        event = get_event_tweet(user_id, self.event_tweets_collection)
+        event = self.event(user_id)
 
         if event is None:
             return 0
 
-        if event.urls:
+        if event['has_urls']:
             return 1
         else:
             return 0
 
+    def responses_by_original(self, responder_id):
+        """ Returns the responder's response entries keyed by the id of the
+        tweet they respond to, in rank order. Built once per responder.
+
+        Arguments:
+            responder_id {str} -- User ID
+
+        Returns:
+            dict -- original tweet id -> response entries
+        """
+        response_map = self.response_maps.get(responder_id)
+        if response_map is None:
+            response_map = {}
+            for response in self.responses(responder_id):
+                original_tweet_id = response['original_tweet_id']
+                # old format responses can hold the whole original tweet,
+                # which never equals an event tweet id
+                if isinstance(original_tweet_id, Hashable):
+                    response_map.setdefault(original_tweet_id,
+                                            []).append(response)
+            self.response_maps.put(responder_id, response_map)
+
+        return response_map
+
     def num_event_responses(self, user_id, responder_id):
         """ Returns 1 if one of the event tweets for the given user has a response, false otherwise """
+        event = self.event(user_id)
+
+        if event is None:
+            return 0
+
+        response_map = self.responses_by_original(responder_id)
+
         response_count = 0
-        for event in get_event_tweets(user_id, self.event_tweets_collection):
-            for response in get_responses(responder_id, self.node_collection, self.tweet_collection,
-                                          self.retweets_collection, self.replies_collection):
-                if response.original_tweet_id == event.id:
-                    response_count += 1
+        for event_id in event['event_ids']:
+            response_count += len(response_map.get(event_id, ()))
 
         return response_count
 
     def event_response_time(self, user_id, responder_id):
         """ Returns 1 if the event tweet for the given user has a response, false otherwise """
-        event = get_event_tweet(user_id, self.event_tweets_collection)
+        event = self.event(user_id)
 
         if event is None:
             return 0
 
         found_response = None
-        for response in get_responses(responder_id, self.node_collection, self.tweet_collection,
-                                      self.retweets_collection, self.replies_collection):
-            if response.original_tweet_id == event.id:
-                found_response = response
-                break
+        responses = self.responses_by_original(responder_id).get(event['id'])
+        if responses:
+            found_response = responses[0]
 
         if found_response is None:
             return 0
         else:
-            return (found_response.created_at.replace(tzinfo=None) - event.created_at.replace(tzinfo=None)).total_seconds()
+            return (found_response['created_at'] -
+                    event['created_at']).total_seconds()
 
     def src_dest_response_time_avgs(self):
         # Gather all response times from the src user to the dest user
         responses = []
-        for tweet in get_responses(self.src_user, self.node_collection, self.tweet_collection, self.retweets_collection, self.replies_collection):
-            original = tweet.get_original_tweet(self.tweet_collection, self.event_tweets_collection)
+        for response in self.responses(self.src_user):
             # If we have a copy of the original tweet and it's from the dest
-            if original and original.owner_id == self.dest_user:
-                delay = (tweet.created_at.replace(tzinfo=None) - original.created_at.replace(
-                    tzinfo=None)).total_seconds()
-                responses.append(delay)
+            if response['original_author_id'] == self.dest_user and \
+                    response['response_time'] is not None:
+                responses.append(response['response_time'])
 
         # If the user has any responses
         if len(responses) > 0:
@@ -778,6 +933,11 @@ class Features(object):
         return [0, 0, 0]
 
     def additional_features(self, user_id, user=None):
+        precomputed = self.precomputed_user_features(
+            user_id, ADDITIONAL_USER_FEATURES, user=user)
+        if precomputed is not None:
+            return precomputed
+
         return {
             f'{user}_I': self.activity_index(user_id),
             f'{user}_dTR': self.dTR(user_id),
@@ -895,6 +1055,11 @@ class Features(object):
         Returns:
             {dict} -- mapping of feature names to values
         """
+        precomputed = self.precomputed_user_features(
+            user_id, GENERIC_USER_FEATURES, user=user)
+        if precomputed is not None:
+            return precomputed
+
         return {
             f'{user}_num_followers': self.raw_number_followers(user_id),
             f'{user}_num_friends': self.raw_number_friends(user_id),
@@ -943,13 +1108,7 @@ class Features(object):
             {dict} -- mapping of feature names to values
         """
         return {
-            'dest_num_responses_to_src': self.dest_num_responses_to_src(),
-            'dest_num_responses_to_mentions': self.dest_num_responses_to_mentions(),
-            'dest_avg_positive_sentiment_responses': self.dest_avg_positive_sentiment_responses(),
-            'dest_avg_negative_sentiment_responses': self.dest_avg_negative_sentiment_responses(),
-            'dest_num_responses_to_media': self.dest_num_responses_to_media(),
-            'dest_num_responses_to_hashtags': self.dest_num_responses_to_hashtags(),
-            'dest_num_responses_to_urls': self.dest_num_responses_to_urls(),
+            **self.dest_response_features(),
             'dest_follows_src': self.dest_follows_src()
         }
 
@@ -1041,6 +1200,100 @@ def get_responses(user_id, node_collection, tweets_collection, retweets_collecti
             yield tweet
 
 
+def response_entry(user_id, rank, tweet, tweets_collection, event_collection,
+                   owner_resolver=None):
+    """ Builds the compact responses index entry of a response tweet
+
+    Arguments:
+        user_id {str} -- id of the responding user
+        rank {int} -- position of the response in get_responses order
+        tweet {Tweet} -- the response
+        tweets_collection {collection} -- tweets
+        event_collection {collection} -- event tweets
+
+    Keyword Arguments:
+        owner_resolver {OwnerResolver} -- batched original owner lookups
+        (default: {None})
+
+    Returns:
+        {dict} -- response index entry
+    """
+    created_at = tweet.created_at
+
+    original_author_id = None
+    response_time = None
+    original = tweet.get_original_tweet(tweets_collection, event_collection)
+    if original:
+        original_author_id = original.owner_id
+        original_created_at = original.created_at
+        if created_at is not None and original_created_at is not None:
+            response_time = (created_at -
+                             original_created_at).total_seconds()
+
+    return {
+        'responder_id': user_id,
+        'rank': rank,
+        'id': tweet.id,
+        'original_tweet_id': tweet.original_tweet_id,
+        'original_owner_id': tweet.original_owner_id(
+            tweets_collection, owner_resolver=owner_resolver),
+        'original_author_id': original_author_id,
+        'created_at': created_at,
+        'response_time': response_time,
+        'users_mentioned': tweet.users_mentioned,
+        'has_media': bool(tweet.media),
+        'has_hashtags': bool(tweet.hashtags),
+        'has_urls': bool(tweet.urls),
+        'sentiment': tweet.sentiment,
+    }
+
+
+def is_complete_entry(entry):
+    """ Whether a responses index entry found the tweet it responds to,
+    and so would be built the same again. Entries of responses to tweets
+    missing from the database are rebuilt in case those have been added. """
+    return (entry.get('response_time') is not None and
+            entry.get('original_author_id') is not None)
+
+
+def response_entries(user_id, node_collection, tweets_collection,
+                     retweets_collection, replies_collection,
+                     event_collection, current_attr=None, owner_resolver=None,
+                     known_entries=None):
+    """ Expands a user's responses into responses index entries, in
+    get_responses order. With an owner_resolver, the original owners of
+    all the responses are resolved in one batch. Complete entries in
+    known_entries, keyed by response id, are reused with their rank updated
+    instead of being rebuilt. """
+    known_entries = {id_: entry for id_, entry in
+                     (known_entries or {}).items()
+                     if is_complete_entry(entry)}
+    responses = get_responses(user_id, node_collection, tweets_collection,
+                              retweets_collection, replies_collection,
+                              current_attr=current_attr)
+    if owner_resolver is not None:
+        responses = list(responses)
+        owner_resolver.prefetch(tweet for tweet in responses
+                                if tweet.id not in known_entries)
+
+    for rank, tweet in enumerate(responses):
+        if tweet.id in known_entries:
+            entry = dict(known_entries[tweet.id], rank=rank)
+            entry.pop('_id', None)
+            yield entry
+        else:
+            yield response_entry(user_id, rank, tweet, tweets_collection,
+                                 event_collection,
+                                 owner_resolver=owner_resolver)
+
+
+def get_indexed_responses(user_id, responses_collection):
+    """ Reads a user's entries from the responses index, in get_responses
+    order """
+    query = {'responder_id': user_id}
+    return list(responses_collection.find(query).sort('rank', 1))
+
+
 def get_event_tweet(user_id, event_tweets_collection):
     """ Gets the event tweet (the earliest tweet sent by the user in this database) """
     min_tweet = None
@@ -1066,27 +1319,95 @@ def get_event_tweets(user_id, event_tweets_collection):
             yield parsed
 
 
+def event_table_row(user_id, event_tweets):
+    """ Summarises a user's event tweets as an event table row
+
+    Arguments:
+        user_id {str} -- User ID
+        event_tweets {iterable} -- the user's event tweets, as Tweets
+
+    Returns:
+        {dict} -- the fields of the earliest event tweet the event features
+        read and the ids of all the user's event tweets, None if there are
+        no event tweets
+    """
+    event = None
+    event_ids = []
+    returned_ids = set()
+    for tweet in event_tweets:
+        if tweet.id in returned_ids:
+            continue
+        returned_ids.add(tweet.id)
+        event_ids.append(tweet.id)
+
+        if event is None or tweet.created_at < event.created_at:
+            event = tweet
+
+    if event is None:
+        return None
+
+    return {
+        '_id': user_id,
+        'id': event.id,
+        'created_at': event.created_at,
+        'sentiment': event.sentiment,
+        'users_mentioned': event.users_mentioned,
+        'has_hashtags': bool(event.hashtags),
+        'has_media': bool(event.media),
+        'has_urls': bool(event.urls),
+        'event_ids': event_ids,
+    }
+
+
+def event_table_rows(event_tweets_collection):
+    """ Computes the event table row of every user with event tweets in one
+    pass over the event tweets sorted by author """
+    query = {'author_id': {'$exists': True}}
+    cursor = event_tweets_collection.find(query, no_cursor_timeout=True).sort(
+        'author_id', 1)
+    try:
+        tweets = (Tweet(document) for document in cursor)
+        by_author = groupby(tweets, key=lambda tweet: tweet.tweet['author_id'])
+        for user_id, event_tweets in by_author:
+            yield event_table_row(user_id, event_tweets)
+    finally:
+        cursor.close()
+
+
+def load_event_table(event_table_collection):
+    """ Reads the event table into a user id -> row mapping """
+    return {row['_id']: row for row in event_table_collection.find()}
+
+
 def get_following(user_id, users_collection):
     """ Gets list of users the given user is following """
     query = {'id': user_id}
 
     user = users_collection.find_one(query)
-    if 'following_ids' in user:
-        return user['following_ids']
-    elif 'following' in user:
-        return user['following']
 
-    # No following data; return empty list
-    return []
+    # No following data gives an empty list
+    return following_ids(user)
+
+
+def expanded_tweets(tweet_ids, tweets_collection, chunk_size=1000):
+    """ Get tweets from the database using the given list of ids
 
+    Ids are looked up chunk_size at a time with $in queries projected to the
+    fields Tweet reads. Tweets are yielded in the order of tweet_ids, the
+    first document stored for an id as find_one would return it, and ids
+    that are not found are skipped.
+    """
+    tweet_ids = list(tweet_ids)
+    for i in range(0, len(tweet_ids), chunk_size):
+        chunk = tweet_ids[i:i + chunk_size]
+        query = {'id': {'$in': list(dict.fromkeys(chunk))}}
+        found = {}
+        for tweet in tweets_collection.find(query, TWEET_PROJECTION):
+            found.setdefault(tweet.get('id'), tweet)
 
-def expanded_tweets(tweet_ids, tweets_collection):
-    """ Get tweets from the database using the given list of ids """
-    for id_str in tweet_ids:
-        query = {'id': id_str}
-        found = tweets_collection.find_one(query)
-        if found is not None:
-            yield Tweet(found)
+        for id_str in chunk:
+            if id_str in found:
+                yield Tweet(found[id_str])
 
 
 def users_ever_mentioned(user_id, node_collection):  # get_users_mentioned_in
@@ -1120,12 +1441,27 @@ def calculate_network_diffusion(edges, keywords, node_collection,
                                 tweet_collection, retweets_collection, event_tweets_collection, users_collection,
                                 replies_collection,
                                 *, additional_attr=False,
-                                do_not_add_sentiment=False, n_days=30):
+                                do_not_add_sentiment=False, n_days=30,
+                                user_features=None, responses_collection=None,
+                                event_table=None, response_maps=None,
+                                follow_graph=None):
     # todo: turn this into a generator and see if its contents will only be
     # consumed once. this will require removing counter and search for another
     # way of knowing the number of things calculated
     # changed results.append to yield
 
+    # share one user attribute cache across all edges of this run
+    if not isinstance(node_collection, UserAttribsCache):
+        node_collection = UserAttribsCache(node_collection)
+
+    # every edge sharing a responder probes the same response map
+    if response_maps is None:
+        response_maps = response_maps_cache()
+
+    # per-user features are joined from the precomputed matrix
+    if isinstance(user_features, pd.DataFrame):
+        user_features = user_feature_rows(user_features)
+
     widgets = ['Computing Diffusion, ',
                progressbar.Counter('Processed %(value)02d'),
                ' edges (', progressbar.Timer(), ')']
@@ -1137,10 +1473,17 @@ def calculate_network_diffusion(edges, keywords, node_collection,
                             retweets_collection=retweets_collection,
                             replies_collection=replies_collection,
                             users_collection=users_collection,
-                            event_tweets_collection=event_tweets_collection)
+                            event_tweets_collection=event_tweets_collection,
+                            user_features=user_features,
+                            responses_collection=responses_collection,
+                            event_table=event_table,
+                            response_maps=response_maps,
+                            follow_graph=follow_graph)
 
         yield(features.to_dict())
 
+    node_collection.log_stats()
+
 
 def number_of_retweeted_tweets(user_id, node_collection):
     """---"""
@@ -1217,21 +1560,22 @@ def quoted_tweets_with_media(user_id, node_collection):
     return attr['n_quoted_tweets_with_media']
 
 
-def compute_ratio_of_tweet_per_time_period(user):
-    periods = Counter()
+def _period_counts(dates):
+    """ Counts dates per six hour period of the day, keyed '1' to '4' """
+    dates = utils.parse_created_at_many(dates)
+    hours = np.asarray(dates[dates.notna()].hour, dtype=np.int64)
+    counts = np.bincount(hours // 6, minlength=4)
+    return Counter({str(period): int(n)
+                    for period, n in enumerate(counts, start=1) if n})
+
 
+def compute_ratio_of_tweet_per_time_period(user):
     all_tweets_dates = user['tweets_dates'] + \
         user['retweeted_tweets_dates'] + user['quoted_tweets_dates']
 
     n_all_tweets_dates = len(all_tweets_dates)
 
-    for tweet_date in all_tweets_dates:
-        h = tweet_date.hour
-
-        if h in range(0, 24):
-            period = h // 6 + 1
-            periods[str(period)] += 1
-
+    periods = _period_counts(all_tweets_dates)
     for key, value in periods.items():
         periods[key] = value / n_all_tweets_dates
 
@@ -1239,8 +1583,6 @@ def compute_ratio_of_tweet_per_time_period(user):
 
 
 def compute_ratio_of_tweets_that_got_retweeted_per_time_period(user):
-    periods = Counter()
-
     all_tweets_dates = user['tweets_dates'] + \
         user['retweeted_tweets_dates'] + user['quoted_tweets_dates']
 
@@ -1248,13 +1590,7 @@ def compute_ratio_of_tweets_that_got_retweeted_per_time_period(user):
 
     retweeted_tweets_dates = user['retweeted_tweets_dates']
 
-    for tweet_date in retweeted_tweets_dates:
-        h = tweet_date.hour
-
-        if h in range(0, 24):
-            period = h // 6 + 1
-            periods[str(period)] += 1
-
+    periods = _period_counts(retweeted_tweets_dates)
     for key, value in periods.items():
         periods[key] = value / n_all_tweets_dates
 
@@ -1262,17 +1598,10 @@ def compute_ratio_of_tweets_that_got_retweeted_per_time_period(user):
 
 
 def compute_ratio_of_retweet_per_time_period(user):
-    periods = Counter()
     retweeted_tweets_dates = user['retweeted_tweets_dates']
     n_retweeted_tweets_dates = len(retweeted_tweets_dates)
 
-    for tweet_date in retweeted_tweets_dates:
-        h = tweet_date.hour
-
-        if h in range(0, 24):
-            period = h // 6 + 1
-            periods[str(period)] += 1
-
+    periods = _period_counts(retweeted_tweets_dates)
     for key, value in periods.items():
         if n_retweeted_tweets_dates:
             periods[key] = value / n_retweeted_tweets_dates
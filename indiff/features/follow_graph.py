@@ -0,0 +1,193 @@
+"""Follow graph index in compressed sparse row (CSR) form.
+
+Users are numbered densely by their position in a sorted array of user ids.
+Row i of the CSR arrays lists, in ascending order, the numbers of the users
+user i follows, so whether one user follows another is two binary searches
+over the ids and one over the follower's row.
+
+The arrays are saved as .npy files and loaded memory-mapped, so worker
+processes share one read-only copy through the page cache.
+
+    graph = FollowGraph.from_users(users_collection)
+    graph.save(path)
+    graph = FollowGraph.load(path)
+    graph.follows(dest_id, src_id)
+"""
+
+import os
+
+import numpy as np
+
+FILES = ('ids', 'indptr', 'indices')
+
+
+def following_ids(user):
+    """ The ids a user document follows, as build_features.get_following
+    reads them """
+    if 'following_ids' in user:
+        return user['following_ids']
+    elif 'following' in user:
+        return user['following']
+    return []
+
+
+class FollowGraph(object):
+    """Read-only follow graph.
+
+    Arguments:
+        ids {ndarray} -- sorted user ids, a user's number is its position
+        indptr {ndarray} -- row offsets into indices, one more than ids
+        indices {ndarray} -- followed user numbers, sorted within each row
+    """
+
+    def __init__(self, ids, indptr, indices):
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self._keys = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_users(cls, users_collection):
+        """Builds the graph from the following lists of a users collection.
+
+        Only string ids are kept, since the graph's user ids are strings and
+        other values never equal them. When several documents share an id
+        the first is used, as find_one does.
+
+        Arguments:
+            users_collection {collection} -- user data objects
+
+        Returns:
+            FollowGraph -- the follow graph
+        """
+        projection = {'id': 1, 'following_ids': 1, 'following': 1}
+        following = {}
+        cursor = users_collection.find({}, projection)
+        try:
+            for user in cursor:
+                user_id = user.get('id')
+                if not isinstance(user_id, str) or user_id in following:
+                    continue
+                following[user_id] = [id_ for id_ in following_ids(user)
+                                      if isinstance(id_, str)]
+        finally:
+            cursor.close()
+
+        all_ids = set(following)
+        for followed in following.values():
+            all_ids.update(followed)
+        ids = np.array(sorted(all_ids), dtype=str)
+
+        rows = np.zeros(len(ids), dtype=np.int64)
+        row_indices = []
+        for user_id, followed in following.items():
+            i = np.searchsorted(ids, user_id)
+            indices = np.unique(np.searchsorted(ids, np.array(followed,
+                                                              dtype=str)))
+            rows[i] = len(indices)
+            row_indices.append((i, indices))
+
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(rows, out=indptr[1:])
+        indices = np.zeros(indptr[-1], dtype=np.int64)
+        for i, row in row_indices:
+            indices[indptr[i]:indptr[i + 1]] = row
+
+        return cls(ids, indptr, indices)
+
+    def save(self, path):
+        """ Saves the arrays as .npy files in the directory path """
+        os.makedirs(path, exist_ok=True)
+        for name in FILES:
+            tmp_path = os.path.join(path, name + '.tmp.npy')
+            np.save(tmp_path, getattr(self, name))
+            os.replace(tmp_path, os.path.join(path, name + '.npy'))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads a graph saved with save.
+
+        Keyword Arguments:
+            mmap {bool} -- memory-map the arrays read-only (default: {True})
+        """
+        mmap_mode = 'r' if mmap else None
+        arrays = [np.load(os.path.join(path, name + '.npy'),
+                          mmap_mode=mmap_mode) for name in FILES]
+        return cls(*arrays)
+
+    @staticmethod
+    def exists(path):
+        return all(os.path.exists(os.path.join(path, name + '.npy'))
+                   for name in FILES)
+
+    def number(self, user_id):
+        """ Returns a user's number, -1 if the user is not in the graph """
+        i = int(np.searchsorted(self.ids, user_id))
+        if i < len(self.ids) and self.ids[i] == user_id:
+            return i
+        return -1
+
+    def numbers(self, user_ids):
+        """ Vectorised number """
+        user_ids = np.asarray(user_ids, dtype=str)
+        i = np.searchsorted(self.ids, user_ids)
+        found = i < len(self.ids)
+        found[found] = self.ids[i[found]] == user_ids[found]
+        return np.where(found, i, -1)
+
+    def following(self, user_id):
+        """ Returns the ids of the users a user follows, sorted """
+        i = self.number(user_id)
+        if i < 0:
+            return self.ids[:0]
+        return self.ids[self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def follows(self, follower_id, followed_id):
+        """ Whether one user follows another """
+        i = self.number(follower_id)
+        j = self.number(followed_id)
+        if i < 0 or j < 0:
+            return False
+
+        row = self.indices[self.indptr[i]:self.indptr[i + 1]]
+        k = int(np.searchsorted(row, j))
+        return k < len(row) and row[k] == j
+
+    def follows_many(self, follower_ids, followed_ids):
+        """Batched follows over pairs of users.
+
+        Arguments:
+            follower_ids {iterable} -- ids of the following users
+            followed_ids {iterable} -- ids of the followed users, one per
+            follower
+
+        Returns:
+            ndarray -- bool per pair
+        """
+        i = self.numbers(list(follower_ids))
+        j = self.numbers(list(followed_ids))
+        known = (i >= 0) & (j >= 0)
+
+        # rows are in order and sorted within, so row * n + column is sorted
+        # across the whole graph
+        n = len(self.ids)
+        if self._keys is None:
+            rows = np.repeat(np.arange(n, dtype=np.int64),
+                             np.diff(self.indptr))
+            self._keys = rows * n + self.indices
+
+        keys = i[known] * n + j[known]
+        k = np.searchsorted(self._keys, keys)
+        found = k < len(self._keys)
+        found[found] = self._keys[k[found]] == keys[found]
+
+        result = np.zeros(len(i), dtype=bool)
+        result[known] = found
+        return result
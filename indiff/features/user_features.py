@@ -0,0 +1,310 @@
+"""Per-user features computed once for every user in a topic.
+
+The features in Features.generic_user_features and
+Features.additional_features only depend on a single user's attribute
+document, so they are computed here for all users at once as NumPy columns
+instead of once per edge the user appears in.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+# Features.generic_user_features, without the src/dest prefix
+GENERIC_USER_FEATURES = [
+    'num_followers',
+    'num_friends',
+    'follower_friends_ratio',
+    'total_tweets',
+    'avg_positive_sentiment_of_tweets',
+    'avg_negative_sentiment_of_tweets',
+]
+
+# Features.additional_features, without the src/dest prefix
+ADDITIONAL_USER_FEATURES = [
+    'I',
+    'dTR',
+    'mR',
+    'hK',
+    'A_1', 'A_2', 'A_3', 'A_4', 'A_5', 'A_6',
+    'ratio_of_retweets_to_tweets',
+    'avg_number_of_tweets_with_hastags',
+    'avg_number_of_retweets_with_hastags',
+    'avg_number_of_retweets',
+    'avg_number_of_tweets',
+    'avg_number_of_mentions_not_including_retweets',
+    'ratio_of_mentions_to_tweet',
+    'avg_url_per_retweet',
+    'avg_url_per_tweet',
+    'avg_number_of_media_in_retweets',
+    'avg_number_of_media_in_tweets',
+    'description',
+    'ratio_of_favorited_to_tweet',
+    'avg_positive_sentiment_of_tweets',
+    'avg_negative_sentiment_of_tweets',
+    'ratio_of_tweet_per_time_period_1',
+    'ratio_of_tweet_per_time_period_2',
+    'ratio_of_tweet_per_time_period_3',
+    'ratio_of_tweet_per_time_period_4',
+    'ratio_of_tweets_that_got_retweeted_per_time_period_1',
+    'ratio_of_tweets_that_got_retweeted_per_time_period_2',
+    'ratio_of_tweets_that_got_retweeted_per_time_period_3',
+    'ratio_of_tweets_that_got_retweeted_per_time_period_4',
+    'ratio_of_retweet_per_time_period_1',
+    'ratio_of_retweet_per_time_period_2',
+    'ratio_of_retweet_per_time_period_3',
+    'ratio_of_retweet_per_time_period_4',
+    'avg_number_followers',
+    'avg_number_friends',
+    'ratio_of_follower_to_friends',
+]
+
+# Attribute document fields needed to compute the features above
+_PROJECTION = {
+    'tweets': 1,
+    'retweeted_tweets': 1,
+    'quoted_tweets': 1,
+    'mentioned_in': 1,
+    'keywords_in_all_my_tweets': 1,
+    'n_tweets_with_user_mentions': 1,
+    'n_tweets_with_hashtags': 1,
+    'n_retweeted_tweets_with_hashtags': 1,
+    'n_tweets_with_urls': 1,
+    'n_retweeted_tweets_with_urls': 1,
+    'n_tweets_with_media': 1,
+    'n_retweeted_tweets_with_media': 1,
+    'tweets_with_others_mentioned_count': 1,
+    'retweeted_count': 1,
+    'favorite_tweets_count': 1,
+    'positive_sentiment_count': 1,
+    'negative_sentiment_count': 1,
+    'followers_count': 1,
+    'friends_count': 1,
+    'followers_ids': 1,
+    'friends_ids': 1,
+    'description': 1,
+    'tweet_min_date': 1,
+    'tweet_max_date': 1,
+    'A': 1,
+    'ratio_of_tweet_per_time_period': 1,
+    'ratio_of_tweets_that_got_retweeted_per_time_period': 1,
+    'ratio_of_retweet_per_time_period': 1,
+}
+
+_COUNT_FIELDS = [
+    'n_tweets_with_user_mentions',
+    'n_tweets_with_hashtags',
+    'n_retweeted_tweets_with_hashtags',
+    'n_tweets_with_urls',
+    'n_retweeted_tweets_with_urls',
+    'n_tweets_with_media',
+    'n_retweeted_tweets_with_media',
+    'tweets_with_others_mentioned_count',
+    'retweeted_count',
+    'favorite_tweets_count',
+    'positive_sentiment_count',
+    'negative_sentiment_count',
+    'followers_count',
+    'friends_count',
+]
+
+_PERIOD_FIELDS = [
+    'ratio_of_tweet_per_time_period',
+    'ratio_of_tweets_that_got_retweeted_per_time_period',
+    'ratio_of_retweet_per_time_period',
+]
+
+
+def _ratio(numerator, denominator):
+    """Element-wise numerator / denominator, 0 where the denominator is 0"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    out = np.zeros_like(numerator)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out
+
+
+def _number_of_tweet_days(min_date, max_date):
+    """Mirrors build_features.get_user_number_of_tweet_days"""
+    diff = max_date - min_date
+    if diff == 0:
+        return 0
+    return diff.days
+
+
+def _user_attribs(node_collection, user_ids, chunk_size):
+    """ User attribute documents, projected to the fields read here, of
+    user_ids chunk_size at a time, or of every user if None """
+    if user_ids is None:
+        yield from node_collection.find({}, _PROJECTION)
+        return
+
+    # a single $in over a large graph exceeds the BSON document size limit
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), chunk_size):
+        query = {'_id': {'$in': user_ids[i:i + chunk_size]}}
+        yield from node_collection.find(query, _PROJECTION)
+
+
+def load_user_columns(node_collection, keywords, user_ids=None,
+                      chunk_size=10000):
+    """Reads user attribute documents once into per-field NumPy columns.
+
+    Arguments:
+        node_collection {collection} -- user attributes collection
+        keywords {set} -- topic keywords used for hK
+
+    Keyword Arguments:
+        user_ids {iterable} -- restrict to these users, all users if None
+        (default: {None})
+        chunk_size {int} -- ids per $in query (default: {10000})
+
+    Returns:
+        list, dict -- user ids and a mapping of column name to array
+    """
+
+    ids = []
+    raw = {field: [] for field in _COUNT_FIELDS}
+    raw.update({
+        'total_tweets': [],
+        'n_retweeted_tweets': [],
+        'n_mentioned_in': [],
+        'hK': [],
+        'description': [],
+        'n_followers_ids': [],
+        'n_friends_ids': [],
+        'n_days': [],
+        'A': [],
+    })
+    for field in _PERIOD_FIELDS:
+        for period in range(1, 5):
+            raw[f'{field}_{period}'] = []
+
+    for attr in _user_attribs(node_collection, user_ids, chunk_size):
+        ids.append(attr['_id'])
+
+        for field in _COUNT_FIELDS:
+            raw[field].append(attr[field])
+
+        n_retweeted_tweets = len(attr['retweeted_tweets'])
+        raw['total_tweets'].append(len(attr['tweets']) + n_retweeted_tweets +
+                                   len(attr['quoted_tweets']))
+        raw['n_retweeted_tweets'].append(n_retweeted_tweets)
+        raw['n_mentioned_in'].append(len(set(attr['mentioned_in'])))
+        raw['hK'].append(
+            0 if keywords.isdisjoint(attr['keywords_in_all_my_tweets'])
+            else 1)
+        raw['description'].append(1 if attr['description'] else 0)
+        raw['n_followers_ids'].append(len(attr['followers_ids']))
+        raw['n_friends_ids'].append(len(attr['friends_ids']))
+        raw['n_days'].append(_number_of_tweet_days(attr['tweet_min_date'],
+                                                   attr['tweet_max_date']))
+        raw['A'].append(attr['A'] if attr['A'] else [0, 0, 0, 0, 0, 0])
+
+        for field in _PERIOD_FIELDS:
+            periods = attr[field]
+            for period in range(1, 5):
+                raw[f'{field}_{period}'].append(periods.get(str(period), 0))
+
+    columns = {}
+    for name, values in raw.items():
+        if name == 'A':
+            columns[name] = np.asarray(values,
+                                       dtype=np.float64).reshape(-1, 6)
+        else:
+            columns[name] = np.asarray(values)
+
+    return ids, columns
+
+
+def compute_user_feature_matrix(node_collection, keywords, user_ids=None):
+    """Computes every per-user feature for all users in one pass.
+
+    Arguments:
+        node_collection {collection} -- user attributes collection
+        keywords {set} -- topic keywords used for hK
+
+    Keyword Arguments:
+        user_ids {iterable} -- restrict to these users, all users if None
+        (default: {None})
+
+    Returns:
+        DataFrame -- features indexed by user id, with the columns in
+        GENERIC_USER_FEATURES and ADDITIONAL_USER_FEATURES
+    """
+    ids, c = load_user_columns(node_collection, keywords, user_ids=user_ids)
+    logging.info(f'computing user feature matrix for {len(ids)} users')
+
+    total = c['total_tweets']
+    n_retweeted = c['n_retweeted_tweets']
+    n_days = np.where(c['n_days'] == 0, 1, c['n_days'])
+
+    e = 30.4 * 24
+    meu = 200
+
+    features = {
+        # generic user features
+        'num_followers': c['followers_count'],
+        'num_friends': c['friends_count'],
+        'follower_friends_ratio': _ratio(c['followers_count'],
+                                         c['friends_count']),
+        'total_tweets': total,
+        'avg_positive_sentiment_of_tweets': _ratio(
+            c['positive_sentiment_count'], total),
+        'avg_negative_sentiment_of_tweets': _ratio(
+            c['negative_sentiment_count'], total),
+
+        # additional user features
+        'I': np.where(total < e, total / e, 1),
+        'dTR': _ratio(c['n_tweets_with_user_mentions'], total),
+        'mR': np.where(c['n_mentioned_in'] < meu,
+                       c['n_mentioned_in'] / meu, 1),
+        'hK': c['hK'],
+        'ratio_of_retweets_to_tweets': _ratio(c['retweeted_count'], total),
+        'avg_number_of_tweets_with_hastags': _ratio(
+            c['n_tweets_with_hashtags'], total),
+        'avg_number_of_retweets_with_hastags': _ratio(
+            c['n_retweeted_tweets_with_hashtags'], n_retweeted),
+        'avg_number_of_retweets': _ratio(n_retweeted, total),
+        'avg_number_of_tweets': np.minimum(total / n_days, 1),
+        'avg_number_of_mentions_not_including_retweets': _ratio(
+            c['tweets_with_others_mentioned_count'], total),
+        'ratio_of_mentions_to_tweet': _ratio(
+            c['tweets_with_others_mentioned_count'], total),
+        'avg_url_per_retweet': _ratio(c['n_retweeted_tweets_with_urls'],
+                                      n_retweeted),
+        'avg_url_per_tweet': _ratio(c['n_tweets_with_urls'], total),
+        'avg_number_of_media_in_retweets': _ratio(
+            c['n_retweeted_tweets_with_media'], n_retweeted),
+        'avg_number_of_media_in_tweets': _ratio(c['n_tweets_with_media'],
+                                                total),
+        'description': c['description'],
+        'ratio_of_favorited_to_tweet': _ratio(c['favorite_tweets_count'],
+                                              total),
+        'avg_number_followers': np.minimum(c['followers_count'] / 707, 1),
+        'avg_number_friends': np.minimum(c['friends_count'] / 707, 1),
+        'ratio_of_follower_to_friends': np.minimum(
+            _ratio(c['n_followers_ids'], c['n_friends_ids']), 1),
+    }
+
+    for i in range(6):
+        features[f'A_{i + 1}'] = c['A'][:, i]
+
+    for field in _PERIOD_FIELDS:
+        for period in range(1, 5):
+            name = f'{field}_{period}'
+            features[name] = c[name]
+
+    columns = list(dict.fromkeys(GENERIC_USER_FEATURES +
+                                 ADDITIONAL_USER_FEATURES))
+    matrix = pd.DataFrame(features, index=pd.Index(ids, name='user_id'),
+                          columns=columns)
+
+    return matrix
+
+
+def user_feature_rows(matrix):
+    """Converts a user feature matrix to a user id -> feature dict mapping
+    for per-edge lookups"""
+    return matrix.to_dict('index')
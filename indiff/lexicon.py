@@ -0,0 +1,204 @@
+"""Batch lexicon sentiment scorer.
+
+Scores many tweets at once against the same polarity lexicon TextBlob's
+default (pattern) analyzer uses. Texts without negations or modifiers are
+scored with a single sparse matrix product; the few that contain them are
+scored with the same left-to-right rules pattern applies, so the labels
+match utils.sentiment with the TextBlob engine.
+"""
+
+import os
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from indiff.utils import clean_tweet
+
+NEGATIONS = frozenset(('no', 'not', "n't", 'never'))
+MODIFIER_POS = 'RB'
+
+# Polarities closer to zero than this are floating point noise from summing
+# scores in a different order than pattern does, and are scored as zero
+TOLERANCE = 1e-9
+
+
+def default_lexicon_path():
+    """ Path to the sentiment lexicon shipped with TextBlob """
+    import textblob
+
+    return os.path.join(os.path.dirname(textblob.__file__), 'en',
+                        'en-sentiment.xml')
+
+
+def _avg(values):
+    return sum(values) / float(len(values) or 1)
+
+
+def load_lexicon(path):
+    """Loads a pattern sentiment lexicon.
+
+    Scores are averaged over the senses of each part-of-speech tag and then
+    over the tags, and adverbs are derived from adjectives ("terrible" ->
+    "terribly"), as pattern does for English.
+
+    Arguments:
+        path {str} -- path to the lexicon XML file
+
+    Returns:
+        dict -- word -> {pos: (polarity, subjectivity, intensity)}, with the
+        averaged scores under the None key
+    """
+    words = {}
+    root = ElementTree.parse(path).getroot()
+    for word in root.findall('word'):
+        form = word.attrib.get('form')
+        if not form:
+            continue
+        scores = (float(word.attrib.get('polarity', 0.0)),
+                  float(word.attrib.get('subjectivity', 0.0)),
+                  float(word.attrib.get('intensity', 1.0)))
+        words.setdefault(form, {}).setdefault(
+            word.attrib.get('pos'), []).append(scores)
+
+    for form, tags in words.items():
+        words[form] = {pos: tuple(_avg(each) for each in zip(*senses))
+                       for pos, senses in tags.items()}
+    for form, tags in words.items():
+        tags[None] = tuple(_avg(each) for each in zip(*tags.values()))
+
+    for form, tags in list(words.items()):
+        if 'JJ' in tags:
+            adverb = form
+            if adverb.endswith('y'):
+                adverb = adverb[:-1] + 'i'
+            if adverb.endswith('le'):
+                adverb = adverb[:-2]
+            entry = words.setdefault(adverb + 'ly', {})
+            entry[MODIFIER_POS] = entry[None] = tags['JJ']
+
+    return words
+
+
+class LexiconSentiment(object):
+    """Vectorised polarity scorer.
+
+    Keyword Arguments:
+        path {str} -- lexicon XML file, TextBlob's English lexicon if None
+        (default: {None})
+    """
+
+    def __init__(self, path=None):
+        lexicon = load_lexicon(path or default_lexicon_path())
+
+        self.vocabulary = pd.Index(list(lexicon))
+        self.polarity = np.array([lexicon[w][None][0] for w in lexicon])
+        self.intensity = np.array([lexicon[w][None][2] for w in lexicon])
+        self.is_modifier = np.array([MODIFIER_POS in lexicon[w]
+                                     for w in lexicon])
+        self._index = {w: i for i, w in enumerate(lexicon)}
+        self._negations = pd.Index(sorted(NEGATIONS))
+
+    @staticmethod
+    def tokenize(text):
+        """ Splits a tweet into the lower-cased words pattern assesses """
+        return clean_tweet(text).lower().split()
+
+    def polarity_of(self, text):
+        """ Scores a single text """
+        return self.polarities([text])[0]
+
+    def polarities(self, texts):
+        """Scores a batch of texts.
+
+        Arguments:
+            texts {iterable} -- tweet texts
+
+        Returns:
+            ndarray -- polarity of each text in [-1.0, 1.0]
+        """
+        documents = [self.tokenize(text) for text in texts]
+        n_documents = len(documents)
+        if n_documents == 0:
+            return np.zeros(0)
+
+        lengths = np.fromiter((len(d) for d in documents), dtype=np.int64,
+                              count=n_documents)
+        tokens = [token for document in documents for token in document]
+        document_of = np.repeat(np.arange(n_documents), lengths)
+
+        word_ids = self.vocabulary.get_indexer(tokens)
+        known = word_ids >= 0
+
+        # texts with negations or modifiers need the sequential rules
+        is_negation = self._negations.get_indexer(tokens) >= 0
+        is_modifier = np.zeros(len(tokens), dtype=bool)
+        is_modifier[known] = self.is_modifier[word_ids[known]]
+        sequential = np.bincount(document_of,
+                                 weights=is_negation | is_modifier,
+                                 minlength=n_documents) > 0
+
+        # everything else is the mean polarity of its known words
+        counts = sparse.csr_matrix(
+            (np.ones(known.sum()),
+             (document_of[known], word_ids[known])),
+            shape=(n_documents, len(self.vocabulary)))
+        totals = counts @ self.polarity
+        n_known = np.bincount(document_of[known], minlength=n_documents)
+        polarities = totals / np.maximum(n_known, 1)
+
+        for i in np.flatnonzero(sequential):
+            polarities[i] = self._sequential_polarity(documents[i])
+
+        polarities[np.abs(polarities) < TOLERANCE] = 0.0
+        return polarities
+
+    def _sequential_polarity(self, words):
+        """Scores a tokenized text with pattern's assessment rules: a
+        modifier scales the next known word, and a negation flips and
+        halves it.
+        """
+        assessments = []
+        modifier = None
+        negation = None
+
+        for word in words:
+            i = self._index.get(word)
+            if i is not None:
+                if modifier is None:
+                    assessments.append([self.polarity[i],
+                                        self.intensity[i], 1])
+                else:
+                    last = assessments[-1]
+                    last[0] = max(-1.0, min(self.polarity[i] * last[1],
+                                            1.0))
+                    last[1] = self.intensity[i]
+                if negation is not None:
+                    assessments[-1][1] = 1.0 / assessments[-1][1]
+                    assessments[-1][2] = -1
+
+                modifier = None
+                negation = None
+                if self.is_modifier[i]:
+                    modifier = word
+                if word in NEGATIONS:
+                    negation = word
+            else:
+                if word in NEGATIONS:
+                    negation = word
+                elif negation and len(word.strip("'")) > 1:
+                    negation = None
+
+                if negation is not None and modifier is not None and \
+                        modifier.endswith('ly'):
+                    assessments[-1][2] = -1
+                    negation = None
+                elif modifier and len(word) > 2:
+                    modifier = None
+
+        total = 0
+        for polarity, _, negated in assessments:
+            total += polarity * -0.5 if negated < 0 else polarity
+
+        return total / float(len(assessments) or 1)
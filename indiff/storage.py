@@ -0,0 +1,657 @@
+"""Module contains the storage backends of the feature pipeline.
+
+The pipeline reads and writes collections through a small part of the
+pymongo API: find and find_one with equality, $in, $nin, $ne, $exists and
+$gt, $gte, $lt and $lte filters on (dotted) fields, inclusion projections
+and sorts, the counts,
+create_index, drop and bulk_write with InsertOne, ReplaceOne, UpdateOne
+($set, $push, $inc) and DeleteMany. A storage hands out collections by name.
+
+MongoStorage keeps using MongoDB. MemoryStorage holds every collection in
+memory, loaded from a dump written by dump_collections, and answers
+equality and $in queries on indexed fields from hash indexes. Medium topics
+then run without a server, at memory speed.
+
+    storage = MemoryStorage.from_dump('data/interim/twitt_anniv/dump')
+    tweets = storage['twitt_anniv']
+    tweets.find({'author_id': user_id})
+"""
+
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from numbers import Number
+from operator import ge, gt, le, lt
+from pathlib import Path
+
+import pymongo
+from bson import ObjectId, json_util
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+# fields the pipeline looks documents up by
+DEFAULT_INDEXES = ('id', 'author_id', 'user.id_str', 'username',
+                   'responder_id')
+
+DUMP_EXTENSION = '.jsonl'
+
+_MISSING = object()
+
+_COMPARISONS = {'$gt': gt, '$gte': ge, '$lt': lt, '$lte': le}
+
+
+def _get(document, field):
+    """ Value of a dotted field, _MISSING if the document has none """
+    value = document
+    for part in field.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _equals(value, expected):
+    if value is _MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _compares(value, compare, argument):
+    """ Whether a value, or an element of an array value, compares to the
+    argument as MongoDB does: only values of the same type are compared """
+    if value is _MISSING:
+        return False
+    rank, key = _sort_key(argument)
+    values = value if isinstance(value, list) else [value]
+    for item in values:
+        item_rank, item_key = _sort_key(item)
+        if item_rank == rank and compare(item_key, key):
+            return True
+    return False
+
+
+def _matches_condition(value, condition):
+    if not (isinstance(condition, dict) and condition and
+            all(key.startswith('$') for key in condition)):
+        return _equals(value, condition)
+
+    for operator, argument in condition.items():
+        if operator == '$in':
+            if not any(_equals(value, expected) for expected in argument):
+                return False
+        elif operator == '$nin':
+            if any(_equals(value, expected) for expected in argument):
+                return False
+        elif operator == '$exists':
+            if (value is not _MISSING) != bool(argument):
+                return False
+        elif operator == '$ne':
+            if _equals(value, argument):
+                return False
+        elif operator in _COMPARISONS:
+            if not _compares(value, _COMPARISONS[operator], argument):
+                return False
+        else:
+            raise ValueError(f'unsupported query operator: {operator}')
+    return True
+
+
+def matches(document, filter):
+    """ Whether a document matches a query filter """
+    return all(_matches_condition(_get(document, field), condition)
+               for field, condition in (filter or {}).items())
+
+
+def _set_projected(projected, document, parts):
+    """ Copies a dotted field of document into projected, keeping only the
+    field inside embedded documents """
+    head, rest = parts[0], parts[1:]
+    if not isinstance(document, dict) or head not in document:
+        return
+    if not rest:
+        projected[head] = document[head]
+    elif isinstance(document[head], dict):
+        _set_projected(projected.setdefault(head, {}), document[head], rest)
+
+
+def _project(document, projection):
+    if not projection:
+        return document
+
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    included = [field for field, keep in projection.items()
+                if keep and field != '_id']
+    keep_id = projection.get('_id', 1)
+    if not included:
+        projected = {field: value for field, value in document.items()
+                     if projection.get(field, 1)}
+    else:
+        projected = {}
+        if keep_id and '_id' in document:
+            projected['_id'] = document['_id']
+        for field in included:
+            _set_projected(projected, document, field.split('.'))
+
+    if not keep_id:
+        projected.pop('_id', None)
+    return projected
+
+
+# MongoDB orders values of different types by type first
+_TYPE_ORDER = ((type(None), 0), (Number, 1), (str, 2), (dict, 3),
+               (list, 4), (bytes, 5), (ObjectId, 6), (datetime, 8))
+
+
+def _sort_key(value):
+    if value is _MISSING:
+        value = None
+    # bool is a Number, so it is checked first
+    if isinstance(value, bool):
+        return (7, value)
+    for type_, rank in _TYPE_ORDER:
+        if isinstance(value, type_):
+            if rank in (0, 3, 4):
+                return (rank, str(value))
+            return (rank, value)
+    return (9, str(value))
+
+
+def _sort_fields(key_or_list, direction=1):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction)]
+    return list(key_or_list)
+
+
+def _copy(value):
+    """ Copy of a document. Documents only nest dicts and lists; every other
+    BSON value is immutable, so this is faster than copy.deepcopy. """
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _index_key(value):
+    """ Hash index keys of a field value: each element of an array, none
+    for a missing field, which indexes leave out """
+    if value is _MISSING:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class MemoryCursor(object):
+    """ Cursor over the documents a MemoryCollection query matched """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self._iterator = None
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = iter(self.documents)
+        return next(self._iterator)
+
+    def sort(self, key_or_list, direction=1):
+        # stable sorts, last key first, give a multi-key sort
+        for field, field_direction in reversed(_sort_fields(key_or_list,
+                                                            direction)):
+            self.documents.sort(
+                key=lambda document: _sort_key(_get(document, field)),
+                reverse=field_direction < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self.documents = self.documents[:n]
+        return self
+
+    def close(self):
+        pass
+
+
+def write_arguments(request):
+    """ Filter, document and upsert flag of a pymongo write operation
+
+    pymongo's operations have no public accessors for what they write, so
+    they are read from its private attributes here, and only here.
+
+    Arguments:
+        request {InsertOne|ReplaceOne|UpdateOne|DeleteOne|DeleteMany} --
+        write operation
+
+    Raises:
+        ValueError -- if the installed pymongo stores them elsewhere
+
+    Returns:
+        tuple -- filter, document and upsert flag, None, None and False
+        for those the operation does not take
+    """
+    try:
+        if isinstance(request, InsertOne):
+            return None, request._doc, False
+        if isinstance(request, (DeleteOne, DeleteMany)):
+            return request._filter, None, False
+        return request._filter, request._doc, request._upsert
+    except AttributeError as error:
+        raise ValueError(f'unsupported pymongo write operation: {error}')
+
+
+class MemoryCollection(object):
+    """In-memory collection with hash indexes.
+
+    Documents are kept in insertion order, which is the order queries
+    return them in, as MongoDB's natural order. Equality and $in queries on
+    an indexed field only look at the documents the index maps the values
+    to; any other query scans the collection.
+
+    Arguments:
+        name {str} -- collection name
+
+    Keyword Arguments:
+        copy_documents {bool} -- return copies of stored documents, so
+        callers may modify what they read. Turn off for speed when nothing
+        modifies documents it reads (default: {True})
+    """
+
+    def __init__(self, name, copy_documents=True):
+        self.name = name
+        self.copy_documents = copy_documents
+        self._documents = []
+        self._ids = {}
+        # field -> index key -> positions of the documents
+        self._indexes = {}
+        # field -> positions of documents with values an index cannot hold
+        self._unindexed = {}
+        self.n_calls = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return (document for document in self._documents
+                if document is not None)
+
+    def _index_add(self, position, document):
+        for field, index in self._indexes.items():
+            for key in _index_key(_get(document, field)):
+                if _hashable(key):
+                    index[key].add(position)
+                else:
+                    self._unindexed[field].add(position)
+
+    def _index_remove(self, position, document):
+        for field, index in self._indexes.items():
+            for key in _index_key(_get(document, field)):
+                if _hashable(key) and key in index:
+                    positions = index[key]
+                    positions.discard(position)
+                    if not positions:
+                        del index[key]
+            self._unindexed[field].discard(position)
+
+    def create_index(self, keys, **kwargs):
+        """ Builds a hash index on the first field of keys """
+        field = _sort_fields(keys)[0][0]
+        if field not in self._indexes:
+            self._indexes[field] = defaultdict(set)
+            self._unindexed[field] = set()
+            for position, document in enumerate(self._documents):
+                if document is not None:
+                    for key in _index_key(_get(document, field)):
+                        if _hashable(key):
+                            self._indexes[field][key].add(position)
+                        else:
+                            self._unindexed[field].add(position)
+        return f'{field}_1'
+
+    def _candidates(self, filter):
+        """ Positions of the documents that may match, in natural order """
+        for field, condition in (filter or {}).items():
+            if field == '_id':
+                values = None
+                if isinstance(condition, dict) and list(condition) == ['$in']:
+                    values = condition['$in']
+                elif not isinstance(condition, dict):
+                    values = [condition]
+                if values is not None and all(map(_hashable, values)):
+                    return sorted({self._ids[value] for value in values
+                                   if value in self._ids})
+
+            if field not in self._indexes:
+                continue
+
+            if isinstance(condition, dict) and list(condition) == ['$in']:
+                values = condition['$in']
+            elif isinstance(condition, (dict, list)):
+                continue
+            else:
+                values = [condition]
+            # documents missing the field match None but are not indexed
+            if not all(map(_hashable, values)) or None in values:
+                continue
+
+            index = self._indexes[field]
+            positions = set(self._unindexed[field])
+            for value in values:
+                positions.update(index.get(value, ()))
+            return sorted(positions)
+
+        return range(len(self._documents))
+
+    def _find(self, filter):
+        for position in self._candidates(filter):
+            document = self._documents[position]
+            if document is not None and matches(document, filter):
+                yield position, document
+
+    def _output(self, document, projection):
+        document = _project(document, projection)
+        if self.copy_documents:
+            document = _copy(document)
+        return document
+
+    def find(self, filter=None, projection=None, sort=None, limit=0,
+             **kwargs):
+        """ Returns a cursor over the documents matching filter. Options
+        only meaningful to a server, such as no_cursor_timeout, are
+        ignored. """
+        self.n_calls += 1
+        documents = [document for _, document in self._find(filter)]
+        cursor = MemoryCursor(documents)
+        if sort:
+            cursor.sort(sort)
+        cursor.limit(limit)
+        cursor.documents = [self._output(document, projection)
+                            for document in cursor.documents]
+        return cursor
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        if sort:
+            documents = self.find(filter, projection, sort=sort,
+                                  limit=1).documents
+            return documents[0] if documents else None
+
+        self.n_calls += 1
+        for _, document in self._find(filter):
+            return self._output(document, projection)
+        return None
+
+    def count_documents(self, filter, **kwargs):
+        self.n_calls += 1
+        return sum(1 for _ in self._find(filter))
+
+    def estimated_document_count(self, **kwargs):
+        self.n_calls += 1
+        return len(self)
+
+    def drop(self):
+        self.n_calls += 1
+        self._documents = []
+        self._ids = {}
+        for field in self._indexes:
+            self._indexes[field] = defaultdict(set)
+            self._unindexed[field] = set()
+
+    def _insert(self, document):
+        document = _copy(document)
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        if document['_id'] in self._ids:
+            raise DuplicateKeyError(
+                f'duplicate key in {self.name}: {document["_id"]!r}')
+
+        position = len(self._documents)
+        self._documents.append(document)
+        self._ids[document['_id']] = position
+        self._index_add(position, document)
+        return document['_id']
+
+    def _store(self, position, document):
+        old = self._documents[position]
+        self._index_remove(position, old)
+        document = _copy(document)
+        document['_id'] = old['_id']
+        self._documents[position] = document
+        self._index_add(position, document)
+
+    def _delete(self, position):
+        document = self._documents[position]
+        self._index_remove(position, document)
+        del self._ids[document['_id']]
+        self._documents[position] = None
+
+    @staticmethod
+    def _upserted(filter):
+        """ Document an upsert inserts: the filter's equality fields """
+        return {field: condition for field, condition in filter.items()
+                if '.' not in field and not (
+                    isinstance(condition, dict) and
+                    any(key.startswith('$') for key in condition))}
+
+    @staticmethod
+    def _apply_update(document, update):
+        document = _copy(document)
+        for operator, fields in update.items():
+            for field, value in fields.items():
+                if operator == '$set':
+                    document[field] = value
+                elif operator == '$inc':
+                    document[field] = document.get(field, 0) + value
+                elif operator == '$push':
+                    values = [value]
+                    if isinstance(value, dict) and '$each' in value:
+                        values = value['$each']
+                    document.setdefault(field, []).extend(values)
+                else:
+                    raise ValueError(
+                        f'unsupported update operator: {operator}')
+        return document
+
+    def insert_one(self, document):
+        self.n_calls += 1
+        return self._insert(document)
+
+    def insert_many(self, documents, ordered=True):
+        self.n_calls += 1
+        return [self._insert(document) for document in documents]
+
+    def replace_one(self, filter, replacement, upsert=False):
+        self.bulk_write([ReplaceOne(filter, replacement, upsert=upsert)])
+
+    def update_one(self, filter, update, upsert=False):
+        self.bulk_write([UpdateOne(filter, update, upsert=upsert)])
+
+    def delete_many(self, filter):
+        self.bulk_write([DeleteMany(filter)])
+
+    def bulk_write(self, requests, ordered=True):
+        """ Applies pymongo InsertOne, ReplaceOne, UpdateOne, DeleteOne and
+        DeleteMany operations in order """
+        self.n_calls += 1
+        for request in requests:
+            filter, document, upsert = write_arguments(request)
+
+            if isinstance(request, InsertOne):
+                self._insert(document)
+            elif isinstance(request, (ReplaceOne, UpdateOne)):
+                found = next(self._find(filter), None)
+                if isinstance(request, ReplaceOne):
+                    new = document
+                    base = found[1] if found else self._upserted(filter)
+                    if '_id' in base:
+                        new = dict(document, _id=base['_id'])
+                else:
+                    new = self._apply_update(
+                        found[1] if found else self._upserted(filter),
+                        document)
+
+                if found is not None:
+                    self._store(found[0], new)
+                elif upsert:
+                    self._insert(new)
+            elif isinstance(request, (DeleteOne, DeleteMany)):
+                positions = [position for position, _ in self._find(filter)]
+                if isinstance(request, DeleteOne):
+                    positions = positions[:1]
+                for position in positions:
+                    self._delete(position)
+            else:
+                raise ValueError(
+                    f'unsupported write: {type(request).__name__}')
+
+    def load(self, path):
+        """ Appends the documents of a dump file """
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    self._insert(json_util.loads(line))
+
+
+class MemoryStorage(object):
+    """In-memory database: collections are created on first use, as in
+    MongoDB.
+
+    Keyword Arguments:
+        name {str} -- database name (default: {'memory'})
+        copy_documents {bool} -- see MemoryCollection (default: {True})
+        indexes {tuple} -- fields every collection is hash indexed on
+        (default: {DEFAULT_INDEXES})
+    """
+
+    def __init__(self, name='memory', copy_documents=True,
+                 indexes=DEFAULT_INDEXES):
+        self.name = name
+        self.copy_documents = copy_documents
+        self.indexes = indexes
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            collection = MemoryCollection(
+                name, copy_documents=self.copy_documents)
+            for field in self.indexes:
+                collection.create_index(field)
+            self.collections[name] = collection
+        return self.collections[name]
+
+    def list_collection_names(self):
+        return list(self.collections)
+
+    @property
+    def n_calls(self):
+        """ Number of collection method calls made so far """
+        return sum(collection.n_calls
+                   for collection in self.collections.values())
+
+    @classmethod
+    def from_dump(cls, path, **kwargs):
+        """Loads every collection of a dump directory.
+
+        Arguments:
+            path {str} -- directory written by dump_collections
+
+        Returns:
+            MemoryStorage -- storage holding the dumped collections
+        """
+        storage = cls(**kwargs)
+        for dump_path in sorted(Path(path).glob('*' + DUMP_EXTENSION)):
+            logging.info(f'loading "{dump_path}"')
+            storage[dump_path.name[:-len(DUMP_EXTENSION)]].load(dump_path)
+        return storage
+
+    def close(self):
+        pass
+
+
+class MongoStorage(object):
+    """MongoDB database, as the pipeline has always used.
+
+    Collections are plain pymongo collections.
+
+    Arguments:
+        database {Database} -- pymongo database
+
+    Keyword Arguments:
+        client {MongoClient} -- client closed by close (default: {None})
+    """
+
+    def __init__(self, database, client=None):
+        self.database = database
+        self.client = client
+        self.name = database.name
+
+    def __getitem__(self, name):
+        return self.database[name]
+
+    def list_collection_names(self):
+        return self.database.list_collection_names()
+
+    @classmethod
+    def connect(cls, db_name, host='localhost', port=27017, appname=None):
+        """Connects to a database that must already exist.
+
+        Raises:
+            ValueError -- the server has no such database
+        """
+        client = pymongo.MongoClient(host=host, port=port, appname=appname)
+        if db_name not in client.list_database_names():
+            client.close()
+            raise ValueError(f"Database does not exist: {db_name}.")
+        return cls(client[db_name], client=client)
+
+    def database_storage(self, db_name):
+        """ Another database of the same server """
+        return MongoStorage(self.client[db_name])
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+
+def dump_collection(collection, path):
+    """ Writes every document of a collection to a JSON lines file, keeping
+    BSON types such as dates and ObjectIds """
+    tmp_path = str(path) + '.tmp'
+    cursor = collection.find({}, no_cursor_timeout=True)
+    try:
+        with open(tmp_path, 'w') as f:
+            for document in cursor:
+                f.write(json_util.dumps(document))
+                f.write('\n')
+    finally:
+        cursor.close()
+    os.replace(tmp_path, path)
+
+
+def dump_collections(database, names, path):
+    """Dumps collections to a directory MemoryStorage.from_dump reads.
+
+    Arguments:
+        database {Database} -- database the collections are in
+        names {list} -- collection names
+        path {str} -- dump directory
+    """
+    os.makedirs(path, exist_ok=True)
+    for name in names:
+        logging.info(f'dumping {name}')
+        dump_collection(database[name],
+                        os.path.join(path, name + DUMP_EXTENSION))
@@ -1,4 +1,3 @@
-import datetime
 import logging
 from itertools import count
 
@@ -7,7 +6,8 @@ import tweepy
 from pymongo.errors import DuplicateKeyError
 import json
 
-from indiff.utils import sentiment, split_text
+from indiff.cache import get_text_cache
+from indiff.utils import parse_created_at
 
 
 def auth(consumer_key, consumer_secret, access_token, access_token_secret):
@@ -22,7 +22,190 @@ def auth(consumer_key, consumer_secret, access_token, access_token_secret):
         retry_errors=set([401, 404, 500, 503]))
 
 
+def _is_missing(value):
+    """ Whether a stored field holds no data (missing, NaN or 'None') """
+    return not value or isinstance(value, float) or value == 'None'
+
+
+def _loads(value):
+    """ Parses fields stored as a JSON string, as in event tweets """
+    if isinstance(value, str):
+        return json.loads(value.replace('\'', '\"'))
+    return value
+
+
+class ParsedTweet(object):
+    """Typed fields of a raw tweet document, parsed once.
+
+    Reads both the v1 (retweeted_status, user) and v2 (referenced_tweets,
+    author_id) document formats. The values match the corresponding Tweet
+    properties.
+
+    Arguments:
+        document {dict} -- raw tweet document
+    """
+
+    __slots__ = ('id', 'owner_id', 'created_at', 'kind', 'original_id',
+                 'retweeted_ids', 'quoted_ids', 'is_response', 'mentions',
+                 'hashtags', 'urls', 'media', 'errors')
+
+    def __init__(self, document):
+        # malformed JSON strings only fail when the fields they hold are
+        # used, as they did before tweets were parsed up front
+        self.errors = {}
+
+        self.id = document.get('id')
+        try:
+            self.owner_id = self._parse_owner_id(document)
+        except ValueError as error:
+            self.owner_id = None
+            self.errors['owner_id'] = error
+        self.created_at = parse_created_at(document.get('created_at'))
+
+        references = self._parse_references(document)
+        self.retweeted_ids = tuple(id_ for type_, id_ in references
+                                   if type_ == 'retweeted')
+        self.quoted_ids = tuple(id_ for type_, id_ in references
+                                if type_ == 'quoted')
+        try:
+            self.original_id = self._parse_original_id(document, references)
+        except ValueError as error:
+            self.original_id = None
+            self.errors['original_id'] = error
+
+        if self.retweeted_ids:
+            self.kind = 'retweet'
+        elif self.quoted_ids:
+            self.kind = 'quote'
+        elif 'in_reply_to_user_id' in document:
+            self.kind = 'reply'
+        else:
+            self.kind = 'tweet'
+        self.is_response = self.kind != 'tweet'
+
+        try:
+            self._parse_entities(document)
+        except ValueError as error:
+            self.mentions = self.hashtags = self.urls = None
+            self.errors.update(mentions=error, hashtags=error, urls=error)
+        try:
+            self._parse_attachments(document)
+        except ValueError as error:
+            self.media = None
+            self.errors['media'] = error
+
+    @staticmethod
+    def _parse_owner_id(document):
+        if 'author_id' in document:
+            return document['author_id']
+
+        if 'user' in document:
+            user = document['user']
+            if isinstance(user, str) and not user == 'None':
+                user = _loads(user)
+            if isinstance(user, dict):
+                return user['id_str']
+
+        return None
+
+    @staticmethod
+    def _parse_references(document):
+        """ (type, id) pairs of referenced_tweets, up to any malformed
+        entry """
+        references = []
+        if 'referenced_tweets' in document:
+            # Wrap in try in case of weird formatting
+            try:
+                for referenced in document['referenced_tweets']:
+                    references.append((referenced['type'],
+                                       referenced.get('id')))
+            except TypeError:
+                pass
+        return references
+
+    @staticmethod
+    def _parse_original_id(document, references):
+        for type_, id_ in references:
+            if type_ in ('retweeted', 'quoted', 'replied_to'):
+                return id_
+
+        # For old tweet format
+        if 'in_reply_to_status_id_str' in document:
+            replied_to = document['in_reply_to_status_id_str']
+            if isinstance(replied_to, str) and not replied_to == 'None':
+                return replied_to
+
+        if 'retweeted_status' in document:
+            retweeted_status = document['retweeted_status']
+            if isinstance(retweeted_status, str) and \
+                    not retweeted_status == 'None':
+                retweeted_status = _loads(retweeted_status)
+            if isinstance(retweeted_status, dict):
+                return retweeted_status
+
+        if 'quoted_status' in document:
+            quoted_status = document['quoted_status']
+            if isinstance(quoted_status, str) and not quoted_status == 'None':
+                quoted_status = _loads(quoted_status)
+            if isinstance(quoted_status, dict):
+                return quoted_status
+
+        return None
+
+    def _parse_entities(self, document):
+        entities = document.get('entities', {})
+        if _is_missing(entities):
+            # Tweet.hashtags and Tweet.urls return the missing value itself
+            self.mentions = []
+            self.hashtags = entities
+            self.urls = entities
+        else:
+            # Entities are stored as a JSON string for event tweets
+            entities = _loads(entities)
+
+            mentions = entities.get('mentions', [])
+            if not _is_missing(mentions):
+                self.mentions = [mention['username'] for mention in mentions]
+            else:
+                self.mentions = []
+
+            self.hashtags = []
+            for hashtag in entities.get('hashtags', []):
+                # Might be two different property names, for some reason
+                if 'tag' in hashtag:
+                    self.hashtags.append(hashtag['tag'])
+                elif 'text' in hashtag:
+                    self.hashtags.append(hashtag['text'])
+
+            self.urls = entities.get('urls', [])
+
+    def _parse_attachments(self, document):
+        attachments = document.get('attachments', {})
+        if _is_missing(attachments):
+            # Tweet.media returns the missing value itself
+            self.media = attachments
+        else:
+            self.media = _loads(attachments).get('media_keys', [])
+
+    def entity(self, name):
+        """ Returns a parsed field, raising the error its JSON failed to
+        parse with if any """
+        if name in self.errors:
+            raise self.errors[name]
+        return getattr(self, name)
+
+
+# every top-level field a Tweet reads, as a find projection
+TWEET_PROJECTION = {field: 1 for field in (
+    'id', 'author_id', 'user', 'created_at', 'text', 'full_text',
+    'referenced_tweets', 'in_reply_to_user_id', 'in_reply_to_status_id_str',
+    'retweeted_status', 'quoted_status', 'entities', 'attachments',
+    'public_metrics', 'sentiment_label')}
+
+
 class Tweet(object):
+    __slots__ = ('_tweet', '_parsed')
+
     counter = 0
 
     def __init__(self, status_json):
@@ -46,6 +229,18 @@ class Tweet(object):
             raise TypeError(
                 "Expected a dict but got {}.".format(type(value)))
         self._tweet = value
+        self._parsed = None
+
+    @property
+    def parsed(self):
+        """The tweet's fields, parsed from the document on first use
+
+        Returns:
+            ParsedTweet -- typed fields of this tweet
+        """
+        if self._parsed is None:
+            self._parsed = ParsedTweet(self._tweet)
+        return self._parsed
 
     @property
     def id(self):
@@ -56,7 +251,7 @@ class Tweet(object):
                 for this Tweet
         """
 
-        return self.tweet['id']
+        return self.parsed.id
 
     @property
     def text(self):
@@ -73,24 +268,12 @@ class Tweet(object):
 
     @property
     def created_at(self):
-        """[summary]
+        """Creation time of the tweet
 
         Returns:
-            [type] -- [description]
+            datetime -- naive UTC datetime, None if it could not be parsed
         """
-        date = self.tweet['created_at']
-        if isinstance(date, datetime.datetime):
-            return date
-
-        try:
-            return datetime.datetime.strptime(str(date), "%a %b %d %H:%M:%S %z %Y")
-        except:
-            pass
-
-        try:
-            return datetime.datetime.strptime(str(date), "%Y-%m-%d %H:%M:%S")
-        except:
-            pass
+        return self.parsed.created_at
 
     @property
     def keywords(self):
@@ -101,7 +284,7 @@ class Tweet(object):
         """
 
         # todo: consider returning a generator instead?
-        return split_text(self.text)
+        return get_text_cache().keywords(self.text)
 
     @property
     def users_mentioned(self):
@@ -115,19 +298,7 @@ class Tweet(object):
             [type] -- [description]
         """
 
-        entities = self.tweet.get('entities', {})
-        if not entities or isinstance(entities, float) or entities == 'None':
-            return []
-
-        # Entities are stored as a JSON string for event tweets
-        if isinstance(entities, str):
-            entities = json.loads(entities.replace('\'', '\"'))
-
-        users_mentions = entities.get('mentions', [])
-        if users_mentions and not isinstance(users_mentions, float) and not users_mentions == 'None':
-            return list([mention['username'] for mention in users_mentions])
-
-        return []
+        return list(self.parsed.entity('mentions'))
 
     @property
     def owner_description(self):
@@ -147,19 +318,9 @@ class Tweet(object):
             [type] -- [description]
         """
 
-        if 'author_id' in self.tweet:
-            return self.tweet['author_id']
+        return self.parsed.entity('owner_id')
 
-        if 'user' in self.tweet:
-            user = self.tweet['user']
-            if isinstance(user, str) and not user == 'None':
-                user = json.loads(user.replace('\'', '\"'))
-            if isinstance(user, dict):
-                return user['id_str']
-
-        return None
-
-    def original_owner_id(self, tweet_collection):
+    def original_owner_id(self, tweet_collection, owner_resolver=None):
         """ this method should be called if the tweet is either a retweet or
         quoted.
 
@@ -175,33 +336,25 @@ class Tweet(object):
         Arguments:
             user_id {[type]} -- [description]
             tweet {[type]} -- [description]
+
+        Keyword Arguments:
+            owner_resolver {OwnerResolver} -- resolves referenced tweets
+            from prefetched batches instead of one query each
+            (default: {None})
         """
 
-        if self.is_retweeted_tweet:
-            if 'referenced_tweets' in self.tweet:
-                # Wrap in try in case of weird formatting
-                try:
-                    for referenced in self.tweet['referenced_tweets']:
-                        if referenced['type'] == 'retweeted':
-                            # TODO Expand data collection to find these
-                            tweet_ = tweet_collection.find_one({"id": referenced['id']})
-                            if tweet_:
-                                return tweet_['author_id']
-                except TypeError:
-                    pass
-
-        if self.is_quoted_tweet:
-            if 'referenced_tweets' in self.tweet:
-                # Wrap in try in case of weird formatting
-                try:
-                    for referenced in self.tweet['referenced_tweets']:
-                        if referenced['type'] == 'quoted':
-                            # TODO Expand data collection to find thse
-                            tweet_ = tweet_collection.find_one({"id": referenced['id']})
-                            if tweet_:
-                                return tweet_['author_id']
-                except TypeError:
-                    pass
+        parsed = self.parsed
+
+        # TODO Expand data collection to find these
+        for referenced_id in parsed.retweeted_ids + parsed.quoted_ids:
+            if owner_resolver is not None:
+                owner_id = owner_resolver.owner(referenced_id)
+                if owner_id is not OwnerResolver.MISSING:
+                    return owner_id
+            else:
+                tweet_ = tweet_collection.find_one({"id": referenced_id})
+                if tweet_:
+                    return tweet_['author_id']
 
         # For old tweet format
         if 'retweeted_status' in self.tweet:
@@ -212,46 +365,13 @@ class Tweet(object):
         if 'in_reply_to_user_id' in self.tweet:
             return self.tweet['in_reply_to_user_id']
 
-        return self.owner_id
+        return parsed.entity('owner_id')
 
     @property
     def original_tweet_id(self):
         """ Returns the original id this tweet is in response to """
 
-        # Wrap in try in case of weird formatting
-        try:
-            if 'referenced_tweets' in self.tweet:
-                for referenced in self.tweet['referenced_tweets']:
-                    if referenced['type'] == 'retweeted':
-                        return referenced['id']
-                    if referenced['type'] == 'quoted':
-                        return referenced['id']
-                    if referenced['type'] == 'replied_to':
-                        return referenced['id']
-        except TypeError:
-            pass
-
-        # For old tweet format
-        if 'in_reply_to_status_id_str' in self.tweet:
-            replied_to = self.tweet['in_reply_to_status_id_str']
-            if isinstance(replied_to, str) and not replied_to == 'None':
-                return replied_to
-
-        if 'retweeted_status' in self.tweet:
-            retweeted_status = self.tweet['retweeted_status']
-            if isinstance(retweeted_status, str) and not retweeted_status == 'None':
-                retweeted_status = json.loads(retweeted_status.replace('\'', '\"'))
-            if isinstance(retweeted_status, dict):
-                return retweeted_status
-            
-        if 'quoted_status' in self.tweet:
-            quoted_status = self.tweet['quoted_status']
-            if isinstance(quoted_status, str) and not quoted_status == 'None':
-                quoted_status = json.loads(quoted_status.replace('\'', '\"'))
-            if isinstance(quoted_status, dict):
-                return quoted_status
-
-        return None
+        return self.parsed.entity('original_id')
 
     @property
     def is_retweeted_tweet(self):
@@ -261,15 +381,7 @@ class Tweet(object):
             [type] -- [description]
         """
 
-        if 'referenced_tweets' in self.tweet:
-            # Wrap in try in case of weird formatting
-            try:
-                for referenced in self.tweet['referenced_tweets']:
-                    if referenced['type'] == 'retweeted':
-                        return True
-            except TypeError:
-                pass
-        return False
+        return self.parsed.kind == 'retweet'
 
     @property
     def is_quoted_tweet(self):
@@ -279,30 +391,13 @@ class Tweet(object):
             [type] -- [description]
         """
 
-        if 'referenced_tweets' in self.tweet:
-            # Wrap in try in case of weird formatting
-            try:
-                for referenced in self.tweet['referenced_tweets']:
-                    if referenced['type'] == 'quoted':
-                        return True
-            except TypeError:
-                pass
-        return False
+        return len(self.parsed.quoted_ids) > 0
 
     @property
     def is_response_tweet(self):
         """ Determines whther this tweet is a response (retweet, quote, or reply) """
 
-        if self.is_retweeted_tweet:
-            return True
-
-        if self.is_quoted_tweet:
-            return True
-
-        if 'in_reply_to_user_id' in self.tweet:
-            return True
-
-        return False
+        return self.parsed.is_response
 
     @property
     def hashtags(self):
@@ -312,24 +407,7 @@ class Tweet(object):
             [type] -- [description]
         """
 
-        entities = self.tweet.get('entities', {})
-        if not entities or isinstance(entities, float) or entities == 'None':
-            return entities
-
-        if isinstance(entities, str):
-            entities = json.loads(entities.replace('\'', '\"'))
-
-        hashtags = entities.get('hashtags', [])
-
-        text_tags = []
-        for hashtag in hashtags:
-            # Might be two different property names, for some reason
-            if 'tag' in hashtag:
-                text_tags.append(hashtag['tag'])
-            elif 'text' in hashtag:
-                text_tags.append(hashtag['text'])
-
-        return text_tags
+        return self.parsed.entity('hashtags')
 
     @property
     def urls(self):
@@ -339,16 +417,7 @@ class Tweet(object):
             [type] -- [description]
         """
 
-        entities = self.tweet.get('entities', {})
-        if not entities or isinstance(entities, float) or entities == 'None':
-            return entities
-
-        if isinstance(entities, str):
-            entities = json.loads(entities.replace('\'', '\"'))
-
-        urls = entities.get('urls', [])
-
-        return urls
+        return self.parsed.entity('urls')
 
     @property
     def media(self):
@@ -358,16 +427,7 @@ class Tweet(object):
             [type] -- [description]
         """
 
-        attachments = self.tweet.get('attachments', {})
-        if not attachments or isinstance(attachments, float) or attachments == 'None':
-            return attachments
-
-        if isinstance(attachments, str):
-            attachments = json.loads(attachments.replace('\'', '\"'))
-
-        media = attachments.get('media_keys', [])
-
-        return media
+        return self.parsed.entity('media')
 
     @property
     def retweet_count(self):
@@ -403,7 +463,7 @@ class Tweet(object):
             [type] -- [description]
         """
 
-        return True if len(self.users_mentioned) > 0 else False
+        return True if len(self.parsed.entity('mentions')) > 0 else False
 
     @property
     def is_favourited(self):
@@ -424,6 +484,23 @@ class Tweet(object):
 
         return True if metrics['like_count'] else False
 
+    @property
+    def sentiment(self):
+        """Sentiment label of the tweet's text.
+
+        Uses the label stored on the document by the sentiment scoring stage
+        when available, and scores the text otherwise.
+
+        Returns:
+            String -- 'positive', 'neutral' or 'negative'
+        """
+
+        label = self.tweet.get('sentiment_label')
+        if label is not None:
+            return label
+
+        return get_text_cache().sentiment(self.text)
+
     @property
     def is_positive_sentiment(self):
         """[summary]
@@ -432,7 +509,7 @@ class Tweet(object):
             [type] -- [description]
         """
 
-        d = sentiment(self.text)
+        d = self.sentiment
         return True if d == 'positive' else False
 
     @property
@@ -443,10 +520,9 @@ class Tweet(object):
             [type] -- [description]
         """
 
-        d = sentiment(self.text)
+        d = self.sentiment
         return True if d == 'negative' else False
 
-
     @property
     def owner_followers_count(self):
         """[summary]
@@ -495,6 +571,63 @@ class Tweet(object):
         return None
 
 
+class OwnerResolver(object):
+    """Resolves referenced tweet ids to their authors with batched queries.
+
+    Ids are looked up with chunked $in queries and kept in an id -> author
+    map for the rest of the run, so resolving the owners of a batch of
+    tweets takes one query per chunk_size referenced tweets instead of one
+    each.
+
+    Arguments:
+        tweet_collection {collection} -- tweets referenced tweets are
+        looked up in
+
+    Keyword Arguments:
+        chunk_size {int} -- ids per $in query (default: {1000})
+    """
+
+    # author of a tweet that is not in the collection
+    MISSING = object()
+
+    def __init__(self, tweet_collection, chunk_size=1000):
+        self.tweet_collection = tweet_collection
+        self.chunk_size = chunk_size
+        self.owners = {}
+        self.n_queries = 0
+
+    def prefetch_ids(self, tweet_ids):
+        """ Resolves the authors of tweet ids not resolved yet """
+        tweet_ids = [id_ for id_ in dict.fromkeys(tweet_ids)
+                     if id_ not in self.owners]
+
+        for i in range(0, len(tweet_ids), self.chunk_size):
+            chunk = tweet_ids[i:i + self.chunk_size]
+            query = {'id': {'$in': chunk}}
+            found = {}
+            for tweet_ in self.tweet_collection.find(
+                    query, {'id': 1, 'author_id': 1}):
+                found.setdefault(tweet_['id'], tweet_['author_id'])
+            self.n_queries += 1
+
+            for id_ in chunk:
+                self.owners[id_] = found.get(id_, self.MISSING)
+
+    def prefetch(self, tweets):
+        """ Resolves the authors of every tweet retweeted or quoted by
+        tweets """
+        self.prefetch_ids(referenced_id for tweet in tweets
+                          for referenced_id in tweet.parsed.retweeted_ids +
+                          tweet.parsed.quoted_ids)
+
+    def owner(self, tweet_id):
+        """Returns the author of a tweet, MISSING if it is not in the
+        collection"""
+        if tweet_id not in self.owners:
+            self.prefetch_ids([tweet_id])
+        return self.owners[tweet_id]
+
+
 def get_user_tweets_in_network(api=None, users=None, collection=None,
                                n_tweets=5000):
     """Fetches users' tweets into database.
@@ -2,14 +2,19 @@
 From reading a file from a csv_file to building a graph.
 """
 
+import calendar
 import datetime
+import hashlib
 import os
 import pickle
 import random
 import re
 import string
+from functools import lru_cache
 from itertools import count
+from multiprocessing import Pool
 
+import numpy as np
 import pandas as pd
 from nltk.corpus import stopwords
 from nltk.tokenize import TweetTokenizer
@@ -18,41 +23,127 @@ from textblob import TextBlob
 
 
 def get_keywords_from_file(keywords_file):
-    """[summary]
+    """Reads topic keywords, one per line. Each lowercased line is kept
+    whole as a keyword, without its trailing newline.
 
     Arguments:
-        keywords_file {[type]} -- [description]
+        keywords_file {str} -- path to the keywords file
 
     Returns:
-        [type] -- [description]
+        set -- keywords
     """
     keywords = set()
 
     with open(keywords_file, 'r') as f:
         for line in f:
-            keywords.add(line.lower())
+            keywords.add(line.rstrip('\n').lower())
 
     return keywords
 
 
-def split_text(tweet_text):
-    # this is probably where you are going to do the whole word frequency thing
-    tokenizer = TweetTokenizer(strip_handles=True)
-    pattern_1 = r'https?://[^\s<>"]+|www\.[^\s<>"]+|\S+@\S+'
-    pattern_2 = r'\w+'
+class KeywordExtractor(object):
+    """Extracts the keywords of tweets.
+
+    The tokenizer, patterns and stopwords are loaded once and reused for
+    every text.
+
+    Keyword Arguments:
+        stop_words {iterable} -- words to drop, NLTK's English stopwords and
+        'rt' if None (default: {None})
+    """
+
+    LINK_PATTERN = r'https?://[^\s<>"]+|www\.[^\s<>"]+|\S+@\S+'
+    WORD_PATTERN = r'\w+'
+
+    def __init__(self, stop_words=None):
+        if stop_words is None:
+            stop_words = stopwords.words('english') + ['rt']
+
+        self.tokenizer = TweetTokenizer(strip_handles=True)
+        self.link_pattern = re.compile(self.LINK_PATTERN)
+        self.word_pattern = re.compile(self.WORD_PATTERN)
+        self.stop_words = frozenset(stop_words)
+
+        # identifies what extract returns, so cached keywords of another
+        # configuration are never reused
+        config = '\n'.join([self.LINK_PATTERN, self.WORD_PATTERN,
+                            str(self.tokenizer.strip_handles),
+                            *sorted(self.stop_words)])
+        self.version = hashlib.sha1(config.encode('utf-8')).hexdigest()[:12]
+
+    def extract(self, text):
+        """Returns the distinct keywords of one text.
+
+        Links, e-mail addresses, handles, punctuation and stopwords are
+        dropped and the remaining tokens are lower-cased.
+
+        Arguments:
+            text {str} -- tweet text
+
+        Returns:
+            list -- keywords in the text
+        """
+        tokens = set(self.tokenizer.tokenize(text))
+        no_links = {token.lower() for token in tokens
+                    if not self.link_pattern.match(token)}
+        final = {token for token in no_links
+                 if self.word_pattern.match(token) and
+                 token not in self.stop_words}
+
+        return list(final)
+
+    def extract_many(self, texts, workers=None, chunksize=1000):
+        """Returns the keywords of many texts, in order.
+
+        Arguments:
+            texts {iterable} -- tweet texts
+
+        Keyword Arguments:
+            workers {int} -- number of processes, extracts in this process if
+            None or 1 (default: {None})
+            chunksize {int} -- texts sent to a process at a time
+            (default: {1000})
+
+        Returns:
+            list -- keywords of each text
+        """
+        if workers is None or workers <= 1:
+            return [self.extract(text) for text in texts]
+
+        # workers extract with this extractor's stop words, not the defaults
+        with Pool(processes=workers, initializer=_init_keyword_worker,
+                  initargs=(sorted(self.stop_words),)) as pool:
+            return pool.map(_extract_keywords, texts, chunksize=chunksize)
+
+
+_keyword_extractor = None
+
+
+def keyword_extractor():
+    """Returns the shared keyword extractor, loading it on first use"""
+    global _keyword_extractor
+
+    if _keyword_extractor is None:
+        _keyword_extractor = KeywordExtractor()
+    return _keyword_extractor
 
-    prog_1 = re.compile(pattern_1)
-    prog_2 = re.compile(pattern_2)
 
-    tokens = set(tokenizer.tokenize(tweet_text))
-    no_links = {token.lower() for token in tokens if not prog_1.match(token)}
-    no_pun = {token for token in no_links if prog_2.match(token)}
-    final = {token for token in no_pun if token not in stopwords.words(
-        'english') + ['rt']}
+def _init_keyword_worker(stop_words):
+    """ Pool initializer: makes the worker's shared keyword extractor use
+    stop_words """
+    global _keyword_extractor
 
+    _keyword_extractor = KeywordExtractor(stop_words=stop_words)
+
+
+def _extract_keywords(text):
+    return keyword_extractor().extract(text)
+
+
+def split_text(tweet_text):
     # returns a list of keywords in one message
     # consider return a generator maybe?
-    return list(final)
+    return keyword_extractor().extract(tweet_text)
 
 
 def clean_tweet(tweet):
@@ -61,21 +152,101 @@ def clean_tweet(tweet):
     using simple regex statements.
     '''
     return ' '.join(re.sub(r"(@[A-Za-z0-9]+)|([^0-9A-Za-z \t])|(\w+:\/\/\S+)",
-                           " ", tweet))
+                           " ", tweet).split())
 
 
-def sentiment(tweet):
+# Engines available to score sentiment: TextBlob scores one text at a time,
+# the lexicon engine scores batches with indiff.lexicon.LexiconSentiment
+SENTIMENT_ENGINES = ('textblob', 'lexicon')
+
+_sentiment_engine = 'textblob'
+_lexicon_sentiment = None
+
+
+def set_sentiment_engine(engine):
+    """Selects the engine used by sentiment, sentiment_polarity and
+    sentiment_polarities.
+
+    Arguments:
+        engine {str} -- one of SENTIMENT_ENGINES
+    """
+    global _sentiment_engine
+
+    if engine not in SENTIMENT_ENGINES:
+        raise ValueError(f'Unknown sentiment engine: {engine}. '
+                         f'Expected one of {SENTIMENT_ENGINES}.')
+    _sentiment_engine = engine
+
+
+def get_sentiment_engine():
+    return _sentiment_engine
+
+
+def lexicon_sentiment():
+    """Returns the shared batch lexicon scorer, loading it on first use"""
+    global _lexicon_sentiment
+
+    if _lexicon_sentiment is None:
+        from indiff.lexicon import LexiconSentiment
+        _lexicon_sentiment = LexiconSentiment()
+    return _lexicon_sentiment
+
+
+def sentiment_polarity(tweet):
+    """Scores the polarity of a tweet's text.
+
+    Arguments:
+        tweet {str} -- tweet text
+
+    Returns:
+        float -- polarity in [-1.0, 1.0]
+    """
+    if _sentiment_engine == 'lexicon':
+        return float(lexicon_sentiment().polarity_of(tweet))
+
     # create TextBlob object of passed tweet text
     analysis = TextBlob(clean_tweet(tweet))
-    # set sentiment
-    if analysis.sentiment.polarity > 0:
+    return analysis.sentiment.polarity
+
+
+def sentiment_polarities(tweets):
+    """Scores the polarity of many tweets at once.
+
+    Arguments:
+        tweets {iterable} -- tweet texts
+
+    Returns:
+        ndarray -- polarity of each tweet in [-1.0, 1.0]
+    """
+    if _sentiment_engine == 'lexicon':
+        return lexicon_sentiment().polarities(tweets)
+
+    return np.array([sentiment_polarity(tweet) for tweet in tweets],
+                    dtype=np.float64)
+
+
+def sentiment_label(polarity):
+    """Maps a polarity score to a positive, neutral or negative label"""
+    if polarity > 0:
         return 'positive'
-    elif analysis.sentiment.polarity == 0:
+    elif polarity == 0:
         return 'neutral'
     else:
         return 'negative'
 
 
+def sentiment_labels(polarities):
+    """Vectorised sentiment_label"""
+    polarities = np.asarray(polarities, dtype=np.float64)
+    return np.where(polarities > 0, 'positive',
+                    np.where(polarities == 0, 'neutral', 'negative'))
+
+
+def sentiment(tweet):
+    # set sentiment
+    return sentiment_label(sentiment_polarity(tweet))
+
+
 def save_trace(trace_obj, filepath):
     """ Construct a save as from the filepath to the csv used to prepare data
     """
@@ -160,3 +331,123 @@ def construct_datetime_from_str(s):
         s = s.split('/')
 
     return datetime.datetime(int(s[0]), int(s[1]), int(s[2]))
+
+
+TWITTER_DATE_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+EVENT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_TWITTER_DATE = re.compile(r'[A-Za-z]{3} ([A-Za-z]{3}) (\d{1,2}) '
+                           r'(\d{1,2}):(\d{1,2}):(\d{1,2}) '
+                           r'([+-])(\d{2})(\d{2}) (\d{4})$')
+_EVENT_DATE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2}) (\d{1,2}):(\d{1,2}):'
+                         r'(\d{1,2})$')
+_MONTHS = {month.lower(): number
+           for number, month in enumerate(calendar.month_abbr) if month}
+
+
+def created_at_format(date):
+    """Detects the format of a stored created_at string without trying to
+    parse it.
+
+    Arguments:
+        date {str} -- created_at value
+
+    Returns:
+        str -- TWITTER_DATE_FORMAT, EVENT_DATE_FORMAT or None if neither
+    """
+    if _TWITTER_DATE.match(date):
+        return TWITTER_DATE_FORMAT
+    if _EVENT_DATE.match(date):
+        return EVENT_DATE_FORMAT
+    return None
+
+
+def _valid_date(year, month, day, hour, minute, second):
+    return (1 <= year and 1 <= month <= 12 and
+            1 <= day <= calendar.monthrange(year, month)[1] and
+            hour < 24 and minute < 60 and second < 60)
+
+
+@lru_cache(maxsize=2 ** 16)
+def _parse_created_at_str(date):
+    match = _TWITTER_DATE.match(date)
+    if match is not None:
+        month = _MONTHS.get(match.group(1).lower())
+        day, hour, minute, second = (int(v) for v in match.group(2, 3, 4, 5))
+        sign, offset_hours, offset_minutes, year = match.group(6, 7, 8, 9)
+        year = int(year)
+        if month is None or \
+                not _valid_date(year, month, day, hour, minute, second):
+            return None
+
+        offset = datetime.timedelta(hours=int(offset_hours),
+                                    minutes=int(offset_minutes))
+        if sign == '-':
+            offset = -offset
+        return datetime.datetime(year, month, day, hour, minute,
+                                 second) - offset
+
+    match = _EVENT_DATE.match(date)
+    if match is not None:
+        fields = tuple(int(v) for v in match.groups())
+        if _valid_date(*fields):
+            return datetime.datetime(*fields)
+
+    return None
+
+
+def parse_created_at(date):
+    """Normalises a tweet's created_at to a naive UTC datetime.
+
+    Accepts datetimes (aware ones are converted to UTC) and strings in the
+    Twitter API format ("Wed Oct 10 20:19:24 +0000 2018") or the event
+    tweets format ("2018-10-10 20:19:24"). Strings are parsed once and
+    cached, since the same tweets are read for many users.
+
+    Arguments:
+        date {object} -- stored created_at value
+
+    Returns:
+        datetime -- naive UTC datetime, None if the value is not a date
+    """
+    if isinstance(date, datetime.datetime):
+        if date.tzinfo is not None:
+            date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return date
+
+    if isinstance(date, str):
+        return _parse_created_at_str(date)
+
+    return None
+
+
+def parse_created_at_many(dates):
+    """Vectorised parse_created_at for a column of created_at values.
+
+    Arguments:
+        dates {iterable} -- stored created_at values, in any mix of formats
+
+    Returns:
+        DatetimeIndex -- naive UTC datetimes, NaT where a value is not a date
+    """
+    dates = pd.Series(list(dates), dtype=object)
+    parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    if dates.empty:
+        return pd.DatetimeIndex(parsed)
+
+    is_datetime = dates.map(lambda d: isinstance(d, datetime.datetime))
+    if is_datetime.any():
+        parsed[is_datetime] = pd.to_datetime(
+            list(dates[is_datetime]), utc=True).tz_localize(None)
+
+    is_str = dates.map(lambda d: isinstance(d, str))
+    strings = dates[is_str].astype(str)
+    for format_, pattern in ((TWITTER_DATE_FORMAT, _TWITTER_DATE),
+                             (EVENT_DATE_FORMAT, _EVENT_DATE)):
+        matches = strings[strings.str.match(pattern.pattern)]
+        if not matches.empty:
+            parsed[matches.index] = pd.to_datetime(
+                matches, format=format_, errors='coerce',
+                utc=True).dt.tz_localize(None)
+
+    return pd.DatetimeIndex(parsed)
@@ -0,0 +1,131 @@
+"""Module contains a buffer that batches writes to a collection.
+"""
+
+import logging
+import time
+
+from pymongo import DeleteMany, InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import InvalidDocument
+
+
+class WriteBuffer(object):
+    """Collects write operations for a collection and sends them as unordered
+    bulk writes.
+
+    A batch rejected because a document cannot be encoded or is too large
+    is split in halves and each half sent again, until the operations at
+    fault are isolated and dropped, as the per-document writes it replaces
+    did. A rejected batch may already be partly applied, so buffered
+    operations must be idempotent: replaces, deletes and $set updates, not
+    inserts, $push or $inc.
+
+    Operations in a batch may be applied in any order, so they must not
+    depend on each other. Call flush before reading what was written.
+
+    Arguments:
+        collection {collection} -- collection written to
+
+    Keyword Arguments:
+        batch_size {int} -- operations per bulk write (default: {1000})
+        logger {Logger} -- logger for errors and statistics (default: {None})
+        flush_first {tuple} -- buffers flushed before each flush of this
+        one, whose writes must not land after this buffer's
+        (default: {()})
+    """
+
+    def __init__(self, collection, batch_size=1000, logger=None,
+                 flush_first=()):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.logger = logger or logging.getLogger(__name__)
+        self.flush_first = flush_first
+        self.requests = []
+        self.n_written = 0
+        self.n_invalid = 0
+        # seconds taken by each flush
+        self.latencies = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, request):
+        """ Buffers a pymongo write operation, flushing a full batch """
+        self.requests.append(request)
+        if len(self.requests) >= self.batch_size:
+            self.flush()
+
+    def insert(self, document):
+        self.add(InsertOne(document))
+
+    def replace(self, filter, document, upsert=True):
+        self.add(ReplaceOne(filter, document, upsert=upsert))
+
+    def update(self, filter, update, upsert=False):
+        self.add(UpdateOne(filter, update, upsert=upsert))
+
+    def delete(self, filter):
+        self.add(DeleteMany(filter))
+
+    def flush(self):
+        """ Writes every buffered operation """
+        if not self.requests:
+            return
+
+        for buffer in self.flush_first:
+            buffer.flush()
+
+        requests, self.requests = self.requests, []
+        start = time.perf_counter()
+        n_written = self._write(requests)
+        latency = time.perf_counter() - start
+
+        self.latencies.append(latency)
+        self.n_written += n_written
+        self.logger.debug(f'flushed {n_written} writes to '
+                          f'{self.collection.name} in {latency * 1000:.1f} ms')
+
+    def _write(self, requests):
+        """ Sends requests in one bulk write, splitting a batch with an
+        invalid document until the invalid operations are isolated
+
+        Returns:
+            int -- number of operations written
+        """
+        try:
+            self.collection.bulk_write(requests, ordered=False)
+        except InvalidDocument as err:
+            # DocumentTooLarge is an InvalidDocument too
+            if len(requests) == 1:
+                self.n_invalid += 1
+                self.logger.error('found an invalid document')
+                self.logger.error(err)
+                return 0
+
+            middle = len(requests) // 2
+            return (self._write(requests[:middle]) +
+                    self._write(requests[middle:]))
+
+        return len(requests)
+
+    def stats(self):
+        """Returns counters describing the writes made so far"""
+        n_flushes = len(self.latencies)
+        mean = sum(self.latencies) / n_flushes if n_flushes else 0
+        return {'collection': self.collection.name,
+                'writes': self.n_written,
+                'invalid': self.n_invalid,
+                'flushes': n_flushes,
+                'mean_latency_ms': mean * 1000,
+                'max_latency_ms': max(self.latencies, default=0) * 1000}
+
+    def log_stats(self):
+        self.logger.info('writes to {collection}: {writes} operations in '
+                         '{flushes} flushes, {mean_latency_ms:.1f} ms mean / '
+                         '{max_latency_ms:.1f} ms max per flush, {invalid} '
+                         'invalid documents'.format(**self.stats()))
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+
+from indiff import utils
+from indiff.benchmarks.pipeline import create_indexes
+from indiff.data import make_features
+from indiff.data.make_synthetic import KEYWORDS, generate_topic, load_topic
+from indiff.features import build_features
+from indiff.features.follow_graph import FollowGraph
+from indiff.features.user_features import compute_user_feature_matrix
+from indiff.storage import MemoryStorage
+
+TOPIC = 'synthetic'
+
+
+def build_topic(n_users=40, tweets_per_user=6, avg_following=4, seed=1,
+                storage=None):
+    """ Generates a small synthetic topic into a storage, a new MemoryStorage
+    if None, and runs the make_features stages before the edge features on
+    it """
+    collections, network = generate_topic(
+        n_users=n_users, tweets_per_user=tweets_per_user,
+        avg_following=avg_following, seed=seed)
+    if storage is None:
+        storage = MemoryStorage()
+    load_topic(storage, TOPIC, collections)
+    create_indexes(storage, TOPIC)
+
+    keywords = utils.keyword_extractor().extract_many(KEYWORDS)
+    keywords = set(keyword for line in keywords for keyword in line)
+
+    user_ids = list(network.nodes)
+    collection = lambda suffix: storage[TOPIC + suffix]
+    make_features.process_user_attribs(
+        users=user_ids, tweet_collection=collection(''),
+        event_collection=collection('-event_tweets'),
+        tweet_mentions_collection=collection('-mentions'),
+        users_collection=collection('-users'),
+        retweet_collection=collection('-retweets'),
+        replies_collection=collection('-replies'),
+        user_attribs_collection=collection('-user-attribs'),
+        responses_collection=collection('-responses'))
+    make_features.process_event_table(collection('-event_tweets'),
+                                      collection('-event-table'))
+
+    return SimpleNamespace(
+        storage=storage, topic=TOPIC, collections=collections,
+        network=network, user_ids=user_ids, edges=list(network.edges),
+        keywords=keywords, collection=collection,
+        event_table=build_features.load_event_table(
+            collection('-event-table')),
+        follow_graph=FollowGraph.from_users(collection('-users')),
+        user_features=compute_user_feature_matrix(
+            collection('-user-attribs'), keywords, user_ids=user_ids))
+
+
+@pytest.fixture(scope='session')
+def topic():
+    """ Processed synthetic topic, shared by the tests that only read it """
+    return build_topic()
+
+
+@pytest.fixture
+def fresh_topic():
+    """ Processed synthetic topic a test may modify """
+    return build_topic()
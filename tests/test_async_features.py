@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+
+from indiff.data import make_features
+from indiff.features import async_features, build_features
+
+
+@pytest.mark.parametrize('prefetched', [False, True])
+def test_engine_rows_match_calculate_network_diffusion(topic, prefetched):
+    edges = topic.edges[:60]
+    expected = build_features.calculate_network_diffusion(
+        edges, topic.keywords,
+        **make_features.edge_collections(topic.storage, topic.storage,
+                                         topic.topic),
+        user_features=topic.user_features)
+
+    # the engine prefetches event tweets and users unless given the event
+    # table and follow graph
+    kwargs = {}
+    if prefetched:
+        kwargs = {'event_table': topic.event_table,
+                  'follow_graph': topic.follow_graph}
+    chunks = async_features.network_diffusion_chunks(
+        [edges[:25], edges[25:]], topic.keywords, None, None, topic.topic,
+        user_features=topic.user_features, concurrency=8,
+        storage=topic.storage, **kwargs)
+    rows = [row for chunk in chunks for row in chunk]
+
+    pd.testing.assert_frame_equal(pd.DataFrame(rows),
+                                  pd.DataFrame(list(expected)))
@@ -0,0 +1,54 @@
+from indiff.cache import LRUCache, UserAttribsCache, sizeof
+from indiff.storage import MemoryStorage
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.evictions == 1
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_byte_cap_evicts_until_under_the_cap():
+    documents = {key: {'_id': key, 'text': key * 100} for key in 'abcd'}
+    size = sizeof(documents['a'])
+    cache = LRUCache(maxsize=100, max_bytes=2 * size)
+    for key, document in documents.items():
+        cache.put(key, document)
+
+    assert list(cache._entries) == ['c', 'd']
+    assert cache.nbytes == 2 * size
+    assert cache.evictions == 2
+
+    # replacing an entry releases its old size
+    cache.put('d', {'_id': 'd'})
+    assert cache.nbytes == size + sizeof({'_id': 'd'})
+
+
+def test_entry_larger_than_the_cap_is_kept_alone():
+    cache = LRUCache(maxsize=100, max_bytes=10)
+    cache.put('a', 'a' * 100)
+    cache.put('b', 'b' * 100)
+
+    assert list(cache._entries) == ['b']
+
+
+def test_user_attribs_are_fetched_once():
+    collection = MemoryStorage()['user-attribs']
+    collection.insert_one({'_id': '1', 'name': 'a'})
+    attribs = UserAttribsCache(collection)
+
+    for _ in range(3):
+        assert attribs.find_one({'_id': '1'}) == {'_id': '1', 'name': 'a'}
+    assert attribs.find_one({'_id': '2'}) is None
+    # other queries are passed through
+    assert attribs.find_one({'name': 'a'})['_id'] == '1'
+
+    assert (attribs.cache.hits, attribs.cache.misses) == (2, 2)
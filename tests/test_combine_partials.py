@@ -0,0 +1,28 @@
+import pandas as pd
+
+from indiff.data.combine_partials import combine
+
+
+class FrameCollector(object):
+    """ Writer keeping the frames combine appends """
+
+    def __init__(self):
+        self.frames = []
+
+    def write_frame(self, df):
+        self.frames.append(df)
+
+
+def test_combine_keeps_the_first_row_of_each_edge():
+    first = pd.DataFrame({'src_id': ['1', '1', '2'],
+                          'dest_id': ['2', '2', '3'], 'value': [0, 1, 2]})
+    second = pd.DataFrame({'src_id': pd.Categorical(['2', '3', '12']),
+                           'dest_id': pd.Categorical(['3', '1', '3']),
+                           'value': [3, 4, 5]})
+    empty = first.iloc[:0]
+
+    writer = FrameCollector()
+    n_rows = combine([('a', first), ('b', empty), ('c', second)], writer)
+
+    assert n_rows == 4
+    assert pd.concat(writer.frames)['value'].tolist() == [0, 2, 4, 5]
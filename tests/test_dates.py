@@ -0,0 +1,36 @@
+import datetime
+
+import pandas as pd
+
+from indiff import utils
+
+UTC = datetime.timezone.utc
+EXPECTED = datetime.datetime(2018, 10, 10, 20, 19, 24)
+DATES = ['Wed Oct 10 20:19:24 +0000 2018',
+         'Wed Oct 10 22:19:24 +0200 2018',
+         '2018-10-10 20:19:24',
+         datetime.datetime(2018, 10, 10, 20, 19, 24),
+         datetime.datetime(2018, 10, 10, 15, 19, 24,
+                           tzinfo=datetime.timezone(
+                               datetime.timedelta(hours=-5)))]
+
+
+def test_created_at_formats_normalise_to_naive_utc():
+    for date in DATES:
+        parsed = utils.parse_created_at(date)
+        assert parsed == EXPECTED
+        assert parsed.tzinfo is None
+
+    for date in (None, 1539202764, 'yesterday', ''):
+        assert utils.parse_created_at(date) is None
+
+
+def test_parse_created_at_many_matches_parse_created_at():
+    dates = DATES + [None, 'yesterday', 1539202764]
+    parsed = utils.parse_created_at_many(dates)
+
+    expected = pd.DatetimeIndex(
+        [utils.parse_created_at(date) or pd.NaT for date in dates],
+        dtype='datetime64[ns]')
+    pd.testing.assert_index_equal(parsed, expected)
+    assert utils.parse_created_at_many([]).empty
@@ -0,0 +1,13 @@
+from indiff.features import build_features
+
+
+def test_expanded_tweets_keep_order(topic):
+    # chunked $in lookups yield what one find_one per id would
+    tweets = topic.collection('')
+    ids = [tweet['id'] for tweet in topic.collections[''][:9]]
+    ids = ids[::-1] + ['missing'] + ids[:3]
+
+    expanded = build_features.expanded_tweets(ids, tweets, chunk_size=4)
+    expected = [tweets.find_one({'id': id_}) for id_ in ids]
+    assert [tweet.id for tweet in expanded] == \
+        [tweet['id'] for tweet in expected if tweet is not None]
@@ -0,0 +1,25 @@
+import os
+
+import pandas as pd
+
+from indiff.data import make_features
+from indiff.data.feature_sink import ID_COLUMNS, ParquetFeatureSink
+
+
+def test_parquet_feature_sink_round_trips_rows(topic, tmp_path):
+    collections = make_features.edge_collections(topic.storage,
+                                                 topic.storage, topic.topic)
+    rows = list(make_features.edge_chunk_rows(
+        topic.edges[:30], topic.keywords, collections, topic.user_features))
+
+    path = str(tmp_path / 'dataset1.parquet')
+    with ParquetFeatureSink(path, batch_size=7) as sink:
+        sink.write_rows(rows)
+
+    written = pd.read_parquet(path)
+    for name in ID_COLUMNS:
+        written[name] = written[name].astype(str)
+    # ratios and averages are stored as float32
+    pd.testing.assert_frame_equal(written, pd.DataFrame(rows),
+                                  check_dtype=False, rtol=1e-6)
+    assert not os.path.exists(path + '.tmp')
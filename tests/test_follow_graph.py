@@ -0,0 +1,18 @@
+import numpy as np
+
+from indiff.features.follow_graph import FollowGraph
+
+
+def test_follow_graph_round_trips(topic, tmp_path):
+    # network edges go from each user to their followers
+    path = str(tmp_path / 'follow_graph')
+    topic.follow_graph.save(path)
+    graph = FollowGraph.load(path)
+
+    followed, followers = zip(*topic.edges)
+    assert graph.follows_many(followers, followed).all()
+    assert all(graph.follows(follower, user)
+               for user, follower in topic.edges)
+    assert graph.n_edges == topic.network.number_of_edges()
+    assert not graph.follows(topic.user_ids[0], 'unknown')
+    assert np.array_equal(graph.numbers(['unknown']), [-1])
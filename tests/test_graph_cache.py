@@ -0,0 +1,66 @@
+import os
+
+import networkx as nx
+
+from indiff.data import make_features
+from indiff.storage import MemoryStorage
+
+
+def users_collection():
+    users = MemoryStorage()['users']
+    users.insert_many([{'id': '1', 'following_ids': ['2']},
+                       {'id': '2', 'following_ids': []},
+                       {'id': '3', 'following_ids': ['1', '2']}])
+    return users
+
+
+def write_network(path):
+    path.write_text('1,2,4\n2,3\n4,1\n5\n')
+    return str(path)
+
+
+def test_filter_graph_removes_users_missing_from_the_database():
+    graph = nx.DiGraph([('1', '2'), ('1', '4'), ('2', '3'), ('4', '1')])
+    graph.add_node('5')
+    make_features.filter_graph(graph, users_collection())
+
+    assert sorted(graph.nodes) == ['1', '2', '3']
+    assert sorted(graph.edges) == [('1', '2'), ('2', '3')]
+
+
+def test_filtered_graph_cache_is_keyed_by_user_ids(tmp_path, monkeypatch):
+    network = write_network(tmp_path / 'network.csv')
+    cache_dir = str(tmp_path / 'cache')
+    users = users_collection()
+
+    graph = make_features.load_filtered_graph(network, users, cache_dir)
+    assert sorted(graph.edges) == [('1', '2'), ('2', '3')]
+
+    # unchanged data is read from the cache
+    def fail(*args, **kwargs):
+        raise AssertionError('graph filtered again')
+    monkeypatch.setattr(make_features, 'filter_graph', fail)
+    cached = make_features.load_filtered_graph(network, users, cache_dir)
+    assert list(cached.edges) == list(graph.edges)
+    monkeypatch.undo()
+
+    # a user changing id in place invalidates it
+    users.update_one({'id': '3'}, {'$set': {'id': '4'}})
+    graph = make_features.load_filtered_graph(network, users, cache_dir)
+    assert sorted(graph.edges) == [('1', '2'), ('1', '4'), ('4', '1')]
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_follow_graph_cache_follows_following_updates(tmp_path):
+    users = users_collection()
+    cache_dir = str(tmp_path)
+
+    path = make_features.follow_graph_cache_path(users, cache_dir)
+    assert make_features.follow_graph_cache_path(users, cache_dir) == path
+    assert make_features.load_follow_graph(users, path).follows('1', '2')
+
+    users.update_one({'id': '1'}, {'$set': {'following_ids': ['3']}})
+    updated = make_features.follow_graph_cache_path(users, cache_dir)
+    assert updated != path
+    graph = make_features.load_follow_graph(users, updated)
+    assert graph.follows('1', '3') and not graph.follows('1', '2')
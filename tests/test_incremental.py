@@ -0,0 +1,143 @@
+import pytest
+
+from indiff.benchmarks.pipeline import create_indexes
+from indiff.data import make_features
+from indiff.data.make_synthetic import generate_topic, load_topic
+from indiff.storage import MemoryStorage
+
+TOPIC = 'synthetic'
+
+
+def process_user_attribs(storage, user_ids, incremental=False):
+    collection = lambda suffix: storage[TOPIC + suffix]
+    make_features.process_user_attribs(
+        users=user_ids, tweet_collection=collection(''),
+        event_collection=collection('-event_tweets'),
+        tweet_mentions_collection=collection('-mentions'),
+        users_collection=collection('-users'),
+        retweet_collection=collection('-retweets'),
+        replies_collection=collection('-replies'),
+        user_attribs_collection=collection('-user-attribs'),
+        responses_collection=collection('-responses'),
+        incremental=incremental)
+
+
+def documents(collection, key):
+    """ A collection's documents without _id if generated, in key order """
+    found = []
+    for document in collection.find({}):
+        if not isinstance(document['_id'], str):
+            del document['_id']
+        found.append(document)
+    return sorted(found, key=key)
+
+
+def normalized_attribs(storage):
+    attribs = documents(storage[TOPIC + '-user-attribs'],
+                        key=lambda document: document['_id'])
+    for document in attribs:
+        # tweets are folded in collection order, which differs between a
+        # full and an incremental run
+        for field in ('mentioned_in', 'keywords_in_all_my_tweets'):
+            document[field] = sorted(document[field])
+        # marks are _ids, which differ between storages
+        for field in (make_features.TWEETS_MARK, make_features.MENTIONS_MARK):
+            del document[field]
+    return attribs
+
+
+def responses(storage):
+    return documents(storage[TOPIC + '-responses'],
+                     key=lambda entry: (entry['responder_id'], entry['rank']))
+
+
+def load(collections, tweets=None):
+    storage = MemoryStorage()
+    if tweets is not None:
+        collections = dict(collections, **{'': tweets})
+    load_topic(storage, TOPIC, collections)
+    create_indexes(storage, TOPIC)
+    return storage
+
+
+def crash(before_mentions):
+    """ compute_mentioned_in interrupted before or after its writes """
+    compute_mentioned_in = make_features.compute_mentioned_in
+
+    def interrupted(*args, **kwargs):
+        if not before_mentions:
+            compute_mentioned_in(*args, **kwargs)
+        raise KeyboardInterrupt
+    return interrupted
+
+
+@pytest.mark.parametrize('interrupted', [None, 'before', 'after'])
+def test_incremental_run_matches_full_run(monkeypatch, interrupted):
+    collections, network = generate_topic(n_users=30, tweets_per_user=6,
+                                          avg_following=4, seed=2)
+    user_ids = list(network.nodes)
+    tweets = collections['']
+
+    full = load(collections)
+    process_user_attribs(full, user_ids)
+
+    incremental = load(collections, tweets=tweets[:len(tweets) // 2])
+    process_user_attribs(incremental, user_ids)
+    incremental[TOPIC].insert_many(tweets[len(tweets) // 2:])
+    if interrupted is not None:
+        # the attributes are written, the mentions marks not advanced
+        with monkeypatch.context() as patch:
+            patch.setattr(make_features, 'compute_mentioned_in',
+                          crash(interrupted == 'before'))
+            with pytest.raises(KeyboardInterrupt):
+                process_user_attribs(incremental, user_ids,
+                                     incremental=True)
+    process_user_attribs(incremental, user_ids, incremental=True)
+
+    assert normalized_attribs(incremental) == normalized_attribs(full)
+    assert responses(incremental) == responses(full)
+
+
+def test_users_without_new_tweets_are_skipped(fresh_topic, monkeypatch):
+    storage = fresh_topic.storage
+    expected = normalized_attribs(storage)
+
+    reads = []
+    for suffix in ('-users', '-responses', '-event_tweets', '-retweets',
+                   '-replies'):
+        collection = storage[TOPIC + suffix]
+        for method in ('find', 'find_one'):
+            monkeypatch.setattr(collection, method,
+                                lambda *args, suffix=suffix, **kwargs:
+                                reads.append(suffix))
+    process_user_attribs(storage, fresh_topic.user_ids, incremental=True)
+
+    assert reads == []
+    assert normalized_attribs(storage) == expected
+
+
+def test_incomplete_response_entries_are_rebuilt(fresh_topic):
+    storage = fresh_topic.storage
+    expected = responses(storage)
+    index = storage[TOPIC + '-responses']
+
+    complete = [entry for entry in expected
+                if entry['response_time'] is not None]
+    assert complete
+    index.update_one({'id': complete[0]['id']},
+                     {'$set': {'response_time': None,
+                               'original_author_id': None}})
+
+    # users without new tweets are skipped
+    process_user_attribs(storage, fresh_topic.user_ids, incremental=True)
+    assert responses(storage) != expected
+
+    # a new tweet that is not a response adds no entry
+    tweet = dict(storage[TOPIC].find_one(
+        {'author_id': complete[0]['responder_id'],
+         'referenced_tweets': {'$exists': False}}), id='new')
+    del tweet['_id']
+    storage[TOPIC].insert_one(tweet)
+    process_user_attribs(storage, fresh_topic.user_ids, incremental=True)
+
+    assert responses(storage) == expected
@@ -0,0 +1,17 @@
+from indiff import utils
+
+
+def test_keywords_file_lines_are_kept_whole(tmp_path):
+    path = tmp_path / 'keywords.txt'
+    path.write_text('Climate Change\nCOP26\n#NetZero')
+
+    assert utils.get_keywords_from_file(str(path)) == \
+        {'climate change', 'cop26', '#netzero'}
+
+
+def test_extract_many_matches_extract():
+    texts = ['RT @user: Climate change is real! https://t.co/x',
+             'The COP26 talks #NetZero', '']
+    extractor = utils.keyword_extractor()
+    assert extractor.extract_many(texts) == \
+        [extractor.extract(text) for text in texts]
@@ -0,0 +1,64 @@
+import glob
+import functools
+import os
+import shutil
+
+import click
+import pandas as pd
+import pytest
+
+from indiff.cache import configure_text_cache
+from indiff.data import make_features
+from indiff.data.make_synthetic import generate_topic, write_topic
+
+TOPIC = 'synthetic'
+
+
+def run_main(root, *options):
+    """ Runs make_features on a synthetic topic dumped under root and
+    returns the dataset files it wrote """
+    for path in glob.glob(str(root / 'data' / 'raw' / 'dataset*')):
+        os.remove(path)
+    # without the manifest every chunk is computed again
+    shutil.rmtree(str(root / 'data' / 'interim'), ignore_errors=True)
+    make_features.main(
+        [TOPIC, str(root / 'data' / 'raw' / TOPIC / 'keywords.txt'),
+         '--dump-dir', str(root / 'dump'), '--output-format', 'parquet',
+         *options], standalone_mode=False)
+    return {os.path.basename(path): pd.read_parquet(path) for path in
+            sorted(glob.glob(str(root / 'data' / 'raw' / 'dataset*')))}
+
+
+def test_workers_share_the_text_cache_file(tmp_path, monkeypatch):
+    collections, network = generate_topic(n_users=30, tweets_per_user=4,
+                                          avg_following=4, seed=3)
+    write_topic(TOPIC, collections, network, str(tmp_path / 'data' / 'raw'),
+                str(tmp_path / 'dump'))
+    # main finds the data directory from the module's path
+    monkeypatch.setattr(make_features, '__file__', str(
+        tmp_path / 'indiff' / 'data' / 'make_features.py'))
+    monkeypatch.setattr(make_features, 'CHUNK_SIZE', 40)
+    # workers find few texts in memory and go to the file
+    monkeypatch.setattr(make_features, 'configure_text_cache',
+                        functools.partial(configure_text_cache, maxsize=1))
+    text_cache = str(tmp_path / 'text-cache.sqlite')
+
+    serial = run_main(tmp_path)
+    parallel = run_main(tmp_path, '--workers', '2', '--text-cache',
+                        text_cache, '--checkpoint-size', '10')
+
+    assert len(serial) > 1
+    assert list(parallel) == list(serial)
+    for name, df in serial.items():
+        pd.testing.assert_frame_equal(parallel[name], df)
+    assert os.path.getsize(text_cache) > 0
+
+
+def test_workers_and_async_engine_are_rejected_together(tmp_path):
+    keywords = tmp_path / 'keywords.txt'
+    keywords.write_text('climate\n')
+
+    with pytest.raises(click.UsageError):
+        make_features.main([TOPIC, str(keywords), '--workers', '2',
+                            '--async-concurrency', '4'],
+                           standalone_mode=False)
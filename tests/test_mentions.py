@@ -0,0 +1,36 @@
+from indiff.data import make_features
+from indiff.storage import MemoryStorage
+
+MENTIONS = [{'_id': 't1', 'users': ['ann', 'bob']},
+            {'_id': 't2', 'users': ['bob', 'bob']},
+            {'_id': 't3', 'users': ['nobody']},
+            {'_id': 't4', 'users': []},
+            {'_id': 't5', 'users': ['ann']}]
+
+
+def attribs_collection():
+    storage = MemoryStorage()
+    storage['mentions'].insert_many(MENTIONS)
+    attribs = storage['user-attribs']
+    attribs.insert_many([
+        {'_id': '1', 'username': 'ann', 'mentioned_in': ['t0']},
+        {'_id': '2', 'username': 'bob', 'mentioned_in': []},
+        {'_id': '3', 'username': 'cat', 'mentioned_in': []}])
+    return storage['mentions'], attribs
+
+
+def mentioned_in(attribs):
+    return {document['username']: document['mentioned_in']
+            for document in attribs.find({})}
+
+
+def test_mentions_are_grouped_by_user_in_collection_order():
+    mentions, attribs = attribs_collection()
+    make_features.compute_mentioned_in(mentions, attribs, batch_size=1)
+
+    # one update per mention of a user with attributes, as the update per
+    # mention did
+    assert mentioned_in(attribs) == {'ann': ['t0', 't1', 't5'],
+                                     'bob': ['t1', 't2', 't2'],
+                                     'cat': []}
+    assert attribs.find_one({'username': 'nobody'}) is None
@@ -0,0 +1,89 @@
+import pandas as pd
+import pytest
+
+from conftest import build_topic
+from indiff.data import make_features
+from indiff.storage import write_arguments
+
+mongomock = pytest.importorskip('mongomock')
+
+
+class MongomockCollection(object):
+    """ A mongomock collection whose bulk writes fall back to single writes
+    when mongomock cannot build them: mongomock 4.3 rejects the sort
+    argument pymongo 4.11 and later pass for ReplaceOne and UpdateOne. It
+    does so before applying any operation of the batch. """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, requests, ordered=True):
+        try:
+            return self.collection.bulk_write(requests, ordered=ordered)
+        except TypeError:
+            pass
+        for request in requests:
+            filter, document, upsert = write_arguments(request)
+            write = {'InsertOne': lambda: self.insert_one(document),
+                     'ReplaceOne': lambda: self.replace_one(
+                         filter, document, upsert=upsert),
+                     'UpdateOne': lambda: self.update_one(
+                         filter, document, upsert=upsert),
+                     'DeleteOne': lambda: self.delete_one(filter),
+                     'DeleteMany': lambda: self.delete_many(filter)}
+            write[type(request).__name__]()
+
+
+class MongomockStorage(object):
+
+    def __init__(self):
+        self.database = mongomock.MongoClient()['indiff']
+
+    def __getitem__(self, name):
+        return MongomockCollection(self.database[name])
+
+
+def documents(collection, key):
+    """ A collection's documents without generated _ids and marks """
+    found = []
+    for document in collection.find({}):
+        if not isinstance(document['_id'], str):
+            del document['_id']
+        document.pop(make_features.TWEETS_MARK, None)
+        document.pop(make_features.MENTIONS_MARK, None)
+        found.append(document)
+    return sorted(found, key=key)
+
+
+@pytest.fixture(scope='module')
+def topics():
+    return build_topic(), build_topic(storage=MongomockStorage())
+
+
+@pytest.mark.parametrize('suffix, key', [
+    ('-user-attribs', lambda document: document['_id']),
+    ('-responses', lambda entry: (entry['responder_id'], entry['rank'])),
+    ('-mentions', lambda mention: mention['_id']),
+    ('-event-table', lambda row: row['_id'])])
+def test_process_user_attribs_matches_mongo(topics, suffix, key):
+    memory, mongo = topics
+    expected = documents(memory.collection(suffix), key)
+
+    assert expected
+    assert documents(mongo.collection(suffix), key) == expected
+
+
+def test_edge_chunk_rows_match_mongo(topics):
+    rows = []
+    for topic in topics:
+        collections = make_features.edge_collections(
+            topic.storage, topic.storage, topic.topic)
+        rows.append(pd.DataFrame(list(make_features.edge_chunk_rows(
+            topic.edges[:60], topic.keywords, collections,
+            topic.user_features, event_table=topic.event_table,
+            follow_graph=topic.follow_graph))))
+
+    pd.testing.assert_frame_equal(*rows)
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from indiff.data import make_features
+from indiff.features import build_features
+
+
+def unoptimized_rows(topic, edges):
+    """ Feature rows computed from the collections alone: no per-user
+    feature matrix, responses index, event table or follow graph """
+    collections = make_features.edge_collections(topic.storage,
+                                                 topic.storage, topic.topic)
+    del collections['responses_collection']
+    collections['node_collection'] = topic.collection('-user-attribs')
+    return build_features.calculate_network_diffusion(
+        edges, topic.keywords, **collections, additional_attr=True)
+
+
+def test_edge_chunk_rows_match_unoptimized_features(topic):
+    collections = make_features.edge_collections(topic.storage,
+                                                 topic.storage, topic.topic)
+    rows = make_features.edge_chunk_rows(
+        topic.edges, topic.keywords, collections, topic.user_features,
+        event_table=topic.event_table, follow_graph=topic.follow_graph)
+
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(list(rows)),
+        pd.DataFrame(list(unoptimized_rows(topic, topic.edges))))
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from indiff.data import make_features
+from indiff.features import build_features
+
+
+def test_response_maps_are_shared_across_chunks(topic):
+    collections = make_features.edge_collections(topic.storage,
+                                                 topic.storage, topic.topic)
+    expected = list(make_features.edge_chunk_rows(
+        topic.edges, topic.keywords, collections, topic.user_features))
+
+    response_maps = build_features.response_maps_cache()
+    rows = []
+    for start in range(0, len(topic.edges), 25):
+        rows.extend(make_features.edge_chunk_rows(
+            topic.edges[start:start + 25], topic.keywords, collections,
+            topic.user_features, response_maps=response_maps))
+
+    pd.testing.assert_frame_equal(pd.DataFrame(rows),
+                                  pd.DataFrame(expected))
+    assert response_maps.max_bytes == build_features.RESPONSE_MAPS_MAX_BYTES
+    assert 0 < response_maps.nbytes <= response_maps.max_bytes
+    # responders met in an earlier chunk are not read again
+    assert response_maps.misses == len(response_maps)
@@ -0,0 +1,15 @@
+from indiff.features import build_features
+
+
+def test_responses_index_matches_responses(topic):
+    # the index holds the entries get_responses expands to
+    for user_id in topic.user_ids:
+        expected = list(build_features.response_entries(
+            user_id, topic.collection('-user-attribs'),
+            topic.collection(''), topic.collection('-retweets'),
+            topic.collection('-replies'), topic.collection('-event_tweets')))
+        indexed = build_features.get_indexed_responses(
+            user_id, topic.collection('-responses'))
+        for entry in indexed:
+            del entry['_id']
+        assert indexed == expected
@@ -0,0 +1,91 @@
+import os
+
+from indiff.data import make_features
+from indiff.data.run_manifest import RunManifest
+
+EDGES = [(str(i), str(i + 1)) for i in range(30)]
+
+
+def test_checkpoint_tasks_only_cover_missing_ranges(tmp_path):
+    edge_chunks = [[(str(i), str(i + 1)) for i in range(chunk, chunk + 10)]
+                   for chunk in (0, 10, 20)]
+
+    def written(name):
+        path = str(tmp_path / name)
+        open(path, 'w').close()
+        return path
+
+    with RunManifest(str(tmp_path / 'manifest.sqlite')) as manifest:
+        run = manifest.begin_run(sum(edge_chunks, []), 10, 'parquet')
+        manifest.record_chunk(run, 1, 10, written('dataset1'), 1.0)
+        manifest.record_checkpoint(run, 2, 0, 4, 4, written('2-0'), 1.0)
+        manifest.record_checkpoint(run, 2, 6, 8, 2, written('2-6'), 1.0)
+        # a checkpoint whose file is gone is computed again
+        manifest.record_checkpoint(run, 3, 0, 4, 4,
+                                   str(tmp_path / 'missing'), 1.0)
+
+        tasks, pending = make_features.checkpoint_tasks(
+            manifest, run, edge_chunks, checkpoint_size=3)
+
+    assert [key for key, _ in tasks] == [
+        (2, 4, 6), (2, 8, 10), (3, 0, 3), (3, 3, 6), (3, 6, 9), (3, 9, 10)]
+    for (num, start, stop), edges in tasks:
+        assert edges == edge_chunks[num - 1][start:stop]
+    assert pending == {2: 2, 3: 4}
+
+
+def test_completed_stages_are_skipped(tmp_path):
+    calls = []
+    path = str(tmp_path / 'user-features.pickle')
+
+    def compute(stage):
+        def run():
+            calls.append(stage)
+            open(path, 'w').close()
+        return run
+
+    with RunManifest(str(tmp_path / 'manifest.sqlite')) as manifest:
+        run = manifest.begin_run(EDGES, 10, 'parquet')
+        for _ in range(2):
+            make_features.run_stage(manifest, run, 'user_attribs',
+                                    compute('user_attribs'))
+            make_features.run_stage(manifest, run, 'user_features',
+                                    compute('user_features'), path=path)
+            # stages that do not outlive the process always run
+            make_features.run_stage(manifest, run, 'event_table',
+                                    compute('event_table'), record=False)
+        assert calls == ['user_attribs', 'user_features', 'event_table',
+                         'event_table']
+
+        # a stage whose file is gone runs again
+        calls.clear()
+        os.remove(path)
+        make_features.run_stage(manifest, run, 'user_attribs',
+                                compute('user_attribs'))
+        make_features.run_stage(manifest, run, 'user_features',
+                                compute('user_features'), path=path)
+        assert calls == ['user_features']
+
+        # as do the stages of another run
+        other = manifest.begin_run(EDGES, 10, 'parquet', settings=('new',))
+        assert other != run
+        assert not manifest.stage_completed(other, 'user_attribs')
+
+
+def test_dataset_files_before_the_manifest_are_imported(tmp_path):
+    for num in (1, 3):
+        open(str(tmp_path / f'dataset{num}.h5'), 'w').close()
+    edge_chunks = [EDGES[i:i + 10] for i in range(0, 30, 10)]
+
+    with RunManifest(str(tmp_path / 'manifest.sqlite')) as manifest:
+        assert manifest.is_empty()
+        run = manifest.begin_run(EDGES, 10, 'hdf')
+        assert not manifest.is_empty()
+        make_features.import_dataset_files(manifest, run, 3,
+                                           str(tmp_path), '.h5')
+
+        tasks, pending = make_features.checkpoint_tasks(
+            manifest, run, edge_chunks, checkpoint_size=10)
+
+    assert [key for key, _ in tasks] == [(2, 0, 10)]
+    assert pending == {2: 1}
@@ -0,0 +1,23 @@
+from indiff import utils
+
+
+def test_lexicon_labels_match_textblob(topic):
+    texts = [tweet['text'] for tweet in topic.collections['']]
+    texts += ['I love this!', 'What a terrible, awful day.', 'not bad',
+              'It is a table.']
+    try:
+        textblob = utils.sentiment_labels(utils.sentiment_polarities(texts))
+        utils.set_sentiment_engine('lexicon')
+        lexicon = utils.sentiment_labels(utils.sentiment_polarities(texts))
+    finally:
+        utils.set_sentiment_engine('textblob')
+
+    assert lexicon.tolist() == textblob.tolist()
+
+
+def test_labels_keep_the_textblob_thresholds():
+    polarities = [1e-12, 0.0, -1e-12]
+    assert utils.sentiment_labels(polarities).tolist() == \
+        ['positive', 'neutral', 'negative']
+    assert [utils.sentiment_label(p) for p in polarities] == \
+        ['positive', 'neutral', 'negative']
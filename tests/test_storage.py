@@ -0,0 +1,48 @@
+from indiff.storage import MemoryStorage
+
+
+def ids(cursor):
+    return [document['_id'] for document in cursor]
+
+
+def test_indexed_queries_match_scans():
+    storage = MemoryStorage()
+    indexed, scanned = storage['indexed'], storage['scanned']
+    indexed.create_index('a')
+    documents = ([{'_id': i, 'a': i % 3} for i in range(6)] +
+                 [{'_id': 10}, {'_id': 11, 'a': None},
+                  {'_id': 12, 'a': [1, 1]}, {'_id': 13, 'a': []}])
+    for collection in (indexed, scanned):
+        collection.insert_many(documents)
+        collection.replace_one({'_id': 4}, {'a': 2})
+        collection.delete_many({'_id': 0})
+
+    for filter in ({'a': None}, {'a': 1}, {'a': 2}, {'a': {'$in': [2, None]}},
+                   {'a': {'$in': [0, 1]}}):
+        assert ids(indexed.find(filter)) == ids(scanned.find(filter))
+
+    assert ids(indexed.find({'a': None})) == [10, 11]
+    assert ids(indexed.find({'a': 2})) == [2, 4, 5]
+    assert ids(indexed.find({'a': 1})) == [1, 12]
+
+
+def test_missing_fields_are_not_indexed():
+    collection = MemoryStorage()['tweets']
+    collection.create_index('a')
+    collection.insert_many([{'_id': i} for i in range(100)])
+
+    assert not collection._indexes['a']
+    collection.replace_one({'_id': 5}, {'a': 1})
+    assert dict(collection._indexes['a']) == {1: {5}}
+
+
+def test_comparisons_match_mongo_type_brackets():
+    collection = MemoryStorage()['tweets']
+    collection.insert_many([{'_id': 1, 'a': 1}, {'_id': 2, 'a': 2.5},
+                            {'_id': 3, 'a': 'b'}, {'_id': 4, 'a': None},
+                            {'_id': 5, 'a': [0, 3]}, {'_id': 6}])
+
+    assert ids(collection.find({'a': {'$gt': 1}})) == [2, 5]
+    assert ids(collection.find({'a': {'$gte': 1, '$lt': 3}})) == [1, 2, 5]
+    assert ids(collection.find({'a': {'$lte': 'c'}})) == [3]
+    assert ids(collection.find({'_id': {'$gt': 4}})) == [5, 6]
@@ -0,0 +1,64 @@
+import pytest
+
+from indiff.storage import MemoryStorage
+from indiff.twitter import OwnerResolver, Tweet
+
+
+def test_parsed_tweet_defers_malformed_json():
+    # a malformed string only fails the fields it holds
+    tweet = Tweet({'id': '1', 'text': 'hi', 'user': "{'id_str'",
+                   'retweeted_status': '{', 'entities': '{',
+                   'created_at': '2020-01-01 10:00:00'})
+
+    assert tweet.id == '1'
+    assert tweet.created_at is not None
+    assert not tweet.is_response_tweet
+    for name in ('owner_id', 'original_tweet_id', 'hashtags',
+                 'users_mentioned'):
+        with pytest.raises(ValueError):
+            getattr(tweet, name)
+
+
+def test_parsed_tweet_reads_both_formats(topic):
+    for document in topic.collections['']:
+        tweet = Tweet(document)
+        assert tweet.owner_id == document['author_id']
+        mentions = [mention['username'] for mention in
+                    document.get('entities', {}).get('mentions', [])]
+        assert tweet.users_mentioned == mentions
+
+    tweets = topic.collection('')
+    for document in topic.collections['-retweets']:
+        tweet = Tweet(document)
+        assert tweet.owner_id == document['user']['id_str']
+        assert tweet.original_owner_id(tweets) == \
+            document['retweeted_status']['user']['id_str']
+
+
+def test_owner_resolver_falls_back_when_a_tweet_is_missing():
+    tweets = MemoryStorage()['tweets']
+    tweets.insert_many([{'id': '10', 'author_id': 'a'},
+                        {'id': '11', 'author_id': 'b'}])
+    documents = [
+        # missing retweeted tweet, then a quoted one in the collection
+        {'id': '1', 'author_id': 'c', 'referenced_tweets': [
+            {'type': 'retweeted', 'id': '99'},
+            {'type': 'quoted', 'id': '11'}]},
+        {'id': '2', 'author_id': 'c', 'in_reply_to_user_id': 'd',
+         'referenced_tweets': [{'type': 'retweeted', 'id': '98'}]},
+        {'id': '3', 'author_id': 'c',
+         'referenced_tweets': [{'type': 'retweeted', 'id': '10'}]}]
+    tweets_ = [Tweet(document) for document in documents]
+
+    resolver = OwnerResolver(tweets, chunk_size=2)
+    resolver.prefetch(tweets_)
+    assert resolver.n_queries == 2
+    assert resolver.owner('99') is OwnerResolver.MISSING
+    assert resolver.owner('10') == 'a'
+
+    expected = [tweet.original_owner_id(tweets) for tweet in tweets_]
+    assert expected == ['b', 'd', 'a']
+    assert [tweet.original_owner_id(tweets, owner_resolver=resolver)
+            for tweet in tweets_] == expected
+    # missing tweets are remembered rather than looked up again
+    assert resolver.n_queries == 2
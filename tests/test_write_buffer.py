@@ -0,0 +1,61 @@
+from pymongo.errors import DocumentTooLarge, InvalidDocument
+
+from indiff.storage import MemoryStorage, write_arguments
+from indiff.write_buffer import WriteBuffer
+
+
+class RejectingCollection(object):
+    """ Applies a batch's operations in order until one holds a document
+    marked invalid, then rejects the batch, as pymongo does when it fails to
+    encode a document after sending the ones before it """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+        self.batches = []
+
+    def bulk_write(self, requests, ordered=True):
+        self.batches.append(len(requests))
+        for request in requests:
+            _, document, _ = write_arguments(request)
+            document = document or {}
+            if 'invalid' in document:
+                raise InvalidDocument('cannot encode object')
+            if 'too_large' in document:
+                raise DocumentTooLarge('document too large')
+            self.collection.bulk_write([request])
+
+
+def test_rejected_batches_are_split_until_invalid_documents_are_dropped():
+    collection = MemoryStorage()['tweets']
+    collection.insert_one({'_id': 1, 'ids': []})
+    rejecting = RejectingCollection(collection)
+
+    with WriteBuffer(rejecting, batch_size=10) as buffer:
+        buffer.update({'_id': 1}, {'$set': {'ids': [1, 2]}})
+        buffer.replace({'_id': 2}, {'invalid': True})
+        buffer.replace({'_id': 3}, {'n': 3})
+        buffer.replace({'_id': 4}, {'too_large': True})
+        buffer.delete({'_id': 5})
+
+    assert collection.find_one({'_id': 1})['ids'] == [1, 2]
+    assert collection.find_one({'_id': 2}) is None
+    assert collection.find_one({'_id': 3}) == {'_id': 3, 'n': 3}
+    assert collection.find_one({'_id': 4}) is None
+    assert buffer.n_invalid == 2
+    assert buffer.n_written == 3
+    # the batch, its halves, then the invalid operations alone
+    assert rejecting.batches == [5, 2, 1, 1, 3, 1, 2, 1, 1]
+
+
+def test_valid_batches_are_sent_once():
+    collection = MemoryStorage()['tweets']
+    rejecting = RejectingCollection(collection)
+
+    with WriteBuffer(rejecting, batch_size=2) as buffer:
+        for i in range(5):
+            buffer.replace({'_id': i}, {'n': i})
+
+    assert collection.count_documents({}) == 5
+    assert rejecting.batches == [2, 2, 1]
+    assert (buffer.n_written, buffer.n_invalid) == (5, 0)